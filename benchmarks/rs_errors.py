@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+'''
+Time Reed-Solomon error correction for 1 to nsym/2 random symbol errors per
+codeword, comparing the python and numpy backends. For each error count it
+reports the full rs_correct_msg call and the Chien search + Forney part on
+its own (rs_find_errors followed by rs_correct_errata).
+
+With --inner it runs the inner (per strand) codes of the shipped formats
+instead, which are short GF(2^8) codewords with 2 or 3 ecc symbols.
+
+usage: PYTHONPATH=. python benchmarks/rs_errors.py [--c_exp 8] [--n 255] [--nsym 32] [--trials 20] [--inner]
+'''
+import argparse
+import time
+from random import randint, sample, seed
+
+from dnastorage.codec.reedsolomon.rs import get_reed_solomon
+
+# (formats, n, nsym) of the inner codes built by customize_RS_CFC8, where n
+# is the strand payload plus its index plus the ecc symbols
+inner_codes = [
+    ("FSMD-200", 15+1+2, 2),
+    ("RS+CFC8, RS16+CFC8", 15+3+2, 2),
+    ("FSMD-WCUT-160", 10+1+2, 2),
+    ("RS+CFC8+RE1..RE4", 9+2+3, 3),
+]
+
+def corrupt(codeword, errors, c_exp):
+    received = list(codeword)
+    for p in sample(range(len(received)), errors):
+        received[p] ^= randint(1, 2**c_exp-1)
+    return received
+
+def time_correct(rs, received, nsym):
+    t = time.perf_counter()
+    for r in received:
+        rs.rs_correct_msg(r, nsym)
+    return (time.perf_counter() - t) / len(received) * 1e6
+
+def time_chien_forney(rs, received, nsym):
+    # run the decoder up to the error locator outside of the timed region
+    prepared = []
+    for r in received:
+        synd = rs.rs_calc_syndromes(r, nsym)
+        fsynd = rs.rs_forney_syndromes(synd, [], len(r))
+        err_loc = rs.rs_find_error_locator(fsynd, nsym)
+        prepared.append((r, synd, err_loc))
+    t = time.perf_counter()
+    for r, synd, err_loc in prepared:
+        err_pos = rs.rs_find_errors(err_loc[::-1], len(r))
+        rs.rs_correct_errata(r, synd, err_pos)
+    return (time.perf_counter() - t) / len(received) * 1e6
+
+def run(c_exp, n, nsym, trials, name=None):
+    backends = { b : get_reed_solomon(c_exp=c_exp, backend=b) for b in [ "python", "numpy" ] }
+    rs = backends["python"]
+
+    if name is None:
+        print ("GF(2^{}) n={} nsym={}, microseconds per codeword".format(c_exp, n, nsym))
+    else:
+        print ("{}: GF(2^{}) n={} nsym={}, microseconds per codeword".format(name, c_exp, n, nsym))
+    print ("{:>6} {:>14} {:>14} {:>14} {:>14}".format("errors", "python total", "numpy total", "python chien", "numpy chien"))
+    for errors in range(1, nsym//2+1):
+        received = []
+        for _ in range(trials):
+            message = [ randint(0, 2**c_exp-1) for _ in range(n-nsym) ]
+            received.append(corrupt(rs.rs_encode_msg(message, nsym), errors, c_exp))
+        row = [ time_correct(backends[b], received, nsym) for b in [ "python", "numpy" ] ]
+        row += [ time_chien_forney(backends[b], received, nsym) for b in [ "python", "numpy" ] ]
+        print ("{:>6} {:>14.1f} {:>14.1f} {:>14.1f} {:>14.1f}".format(errors, *row))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reed-Solomon error correction microbenchmark")
+    parser.add_argument('--c_exp', type=int, default=8, help="field is GF(2^c_exp), 8 or 16")
+    parser.add_argument('--n', type=int, default=255, help="codeword length in symbols")
+    parser.add_argument('--nsym', type=int, default=32, help="ecc symbols per codeword")
+    parser.add_argument('--trials', type=int, default=20, help="codewords per error count")
+    parser.add_argument('--inner', action='store_true', help="time the inner codes of the shipped formats")
+    args = parser.parse_args()
+
+    seed(0)
+    if args.inner:
+        for name, n, nsym in inner_codes:
+            run(8, n, nsym, args.trials, name)
+    else:
+        run(args.c_exp, args.n, args.nsym, args.trials)
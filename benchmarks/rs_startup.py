@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+'''
+Measure how long it takes to get a usable ReedSolomon field object:
+
+  computed  -- build the log/anti-log tables from scratch (old behavior of
+               get_reed_solomon, on every call)
+  packaged  -- load the log/anti-log tables shipped in reedsolomon/tables
+  shared    -- get_reed_solomon once the process-wide object exists
+
+usage: PYTHONPATH=. python benchmarks/rs_startup.py [--repeat N]
+'''
+import argparse
+import time
+
+from dnastorage.codec.reedsolomon.rs import get_reed_solomon, packaged_table_file, _default_prims
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t
+        if best is None or t < best:
+            best = t
+    return best * 1000.0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ReedSolomon field startup benchmark")
+    parser.add_argument('--repeat', type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+
+    print ("{:>6} {:>8} {:>12} {:>12} {:>12}".format("c_exp", "backend", "computed ms", "packaged ms", "shared ms"))
+    for c_exp, prim in sorted(_default_prims.items()):
+        for backend in [ "python", "numpy" ]:
+            cls = type(get_reed_solomon(c_exp=c_exp, backend=backend))
+            table_file = packaged_table_file(c_exp, prim)
+            computed = best_of(args.repeat, lambda: cls(generator=2, c_exp=c_exp, prim=prim))
+            packaged = best_of(args.repeat, lambda: cls(generator=2, c_exp=c_exp, prim=prim, table_file=table_file))
+            shared = best_of(args.repeat, lambda: get_reed_solomon(c_exp=c_exp, backend=backend))
+            print ("{:>6} {:>8} {:>12.3f} {:>12.3f} {:>12.4f}".format(c_exp, backend, computed, packaged, shared))
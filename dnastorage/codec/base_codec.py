@@ -1,7 +1,16 @@
-from dnastorage.exceptions import AllowAll
+from dnastorage.exceptions import AllowAll, DNAStorageError
 
 class BaseCodec(object):
-    ''' Abstract Codec object to inherit to make other codecs '''
+    ''' Abstract Codec object to inherit to make other codecs
+
+        encode_batch and decode_batch work on a list of items at once and
+        give the same results as encode and decode on each item. Codecs can
+        override _encode_batch and _decode_batch with array-based versions;
+        the default ones loop over the items. When decoding a batch, an item
+        that fails with a DNAStorageError is replaced by the error, and later
+        codecs pass such errors through, so that one bad item doesn't stop
+        the rest of the batch.
+    '''
     def __init__(self,CodecObj=None,Policy=None):
         self._Obj = CodecObj
         if Policy is None:
@@ -23,3 +32,27 @@ class BaseCodec(object):
             return self._Obj.decode(s)
         else:
             return s
+
+    def _encode_batch(self, items):
+        return [ self._encode(s) for s in items ]
+    def encode_batch(self, items):
+        if self._Obj != None:
+            items = self._Obj.encode_batch(items)
+        return self._encode_batch(items)
+    def _decode_batch(self, items):
+        out = []
+        for s in items:
+            if isinstance(s,DNAStorageError):
+                out.append(s)
+                continue
+            try:
+                out.append(self._decode(s))
+            except DNAStorageError as e:
+                out.append(e)
+        return out
+    def decode_batch(self, items):
+        items = self._decode_batch(items)
+        if self._Obj != None:
+            return self._Obj.decode_batch(items)
+        else:
+            return items
@@ -1,5 +1,7 @@
 from math import log, ceil
 from collections import Counter
+import itertools
+import numpy as np
 
 from dnastorage.exceptions import *
 from dnastorage.codec.base_codec import *
@@ -23,28 +25,51 @@ def reportBlockStatus(blocks,bindex,interIndexSize,intraIndexSize):
             if intra == -1:
                 continue
             #logger.debug("intra = {}".format(intra))
-            assert intra >=0 and intra <= 255
+            assert intra >=0 and intra < 256**intraIndexSize
+            if intra >= len(contents):
+                # blocks over GF(2^16) hold more than 256 strands
+                contents += [ '_' for i in range(intra+1-len(contents)) ]
             contents[intra] = '*'        
         stats["reportBlockStatus({})::block_size({}<{}>)".format(bindex,b[0],block_count)] = len(b[1])
         stats["reportBlockStatus({})::block_profile({}<{}>)".format(bindex,b[0],block_count)] = "".join(contents)
 
 
-def partitionStrandsIntoBlocks(strands, interIndexSize=2):
+def partitionStrandsIntoBlocks(strands, interIndexSize=2, indices=None, sort=False):
+    """ Group strands into (index,strands) blocks by their first interIndexSize bytes,
+        in the order the indices first appear. indices optionally gives the block
+        index of every strand, if it is already known. With sort=True, blocks are
+        instead generated in increasing index order, and the list of strands of a
+        block is only built when the block is reached. """
     logger.debug("partitionStrandsIntoBlocks:strands={}".format(len(strands)))
+    if indices is None:
+        indices = [ base_conversion.convertBytesToInt(s[0:interIndexSize]) for s in strands ]
+    if sort:
+        return _blocksInIndexOrder(strands, indices)
     blocksD = {}
-    for s in strands:
-        idx = base_conversion.convertBytesToInt(s[0:interIndexSize])
-        blocksD[idx] = blocksD.get(idx,[]) + [s]
+    for idx,s in zip(indices,strands):
+        blocksD.setdefault(idx,[]).append(s)
     blocks = blocksD.items()
     return blocks
 
-def doMajorityVote(strands, indexBytes=3):
+def _blocksInIndexOrder(strands, indices):
+    if len(strands) == 0:
+        return
+    indices = np.asarray(indices,dtype=np.int64)
+    order = np.argsort(indices,kind='stable')
+    ends = np.r_[np.flatnonzero(np.diff(indices[order])) + 1, len(order)]
+    start = 0
+    for end in ends:
+        yield int(indices[order[start]]), [ strands[i] for i in order[start:end] ]
+        start = end
+
+def _counterMajorityVote(strands, indexBytes=3):
+    # pure python vote, for strands whose values aren't integers
     key_value = {}
     strand_array = []
     for s in strands:
         key = base_conversion.convertBytesToInt(s[0:indexBytes])
         if key is not None:
-            key_value[key] = key_value.get(key,[]) + [s]
+            key_value.setdefault(key,[]).append(s)
             
     for key in key_value:
         data=[]
@@ -55,21 +80,109 @@ def doMajorityVote(strands, indexBytes=3):
         mx = max([len(data_strand) for data_strand in key_value[key]])
         for x in range(0,mx):
             #get a list of values that belong to the same location
-            # if there's a smaller strand, due to error, this assert
-            # will fire before attempting to access an illegal index
-            same_position_values = []
-            for data_strand in key_value[key]:
-                if x < len(data_strand):
-                    same_position_values.append(data_strand[x])
-
+            same_position_values = [ data_strand[x] for data_strand in key_value[key] if x < len(data_strand) ]
             cnt=Counter(same_position_values)
             most_common_value=cnt.most_common(1)[0][0]
             data.append(most_common_value)
-            #put the key and data into an array
         strand_array.append(data)
         
     return strand_array
 
+def _voteGroups(rows, lengths, sizes, weights=None, max_elements=1<<18):
+    """ rows holds the copies of every group, padded to the same length, with the
+        copies of a group next to each other in their original order. Every
+        (group,position,value) is counted with one bincount, a chunk of groups at a
+        time to bound the size of the counts. The winner of each (group,position)
+        is the value with the highest count; where several values tie, the one
+        that appears first wins. Returns one list per group, as long as the
+        longest copy in the group. """
+    L = rows.shape[1]
+    if L == 0:
+        return [ [] for _ in sizes ]
+    vmin = int(rows.min())
+    V = int(rows.max()) - vmin + 1
+    row_start = np.r_[0,np.cumsum(sizes)]
+    chunk = max(1,max_elements // (L*V))
+    voted = []
+    for g0 in range(0,len(sizes),chunk):
+        g1 = min(g0+chunk,len(sizes))
+        r0,r1 = row_start[g0],row_start[g1]
+        lens = lengths[r0:r1]
+        valid = np.arange(L) < lens[:,None]
+        grp = np.repeat(np.arange(g1-g0),sizes[g0:g1])
+        # entries in row-major order
+        gcol = (grp[:,None]*L + np.arange(L))[valid]
+        values = rows[r0:r1][valid] - vmin
+        if weights is None:
+            w = None
+        else:
+            w = np.repeat(weights[r0:r1],lens)
+        counts = np.bincount(gcol*V + values,weights=w,\
+                             minlength=(g1-g0)*L*V).reshape((g1-g0)*L,V)
+        best = counts.argmax(axis=1)
+        top = counts[np.arange(len(best)),best]
+        tied = (counts == top[:,None]).sum(axis=1) > 1
+        tied_entries = np.flatnonzero(tied[gcol] & (counts[gcol,values] == top[gcol]))
+        if len(tied_entries) > 0:
+            # the first entry of a position comes from the first copy with a
+            # tied value there
+            pos,first = np.unique(gcol[tied_entries],return_index=True)
+            best[pos] = values[tied_entries[first]]
+        best = (best + vmin).reshape(g1-g0,L)
+        longest = np.zeros(g1-g0,dtype=np.int64)
+        np.maximum.at(longest,grp,lens)
+        voted += [ best[i,0:longest[i]].tolist() for i in range(g1-g0) ]
+    return voted
+
+def doMajorityVote(strands, indexBytes=3, weights=None):
+    """ Group copies of the same strand by their first indexBytes, read as a
+        little-endian integer, and replace each group by its per-position
+        majority. A strand without copies is returned as is. Strands come out in
+        the order their index first appears; ties go to the value that appears
+        first. weights optionally gives a quality weight per strand, summed in
+        place of counting each copy once. """
+    if len(strands) == 0:
+        return []
+    lengths = np.array([ len(s) for s in strands ],dtype=np.int64)
+    try:
+        flat = np.fromiter(itertools.chain.from_iterable(strands),dtype=np.int64,\
+                           count=int(lengths.sum()))
+    except (TypeError,ValueError):
+        assert weights is None, "weighted votes need integer strands"
+        return _counterMajorityVote(strands,indexBytes)
+
+    L = max(int(lengths.max()),indexBytes)
+    rows = np.zeros((len(strands),L),dtype=np.int64)
+    rows[np.arange(L) < lengths[:,None]] = flat
+    # the same key as convertBytesToInt(s[0:indexBytes]); padding adds nothing
+    keys = rows[:,0:indexBytes].dot(256**np.arange(indexBytes,dtype=np.int64))
+
+    # number the groups in the order their key first appears
+    _,first,inverse = np.unique(keys,return_index=True,return_inverse=True)
+    rank = np.empty(len(first),dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    group = rank[inverse.ravel()]
+    order = np.argsort(group,kind='stable')
+    sizes = np.bincount(group)
+    row_start = np.r_[0,np.cumsum(sizes)]
+
+    multi = np.flatnonzero(sizes > 1)
+    voted = []
+    if len(multi) > 0:
+        take = np.concatenate([ order[row_start[g]:row_start[g+1]] for g in multi ])
+        if weights is not None:
+            weights = np.asarray(weights,dtype=np.float64)[take]
+        voted = _voteGroups(rows[take],lengths[take],sizes[multi],weights)
+
+    strand_array = []
+    next_vote = iter(voted)
+    for g in range(len(sizes)):
+        if sizes[g] == 1:
+            strand_array.append(strands[order[row_start[g]]])
+        else:
+            strand_array.append(next(next_vote))
+    return strand_array
+
 
 class NormalizeBlock(BaseCodec):
     def __init__(self, blockSizeInBytes):
@@ -105,6 +218,8 @@ class BlockToStrand(BaseCodec):
         logger.info("filterZeroes = {}".format(filterZeroes))
         
     def allzeroes(self, l):
+        if isinstance(l,np.ndarray):
+            return not l.any()
         for z in l:
             if z != 0:
                 return False
@@ -147,7 +262,11 @@ class BlockToStrand(BaseCodec):
             
             sindex = base_conversion.convertIntToBytes(i/self._strandSizeInBytes,self._intraIndex)
             assert len(sindex) <= self._intraIndex
-            s = bindex + sindex  + block[i:i+self._strandSizeInBytes]            
+            payload = block[i:i+self._strandSizeInBytes]
+            if isinstance(payload,np.ndarray):
+                # the outer codec may hand over a uint8 array; strands are lists
+                payload = payload.tolist()
+            s = bindex + sindex + payload
             strands.append(s)
             
         return strands
@@ -249,6 +368,12 @@ class BlockToStrand(BaseCodec):
         return prior_bindex,data
         
 
+def _pad_packet(data,n):
+    """ Append n zeroes to data, which is either a list or a uint8 array. """
+    if isinstance(data,np.ndarray):
+        return np.concatenate((data,np.zeros(n,dtype=data.dtype)))
+    return data + [0]*n
+
 class DoNothingOuterCodec(BaseCodec):
     """This is a simple do nothing Outer Codec to bypass this step when testing new designs"""
     def __init__(self,packetSize,payloadSize,CodecObj=None,Policy=None):
@@ -269,7 +394,7 @@ class DoNothingOuterCodec(BaseCodec):
             stats.inc("DoNothingOuterCodec.padPacket")
             # normalize to multiple of payloadSize
             rem = len(data) % self._payloadSize
-            data += [0]*(self._payloadSize-rem)
+            data = _pad_packet(data,self._payloadSize-rem)
 
         #print "Data length {}".format(len(data))
         assert len(data)==self._packetSize
@@ -286,20 +411,49 @@ class ReedSolomonOuterCodec(BaseCodec):
 
     Bcol must be less than rs.field_charac, which is either 2**8 or 2**16.
 
+    With c_exp=16 each symbol is two consecutive bytes of a row (big-endian),
+    so payloadSize must be even and a block may hold up to 65535 strands. A
+    symbol is erased if either of its bytes is erased.
+
+    backend selects the ReedSolomon implementation (see get_reed_solomon). All
+    columns of a block are encoded with a single call to rs_encode_msg_batch.
+
     """
-    def __init__(self,packetSize,errorSymbols,payloadSize,c_exp=8,CodecObj=None,Policy=None):
+    def __init__(self,packetSize,errorSymbols,payloadSize,c_exp=8,CodecObj=None,Policy=None,backend="numpy"):
         BaseCodec.__init__(self,CodecObj=CodecObj,Policy=Policy)
 
-        self._rs = get_reed_solomon(c_exp=c_exp)
+        self._rs = get_reed_solomon(c_exp=c_exp,backend=backend)
 
         self._packetSize = packetSize
         self._errorSymbols = int(errorSymbols)
         self._payloadSize = payloadSize
+        self._symbolSize = 1 if c_exp <= 8 else 2
+        assert payloadSize % self._symbolSize == 0
         
         self._lengthMessage = packetSize / payloadSize + errorSymbols
 
         assert(self._lengthMessage <= self._rs.field_charac) # requirement of RS
+        # build the generator polynomial once, encoding then uses the cached copy
+        self._rs.rs_generator_poly_cached(self._errorSymbols)
         
+    def _to_symbols(self, block):
+        """ rows of bytes to rows of symbols, -1 marks an erased symbol """
+        if self._symbolSize == 1:
+            return block
+        hi = block[:,0::2]
+        lo = block[:,1::2]
+        return np.where((hi < 0) | (lo < 0), -1, hi*256 + lo)
+
+    def _from_symbols(self, symbols):
+        """ rows of symbols back to rows of bytes """
+        symbols = np.asarray(symbols,dtype=np.intp)
+        if self._symbolSize == 1:
+            return symbols
+        block = np.empty((symbols.shape[0],symbols.shape[1]*2),dtype=np.intp)
+        block[:,0::2] = np.where(symbols < 0, -1, symbols >> 8)
+        block[:,1::2] = np.where(symbols < 0, -1, symbols & 0xff)
+        return block
+
     """
     packet is a tuple with the key at position 0 and value at position 1. This should return
     the Reed-Solomon encoded byte array.
@@ -320,80 +474,67 @@ class ReedSolomonOuterCodec(BaseCodec):
             stats.inc("RSOuterCodec.padPacket")
             # normalize to multiple of payloadSize
             rem = len(data) % self._payloadSize
-            data += [0]*(self._payloadSize-rem)
+            data = _pad_packet(data,self._payloadSize-rem)
 
         #print data
         assert len(data) % self._payloadSize == 0
-        rows = len(data) / self._payloadSize
-        # construct message
-
-        ecc = []        
-        for i in range(self._payloadSize):
-            message = data[i:len(data):self._payloadSize]
-            mesecc = self._rs.rs_encode_msg(message, self._errorSymbols)
-            ecc += mesecc[len(message):]
-            #print "encode message=",mesecc
-            #print message, ecc
-            #print  len(message), len(ecc), self._errorSymbols
-            #assert len(ecc) == self._errorSymbols
-
-        tranpose = []
-        for i in range( int(self._errorSymbols) ):
-            syms = ecc[i:len(ecc):self._errorSymbols]
-            data += syms
+        rows = len(data) // self._payloadSize
+        # each column of the block is a message; encode all of them at once
+        block = self._to_symbols(np.asarray(data,dtype=np.intp).reshape(rows,self._payloadSize))
+        mesecc = np.asarray(self._rs.rs_encode_msg_batch(block.T, self._errorSymbols))
+
+        # ecc symbols are appended as errorSymbols new rows of the block
+        ecc = self._from_symbols(mesecc[:,rows:].T).ravel()
+        if isinstance(data,np.ndarray):
+            data = np.concatenate((data,ecc.astype(data.dtype)))
+        else:
+            data += ecc.tolist()
                     
         # separate out key and value
         # convert mesecc into a string
         return packet[0],data
 
     """
-    This function expects a list of unsigned integers in GF(256). For now, erasures are
-    denoted with -1.
+    This function expects a list of bytes. For now, erasures are denoted with -1.
+    All columns are decoded with one call to rs_correct_msg_batch, which skips the
+    columns that have no errors. When whole strands are missing, every column is
+    erased at the same positions, so the columns are solved together against one
+    erasure locator with rs_correct_erasures_batch.
     """
     def _decode(self,packet):
-        #print packet[1]
         data = [x for x in packet[1]]
-        #print data
-        rows = len(data) / self._payloadSize
-        for i in range(self._payloadSize):
-            message = data[i:len(data):self._payloadSize]            
-            erasures = [ j for j in range(len(message)) if message[j]==-1 ]
-            try:
-                # correct the message
-                corrected_message, corrected_ecc = \
-                    self._rs.rs_correct_msg(message, \
-                                            self._errorSymbols, \
-                                            erase_pos=erasures)
-                #debug help
-                #print corrected_message
-                #print corrected_ecc
-                data[i:len(data):self._payloadSize] = corrected_message + corrected_ecc
+        rows = len(data) // self._payloadSize
+        block = self._to_symbols(np.asarray(data,dtype=np.intp).reshape(rows,self._payloadSize))
+        erased = block < 0
+        if erased.any() and (erased == erased[:,0:1]).all():
+            stats.inc("RSOuterCodec::erasure_only_block")
+            erase_pos = np.flatnonzero(erased[:,0]).tolist()
+            columns, errors, clean = self._rs.rs_correct_erasures_batch(block.T, self._errorSymbols, erase_pos)
+        else:
+            columns, errors, clean = self._rs.rs_correct_msg_batch(block.T, self._errorSymbols)
+        stats.inc("RSOuterCodec::fast_path_row",clean)
+        for i in range(block.shape[1]):
+            if not i in errors:
                 stats.inc("RSOuterCodec::correct_row")
-            except ReedSolomonError as e:
+                continue
+            e = errors[i]
+            if isinstance(e,ReedSolomonError):
                 #print "couldn't correct block {}".format(message)
                 stats.inc("RSOuterCodec::ReedSolomonError")
                 # wrap exception into a library specific one when checking policy:
                 wr_e = DNAReedSolomonOuterCodeError(msg=\
                              "RSOuterCodec found error at index={}".format(packet[0]))
-                #if self._Policy.allow(wr_e):
-                #    # fix -1
-                #    corrected_message = [ max(0,_) for _ in message ]
-                #    data[i:len(data):self._payloadSize] = corrected_message
-                #    pass # nothing to do
-                #else:
-                    # policy doesn't allow handling, raise exception
                 raise wr_e
-                # just proceed without further error correction
+            elif self._Policy.allow(e):
+                # leave this column as it was received
                 pass
-            except Exception as e:
-                if self._Policy.allow(e):
-                    pass
-                else:
-                    raise e
+            else:
+                raise e
 
         stats.inc("RSOuterCodec::fully_correct")
         stats.inc("RSOuterCodec::correct[{}]".format(str(packet[0])))                
         # discard outer correction codes
+        data = self._from_symbols(np.asarray(columns).T).ravel().tolist()
         data = data[0:len(data)-self._errorSymbols*self._payloadSize]        
         return packet[0],data
     
@@ -15,20 +15,25 @@ def reverse_complement(seq):
 def customize_RS_CFC8(is_enc,pf,primer5,primer3,intraBlockIndex=1,\
                       interBlockIndex=2,innerECC=2,strandSizeInBytes=15,\
                       blockSizeInBytes=15*185,Policy=None,\
-                      withCut=None,outerECCStrands=None,minIndex=0):
+                      withCut=None,outerECCStrands=None,minIndex=0,outerCExp=8):
     assert blockSizeInBytes % strandSizeInBytes == 0
     payload=strandSizeInBytes
     blockStrands = blockSizeInBytes / strandSizeInBytes
+    # the outer code works over GF(2^outerCExp), so a block holds at most
+    # 2^outerCExp-1 strands; with outerCExp=16 symbols are 2 bytes wide
+    maxStrands = 2**outerCExp - 1
     if outerECCStrands is None:
-        outerECCStrands = 255-blockStrands # strands
+        outerECCStrands = maxStrands-blockStrands # strands
     else:
-        assert outerECCStrands + blockStrands <= 255
-    assert blockStrands + outerECCStrands < 256
+        assert outerECCStrands + blockStrands <= maxStrands
+    assert blockStrands + outerECCStrands < maxStrands+1
+    assert blockStrands + outerECCStrands <= 256**intraBlockIndex
 
     index = intraBlockIndex + interBlockIndex
 
     blockCodec = ReedSolomonOuterCodec(packetSize=blockSizeInBytes,\
-                                       errorSymbols=outerECCStrands,payloadSize=payload,Policy=Policy)
+                                       errorSymbols=outerECCStrands,payloadSize=payload,\
+                                       c_exp=outerCExp,Policy=Policy)
 
     blockToStrand = BlockToStrand(payload,(blockStrands+outerECCStrands)*payload,Policy=Policy,\
                                   intraIndexSize=intraBlockIndex,\
@@ -64,6 +69,7 @@ def customize_RS_CFC8(is_enc,pf,primer5,primer3,intraBlockIndex=1,\
         dec = LayeredDecoder(pf,blockSizeInBytes=blockSizeInBytes,\
                              strandSizeInBytes=strandSizeInBytes,\
                              blockIndexSize=interBlockIndex,\
+                             intraBlockIndexSize=intraBlockIndex,\
                              blockCodec=blockCodec,\
                              strandCodec=strandCodec,\
                              physCodec=physCodec,\
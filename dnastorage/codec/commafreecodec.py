@@ -1,5 +1,7 @@
-from random import randint
+from random import randint, Random
+from functools import lru_cache
 import editdistance as ed
+import numpy as np
 
 from dnastorage.codec.base_codec import BaseCodec
 from dnastorage.codec import base_conversion
@@ -75,18 +77,127 @@ def create_cfc_inv():
     for i,c in enumerate(cfc):
         cfc_inv[c] = i
     cfc_inv[None] = -1000
-    
+
+# 2-bit code of each nucleotide, 4 for anything else
+nuc_code = np.full(256,4,dtype=np.int64)
+for i,n in enumerate('ACGT'):
+    nuc_code[ord(n)] = i
+
+def kmer_value(s):
+    v = 0
+    for n in s:
+        v = (v << 2) | int(nuc_code[ord(n)])
+    return v
+
+# maps the 16-bit value of every 8-mer to its codeword, or -1
+cfc_table = np.full(1<<16,-1,dtype=np.int64)
+for i,c in enumerate(cfc):
+    cfc_table[kmer_value(c)] = i
+
+def exact_codes(s):
+    """ The codeword that starts at each position of s, or -1, as an array. """
+    n = len(s)
+    if n < 8:
+        return np.full(n,-1,dtype=np.int64)
+    codes = nuc_code[np.frombuffer(s.encode('ascii','replace'),dtype=np.uint8)]
+    # value of the 4-mer at each position, then of the 8-mer from two 4-mers
+    q = (codes[0:n-3] << 6) | (codes[1:n-2] << 4) | (codes[2:n-1] << 2) | codes[3:n]
+    out = np.full(n,-1,dtype=np.int64)
+    out[0:n-7] = cfc_table[((q[0:n-7] << 8) | q[4:n-3]) & 0xffff]
+    invalid = codes == 4
+    if invalid.any():
+        # a window with anything but A, C, G or T is never a codeword
+        bad = np.r_[0,np.cumsum(invalid)]
+        out[0:n-7][bad[8:] - bad[0:n-7] > 0] = -1
+    return out
+
+def deletions(s, k):
+    """ Every string that results from deleting up to k characters of s. """
+    out = set([s])
+    frontier = out
+    for _ in range(k):
+        frontier = set([ x[:i]+x[i+1:] for x in frontier for i in range(len(x)) ])
+        out |= frontier
+    return out
+
+# Two strings within edit distance 2 share a string reachable from each by up
+# to 2 deletions, so this index finds every codeword that could be that close.
+deletion_index = {}
+for i,c in enumerate(cfc):
+    for d in deletions(c,2):
+        deletion_index.setdefault(d,[]).append(i)
+
+@lru_cache(maxsize=1<<16)
+def nearest_codewords(s):
+    """ Returns (distance, codewords) for the codewords closest to s, in cfc order,
+        if they are within edit distance 2 of s, and (None, ()) otherwise. """
+    candidates = set()
+    for d in deletions(s,2):
+        candidates.update(deletion_index.get(d,[]))
+    best = None
+    picks = []
+    for i in sorted(candidates):
+        d = ed.eval(s,cfc[i])
+        if d > 2 or (best != None and d > best):
+            continue
+        if best == None or d < best:
+            best = d
+            picks = []
+        picks.append(cfc[i])
+    return best,tuple(picks)
+
 class CommaFreeCodewords(BaseCodec):
-    def __init__(self,numberSymbols,CodecObj=None,Policy=None):
+    """ seed makes the choice among equally close codewords in inexact_vote
+        reproducible; by default it is random. """
+    def __init__(self,numberSymbols,CodecObj=None,Policy=None,seed=None):
         BaseCodec.__init__(self,CodecObj,Policy=Policy)
         self._numberBytes = numberSymbols
         global create_cfc_inv
         create_cfc_inv()
+        if seed is None:
+            self._random = None
+        else:
+            self._random = Random(seed)
+
+    def _pick(self, n):
+        if self._random is None:
+            return randint(0,n-1)
+        return self._random.randint(0,n-1)
 
     def _encode(self,strand):
         enc_strand = [ cfc[s] for s in strand ]
         return enc_strand
 
+    def _encode_batch(self,strands):
+        table = cfc
+        return [ [ table[s] for s in strand ] for strand in strands ]
+
+    def _decode_batch(self,strands):
+        """ Strands made of exactly numberSymbols aligned codewords are looked up
+            together in cfc_table; the others go through _decode. """
+        n = self._numberBytes
+        rows = [ i for i,s in enumerate(strands) if isinstance(s,str) and len(s) == 8*n ]
+        out = list(strands)
+        clean = []
+        if n > 0 and len(rows) > 0:
+            data = "".join([ strands[i] for i in rows ]).encode('ascii','replace')
+            nucs = nuc_code[np.frombuffer(data,dtype=np.uint8)].reshape(len(rows),n,8)
+            values = np.bitwise_or.reduce(nucs << np.arange(14,-1,-2),axis=2)
+            codes = cfc_table[values & 0xffff]
+            ok = (codes >= 0).all(axis=1) & ~(nucs == 4).any(axis=(1,2))
+            clean = [ rows[r] for r in np.flatnonzero(ok).tolist() ]
+            for i,c in zip(clean,codes[ok].tolist()):
+                out[i] = c
+        if len(clean) > 0:
+            stats.inc("CFC8::TotalCodewords",n*len(clean))
+            stats.inc("CFC8::IdentifiedCodeword",n*len(clean))
+            stats.inc("CFC8::strandsTotal",len(clean))
+        clean = set(clean)
+        rest = [ i for i in range(len(strands)) if not i in clean ]
+        for i,s in zip(rest,BaseCodec._decode_batch(self,[ strands[i] for i in rest ])):
+            out[i] = s
+        return out
+
     def _decode_cfc(self, s):
         global cfc_inv
         if s in cfc_inv:
@@ -98,47 +209,25 @@ class CommaFreeCodewords(BaseCodec):
         return dec
 
     def exact_vote(self, s):
-        exact = []        
-        for i in range(len(s)):
-            exact.append(self._decode_cfc(s[i:i+8]))
-        return exact
+        return [ None if c < 0 else c for c in exact_codes(s).tolist() ]
 
     def inexact_vote(self, s):
-        #print s
-        global cfc
-        D = {}
-        for x in cfc:
-            d = ed.eval(s,x)
-            D[d] = D.get(d,[]) + [x]
-        if 0 in D:
-            assert len(D[0])==1
-            return [100,D[0][0],0]        
-        elif 1 in D:
-            if len(D[1])==1:
-                return [100,D[1][0],8]
-            elif len(D[1])>1:
-                p = D[1][ randint(0,len(D[1])-1) ]
-                return [1.0/len(D[1])*100,p,8]
-        elif 2 in D:
-            if len(D[2])==1:
-                return [100,D[2][0],8]
-            elif len(D[2])>1:
-                p = D[2][ randint(0,len(D[2])-1) ]
-                return [1.0/len(D[2])*100,p,8]
+        d,picks = nearest_codewords(s)
+        if d == 0:
+            return [100,picks[0],0]
+        elif d == None:
+            return [0.0,None,8]
+        elif len(picks)==1:
+            return [100,picks[0],8]
         else:
-                return [0.0,None,8]
-
-
-    def get_next_exact(self, i, exact):
-        while i < len(exact):
-            if exact[i] != None:
-                return i
-            i += 1
-        return i
+            p = picks[ self._pick(len(picks)) ]
+            return [1.0/len(picks)*100,p,8]
 
     def _decode_helper(self, s):
         numSyms = self._numberBytes
-        exact = self.exact_vote(s)
+        codes = exact_codes(s)
+        exact = codes.tolist()
+        starts = None
 
         #print len(s)
         
@@ -146,7 +235,7 @@ class CommaFreeCodewords(BaseCodec):
         i = 0
         while i < len(s) and len(new_strand) < numSyms:
             #print i
-            if not(exact[i] is None):
+            if exact[i] >= 0:
                 if i%8 != 0:
                     stats.inc("CFC8::misAlignedCodeword")
                 new_strand.append(exact[i])
@@ -155,7 +244,11 @@ class CommaFreeCodewords(BaseCodec):
             else:
                 e = err.DNABadCodeword("Missing expected CFC8 symbol")
                 if self._Policy.allow(e):
-                    j = self.get_next_exact(i,exact)
+                    if starts is None:
+                        # positions where a codeword starts
+                        starts = np.flatnonzero(codes >= 0)
+                    nxt = np.searchsorted(starts,i)
+                    j = int(starts[nxt]) if nxt < len(starts) else len(s)
                     skipped = int(round((j-i)/8.0))
                     i_tmp = i
                     for k in range(skipped):
@@ -184,15 +277,13 @@ class CommaFreeCodewords(BaseCodec):
                 raise e
 
 
-        cnt=0
-        found=False
-        for _ in new_strand:
-            stats.inc("CFC8::TotalCodewords")
-            if _ == -1:
-                found=True
-                stats.inc("CFC8::UnidentifiedCodeword")
-            else:
-                stats.inc("CFC8::IdentifiedCodeword")
+        unidentified = new_strand.count(-1)
+        found = unidentified > 0
+        stats.inc("CFC8::TotalCodewords",len(new_strand))
+        if found:
+            stats.inc("CFC8::UnidentifiedCodeword",unidentified)
+        if unidentified < len(new_strand):
+            stats.inc("CFC8::IdentifiedCodeword",len(new_strand)-unidentified)
         if found:
             #print "found error"
             stats.inc("CFC8::strandsWithErrors")
@@ -1,11 +1,16 @@
 from random import randint
 from math import ceil,log
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
 
 import dnastorage.exceptions as err
 from dnastorage.codec.codecfile import EncodePacketizedFile, DecodePacketizedFile
 from dnastorage.codec.phys import CombineCodewords
+from dnastorage.codec.pipeline import compile_encode_pipeline
 from dnastorage.codec.block import doMajorityVote, partitionStrandsIntoBlocks
 from dnastorage.codec.block import reportBlockStatus
+from dnastorage.codec.base_conversion import convertBytesToInt
 
 from dnastorage.util.stats import stats
 
@@ -13,7 +18,13 @@ import logging
 logger = logging.getLogger('dna.storage.codec.LayeredCodec')
 
 class LayeredEncoder(EncodePacketizedFile):
+    """ Encodes a file into physical strands, one block at a time.
 
+        If compiled is set and the strand, codeword and phys codecs are a
+        stack that pipeline.py knows how to fuse, the strands of each block
+        are encoded together by a CompiledEncodePipeline, which produces the
+        same strands as the codecs.
+    """
     def __init__(self,packetizedFile,minIndex=0,\
                  strandSizeInBytes=10,blockSizeInBytes=200*10,\
                  blockCodec=None,\
@@ -22,7 +33,7 @@ class LayeredEncoder(EncodePacketizedFile):
                  strandToCodewordCodec=None,\
                  codewordToPhysCodec=CombineCodewords(),\
                  physCodec=None,\
-                 Policy=None):
+                 Policy=None,compiled=True):
         
         EncodePacketizedFile.__init__(self,packetizedFile,minIndex=minIndex)
         # set packetSize (can't hurt to do it again here)
@@ -38,6 +49,11 @@ class LayeredEncoder(EncodePacketizedFile):
         self.strandToCodewordCodec = strandToCodewordCodec
         self.codewordToPhysCodec = codewordToPhysCodec
         self.physCodec = physCodec
+        if compiled:
+            self.pipeline = compile_encode_pipeline(strandCodec,strandToCodewordCodec,\
+                                                    codewordToPhysCodec,physCodec)
+        else:
+            self.pipeline = None
                 
         self.strandSizeInBytes = strandSizeInBytes
         self.blockSizeInBytes = blockSizeInBytes
@@ -50,18 +66,15 @@ class LayeredEncoder(EncodePacketizedFile):
         # convert block into strands
         strands = self.blockToStrandCodec.encode(enc_block)
 
+        if self.pipeline is not None:
+            return self.pipeline.encode(strands)
 
-        # protected logical strands
-        final_strands = []
-        tmp_strands = []
-        for s in strands:
-            ecc_s = self.strandCodec.encode(s)
-            tmp_strands.append(ecc_s)
-            cw_s = self.strandToCodewordCodec.encode(ecc_s)
-            # phys codecs expect a DNA sequnce as a string
-            phys_s = self.codewordToPhysCodec.encode(cw_s)            
-            final = self.physCodec.encode(phys_s)
-            final_strands.append(final)
+        # protected logical strands, the whole block at a time
+        ecc_strands = self.strandCodec.encode_batch(strands)
+        cw_strands = self.strandToCodewordCodec.encode_batch(ecc_strands)
+        # phys codecs expect a DNA sequnce as a string
+        phys_strands = self.codewordToPhysCodec.encode_batch(cw_strands)
+        final_strands = self.physCodec.encode_batch(phys_strands)
 
         return final_strands
 
@@ -77,16 +90,103 @@ class LayeredEncoder(EncodePacketizedFile):
                 
     def encode(self):        
         block = self._encode()
-        try:
-            block = (block[0],[ ord(_) for _ in block[1] ])
-        except Exception as e:
-            # This is pretty horrible, kids don't try this at home!
-            block = (block[0],[ _ for _ in block[1] ])
+        # packets may be bytes, bytearrays or memoryviews (MappedReadPacketizedFile);
+        # the block codecs take them as one uint8 array, and BlockToStrand turns
+        # each strand into a list
+        block = (block[0],np.frombuffer(block[1],dtype=np.uint8))
         return self._layered_encode(block) # get entire block
         
 
+def _phys_to_strand(physCodec, physToStrandCodec, strandCodec, strandSizeInBytes, phys_strand):
+    """ Returns (strand, failed). A strand that can't be decoded is replaced
+        by a strand with an invalid index, as LayeredDecoder expects. """
+    try:
+        phys_s = physCodec.decode(phys_strand)
+        cw_s = physToStrandCodec.decode(phys_s)
+        s = strandCodec.decode(cw_s)
+        stats.inc("LayeredDecoder::phys_to_strand::succeeded")
+        return s,False
+    except err.DNAStorageError as p:
+        stats.inc("LayeredDecoder::phys_to_strand::failed")
+        return [-1] + [ 0 for _ in range(strandSizeInBytes-1) ],True
+
+def _phys_to_strand_batch(physCodec, physToStrandCodec, strandCodec, strandSizeInBytes, phys_strands):
+    """ Same as _phys_to_strand on each of phys_strands, through the codecs'
+        decode_batch. Returns a list of (strand, failed). """
+    phys_s = physCodec.decode_batch(phys_strands)
+    cw_s = physToStrandCodec.decode_batch(phys_s)
+    strands = strandCodec.decode_batch(cw_s)
+    results = []
+    for s in strands:
+        if isinstance(s,err.DNAStorageError):
+            results.append( ([-1] + [ 0 for _ in range(strandSizeInBytes-1) ],True) )
+        else:
+            results.append( (s,False) )
+    failed = sum([ f for _,f in results ])
+    if failed > 0:
+        stats.inc("LayeredDecoder::phys_to_strand::failed",failed)
+    if failed < len(results):
+        stats.inc("LayeredDecoder::phys_to_strand::succeeded",len(results)-failed)
+    return results
+
+# codecs used by _decode_reads_in_worker, set once in each worker process
+_worker_strand_codecs = None
+
+def _init_strand_worker(physCodec, physToStrandCodec, strandCodec, strandSizeInBytes):
+    global _worker_strand_codecs
+    _worker_strand_codecs = (physCodec, physToStrandCodec, strandCodec, strandSizeInBytes)
+
+def _decode_reads_in_worker(reads):
+    """ Decode a shard of reads in a worker process. Returns a list of
+        (strand, failed) and the stats added while decoding them.
+    """
+    saved = stats.all_stats
+    stats.all_stats = {}
+    try:
+        results = _phys_to_strand_batch(*(_worker_strand_codecs + (reads,)))
+    finally:
+        delta = stats.all_stats
+        stats.all_stats = saved
+    return results, delta
+
+def _decode_block(strandToBlockCodec, blockCodec, b):
+    b_contig = strandToBlockCodec.decode(b)
+    return blockCodec.decode(b_contig)
+
+# codecs used by _decode_block_in_worker, set once in each worker process
+_worker_codecs = None
+
+def _init_block_worker(strandToBlockCodec, blockCodec):
+    global _worker_codecs
+    _worker_codecs = (strandToBlockCodec, blockCodec)
+
+def _decode_block_in_worker(b):
+    """ Decode one block in a worker process. Returns (decoded block, error,
+        stats), where stats only holds what decoding this block added to the
+        worker's stats, so that the parent can merge it.
+    """
+    saved = stats.all_stats
+    stats.all_stats = {}
+    try:
+        result = _decode_block(_worker_codecs[0], _worker_codecs[1], b)
+        error = None
+    except Exception as e:
+        result = None
+        error = e
+    finally:
+        delta = stats.all_stats
+        stats.all_stats = saved
+    return result, error, delta
+
 class LayeredDecoder(DecodePacketizedFile):
-    
+    """ Decodes physical strands back into the file.
+
+        Blocks are independent of each other, so with workers > 1 the final
+        decoding of blocks is spread over a pool of that many processes,
+        handing them chunksize blocks at a time. Decoded blocks, errors and
+        stats are merged back in block order, and the Policy is applied in
+        this process, so the outcome is the same as decoding serially.
+    """
     def __init__(self,packetizedFile,minIndex=0,\
                  strandSizeInBytes=10,blockSizeInBytes=200*10,\
                  blockIndexSize=2,
@@ -96,7 +196,9 @@ class LayeredDecoder(DecodePacketizedFile):
                  strandToBlockCodec=None,\
                  blockCodec=None,\
                  Policy=None,
-                 intraBlockIndexSize=1):\
+                 intraBlockIndexSize=1,
+                 workers=None,
+                 chunksize=1):\
                          
         DecodePacketizedFile.__init__(self,packetizedFile,minIndex=minIndex)
         # set packetSize (can't hurt to do it again here)
@@ -115,12 +217,17 @@ class LayeredDecoder(DecodePacketizedFile):
         self.strandSizeInBytes = strandSizeInBytes
         self.blockSizeInBytes = blockSizeInBytes
         self.all_strands = []
+        # block index of each of all_strands, computed as strands are added
+        self.all_block_indices = []
         self.blockIndexSize = blockIndexSize
         self.intraBlockIndexSize = intraBlockIndexSize
         self._Policy = Policy
 
         self.strand_errors = 0
         self.block_errors = 0
+
+        self.workers = workers
+        self.chunksize = chunksize
         
         logger.info("strandSizeInBytes = {}".format(strandSizeInBytes))
         logger.info("blockSizeInBytes = {}".format(blockSizeInBytes))
@@ -131,18 +238,34 @@ class LayeredDecoder(DecodePacketizedFile):
 
     def _layered_decode_phys_to_strand(self, phys_strand):
         # perform block encoding
-        try:
-            phys_s = self.physCodec.decode(phys_strand)
-            cw_s = self.physToStrandCodec.decode(phys_s)
-            s = self.strandCodec.decode(cw_s)
-            stats.inc("LayeredDecoder::phys_to_strand::succeeded")
-        except err.DNAStorageError as p:
-            stats.inc("LayeredDecoder::phys_to_strand::failed")
-            s = [-1] + [ 0 for _ in range(self.strandSizeInBytes-1) ]
+        s,failed = _phys_to_strand(self.physCodec,self.physToStrandCodec,self.strandCodec,\
+                                   self.strandSizeInBytes,phys_strand)
+        if failed:
             self.strand_errors += 1
-                
         return s
 
+    def _add_strand(self, s):
+        self.all_strands.append(s)
+        if self.blockIndexSize > 0:
+            self.all_block_indices.append(convertBytesToInt(s[0:self.blockIndexSize]))
+        else:
+            self.all_block_indices.append(0)
+
+    def clear_strands(self):
+        self.all_strands = []
+        self.all_block_indices = []
+
+    def block_indices(self):
+        """ Block index of each of all_strands. """
+        if len(self.all_block_indices) != len(self.all_strands):
+            # all_strands was replaced from outside
+            self.all_block_indices = []
+            strands = self.all_strands
+            self.all_strands = []
+            for s in strands:
+                self._add_strand(s)
+        return self.all_block_indices
+
     def decode_from_phys_to_strand(self, s):
         return self._layered_decode_phys_to_strand(s)
     
@@ -150,7 +273,7 @@ class LayeredDecoder(DecodePacketizedFile):
         if bypass==False:
             try:            
                 s = self._layered_decode_phys_to_strand(phys_strand)
-                self.all_strands.append(s)
+                self._add_strand(s)
             except err.DNAMissingPrimer as p:
                 # just ignore strands that don't have a required primer
                 pass
@@ -160,40 +283,84 @@ class LayeredDecoder(DecodePacketizedFile):
                 else:
                     raise e
         else:
-            self.all_strands.append(input_value)
+            self._add_strand(input_value)
+
+    def decode_many(self, phys_strands, workers=None, chunksize=1000):
+        """ Same as calling decode on each of phys_strands, in order, but with
+            workers > 1 the reads are split into shards of chunksize reads and
+            decoded in a pool of that many processes. As in decode, a read
+            that fails to decode becomes a strand with an invalid index and
+            is counted in strand_errors; strand_errors and stats are
+            aggregated from the workers. Returns the logical strands that
+            were added.
+        """
+        start = len(self.all_strands)
+        if workers is None or workers <= 1:
+            # decode chunksize reads at a time through the codecs' decode_batch
+            phys_strands = iter(phys_strands)
+            while True:
+                chunk = list(islice(phys_strands,chunksize))
+                if len(chunk) == 0:
+                    break
+                for s,failed in _phys_to_strand_batch(self.physCodec,self.physToStrandCodec,\
+                                                      self.strandCodec,self.strandSizeInBytes,chunk):
+                    if failed:
+                        self.strand_errors += 1
+                    self._add_strand(s)
+            return self.all_strands[start:]
+
+        phys_strands = list(phys_strands)
+        shards = [ phys_strands[i:i+chunksize] for i in range(0,len(phys_strands),chunksize) ]
+        with ProcessPoolExecutor(max_workers=workers,initializer=_init_strand_worker,\
+                                 initargs=(self.physCodec,self.physToStrandCodec,\
+                                           self.strandCodec,self.strandSizeInBytes)) as pool:
+            for results,delta in pool.map(_decode_reads_in_worker,shards):
+                stats.merge(delta)
+                for s,failed in results:
+                    if failed:
+                        self.strand_errors += 1
+                    self._add_strand(s)
+        return self.all_strands[start:]
 
     def _attempt_final_decoding(self):
         # do voting here!!        
         self.voted_strands = doMajorityVote(self.all_strands,\
                                             self.blockIndexSize+self.intraBlockIndexSize)
-        if self.blockIndexSize>0:
-            blocks = partitionStrandsIntoBlocks(self.all_strands,self.blockIndexSize)
-        else:
-            blocks = [ (0,self.all_strands) ]
-        #print "number of blocks=",len(blocks)
-
-        reportBlockStatus(blocks,self.minIndex,
-                          self.blockIndexSize,self.intraBlockIndexSize)
-        
-        #blocks.sort()
-        for b in blocks:
-            idx = b[0]
-            if idx < self.minIndex or idx >= self._packetizedFile.maxKey:
-                # this happens due to errors in strands, and we should just
-                # discard these erroneous blocks
-                # If we want to reclaim some of these strands, it needs
-                # to happen as part of the error processing per strand
-                stats.inc("LayeredCodec::_attempt_final_decoding::indexOutOfRange")
-                continue
-
-            stats.inc("LayeredCodec::_attempt_final_decoding::numberOfBlocks")
+        # blocks are generated in index order, so block 0 is decoded before
+        # the strands of later blocks are gathered
+        blocks = partitionStrandsIntoBlocks(self.all_strands,self.blockIndexSize,\
+                                            indices=self.block_indices(),sort=True)
+
+        def todo():
+            for b in blocks:
+                reportBlockStatus([b],self.minIndex,
+                                  self.blockIndexSize,self.intraBlockIndexSize)
+                idx = b[0]
+                if idx < self.minIndex or idx >= self._packetizedFile.maxKey:
+                    # this happens due to errors in strands, and we should just
+                    # discard these erroneous blocks
+                    # If we want to reclaim some of these strands, it needs
+                    # to happen as part of the error processing per strand
+                    stats.inc("LayeredCodec::_attempt_final_decoding::indexOutOfRange")
+                    continue
+
+                stats.inc("LayeredCodec::_attempt_final_decoding::numberOfBlocks")
+                yield b
+
+        self.decode_blocks(todo(),self.writeToFile)
+
+    def decode_blocks(self, blocks, sink):
+        """ Decode an iterable of (index,strands) blocks in order and call
+            sink(index,data) for each block that decodes. Failed blocks are counted in block_errors
+            and handled according to the Policy.
+        """
+        for b,b_noecc,error in self._decode_blocks(blocks):
             try:
                 #print "attempt",idx,len(b[1])
-                b_contig = self.strandToBlockCodec.decode(b)
-                #print "attempt",b_contig[0],len(b_contig[1])
-                b_noecc = self.blockCodec.decode(b_contig)
+                if error is not None:
+                    raise error
                 #print "attempt",b_noecc[0],len(b_noecc[1])
-                self.writeToFile(b_noecc[0],b_noecc[1])
+                sink(b_noecc[0],b_noecc[1])
 
             except err.DNAStorageError as e:
                 self.block_errors += 1
@@ -205,6 +372,35 @@ class LayeredDecoder(DecodePacketizedFile):
                 print("LayeredCodec._attempt_final_decoding caught error: "+str(e))
                 self.block_errors += 1
                 print (b)
+
+    def decode_block(self, b):
+        """ Decode the (index,strands) of one block into (index,data) """
+        return _decode_block(self.strandToBlockCodec, self.blockCodec, b)
+
+    def _decode_blocks(self, blocks):
+        """ Yields (block, decoded block, error) for each block, in order.
+            Exactly one of decoded block and error is None.
+        """
+        if not (self.workers is None or self.workers <= 1):
+            # the pool takes all of the blocks at once
+            blocks = list(blocks)
+        if self.workers is None or self.workers <= 1 or len(blocks) <= 1:
+            for b in blocks:
+                try:
+                    result = self.decode_block(b)
+                    error = None
+                except Exception as e:
+                    result = None
+                    error = e
+                yield b,result,error
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers,initializer=_init_block_worker,\
+                                 initargs=(self.strandToBlockCodec,self.blockCodec)) as pool:
+            results = pool.map(_decode_block_in_worker,blocks,chunksize=self.chunksize)
+            for b,(result,error,delta) in zip(blocks,results):
+                stats.merge(delta)
+                yield b,result,error
                 
             
     def write(self):
@@ -1,11 +1,29 @@
 import random
-import editdistance as ed
 from difflib import SequenceMatcher
 
 
 import dnastorage.exceptions as err
 from dnastorage.codec.base_codec import BaseCodec
 from dnastorage.util.stats import *
+from dnastorage.util.approxmatch import ApproximateMatcher, primer_window, primer_max_distance
+
+def _decode_batch_exact(codec,strands,cut,name):
+    """ _decode_batch of the codecs that look for codec._seq: strands that
+        contain it are cut inline with cut(strand,index,len(seq)) and the
+        others go through codec._decode. """
+    seq = codec._seq
+    out = []
+    found = 0
+    for s in strands:
+        index = s.find(seq) if isinstance(s,str) else -1
+        if index != -1:
+            found += 1
+            out.append(cut(s,index,len(seq)))
+        else:
+            out += BaseCodec._decode_batch(codec,[s])
+    if found > 0:
+        stats.inc("phys::{}::decode::found".format(name),found)
+    return out
 
 class CombineCodewords(BaseCodec):
     def __init__(self,CodecObj=None,Policy=None):
@@ -14,6 +32,9 @@ class CombineCodewords(BaseCodec):
     def _encode(self, codeword_list):
         return "".join(codeword_list)
 
+    def _encode_batch(self, codeword_lists):
+        return [ "".join(c) for c in codeword_lists ]
+
     def _decode(self, s):
         assert ("not used for decoding")
 
@@ -41,9 +62,15 @@ class NormalizeStrandLength(BaseCodec):
 
         
 class InsertMidSequence(BaseCodec):
-    def __init__(self,seq,CodecObj=None,Policy=None):
+    """ Insert seq in the middle of the strand. When decoding, a copy of seq
+        with at most maxDistance edits is cut out if there is no exact one; by
+        default maxDistance is just under a third of its length. """
+    def __init__(self,seq,CodecObj=None,Policy=None,maxDistance=None):
         BaseCodec.__init__(self,CodecObj=CodecObj,Policy=Policy)
         self._seq = seq
+        if maxDistance == None:
+            maxDistance = (len(seq)-1)//3
+        self._matcher = ApproximateMatcher(seq,maxDistance)
         
     def _encode(self,strand):
         if strand.find(self._seq) != -1:
@@ -69,15 +96,11 @@ class InsertMidSequence(BaseCodec):
             if self._Policy.allow(er):
                 middle = int(len(strand)/2)
                 slen = len(self._seq)
-                res = []
-                for m in range(middle-slen,middle):
-                    sli = strand[m:m+slen]
-                    res.append( ed.eval(sli,self._seq) )
-                mn = min(res)
-                if mn < slen/3:
-                    place = middle - slen + res.index(mn)
+                begin = max(0,middle-slen)
+                mn,start,end = self._matcher.find(strand[begin:middle+slen-1])
+                if mn != None:
                     stats.inc("phys::InsertMidSequence::decode::foundNearby")
-                    return strand[0:place]+strand[place+slen:]
+                    return strand[0:begin+start]+strand[begin+end:]
                 else:
                     # raise error and discard, such a high distance means
                     # that it's unlikely a strand we want
@@ -86,12 +109,19 @@ class InsertMidSequence(BaseCodec):
             else:
                 raise er
 
+    def _decode_batch(self,strands):
+        return _decode_batch_exact(self,strands,lambda s,i,n: s[0:i]+s[i+n:],"InsertMidSequence")
+
 
 class PrependSequence(BaseCodec):
-    def __init__(self,seq,CodecObj=None,Policy=None,isPrimer=False):
+    """ Prepend seq to the strand. When decoding, a copy of seq with at most
+        maxDistance edits within the first primer_window bases is cut off if
+        there is no exact one. """
+    def __init__(self,seq,CodecObj=None,Policy=None,isPrimer=False,maxDistance=primer_max_distance):
         BaseCodec.__init__(self,CodecObj=CodecObj,Policy=Policy)
         self._seq = seq[:]
         self.is_primer = isPrimer
+        self._matcher = ApproximateMatcher(seq,maxDistance)
 
     def _makeCutGuess(self,strand):
         diff = SequenceMatcher(lambda x: False, strand, self._seq)
@@ -124,16 +154,10 @@ class PrependSequence(BaseCodec):
             # with an exact match, so now we look for an inexact match
             if self._Policy.allow(er):
                 slen = len(self._seq)
-                res = []
-                for m in range(0,50):
-                    sli = strand[m:m+slen]
-                    res.append( ed.eval(sli,self._seq) )
-                mn = min(res)
-                idx = res.index(mn)
-                # To do: make this distance configurable
-                if mn < 5:
+                mn,end = self._matcher.find_end(strand[:primer_window+slen-1])
+                if mn != None:
                     stats.inc("phys::PrependSequence::decode::foundNearby")
-                    return strand[idx+slen:]
+                    return strand[end:]
                 else:
                     if self.is_primer:
                         stats.inc("phys::PrependSequence::decode::missingPrimer")
@@ -146,12 +170,20 @@ class PrependSequence(BaseCodec):
                     return strand[len(self._seq):]
             else:
                 raise er
-            
+
+    def _decode_batch(self,strands):
+        return _decode_batch_exact(self,strands,lambda s,i,n: s[i+n:],"PrependSequence")
+
+
 class AppendSequence(BaseCodec):
-    def __init__(self,seq,CodecObj=None,Policy=None,isPrimer=False):
+    """ Append seq to the strand. When decoding, a copy of seq with at most
+        maxDistance edits within the last 2*len(seq) bases is cut off if there
+        is no exact one. """
+    def __init__(self,seq,CodecObj=None,Policy=None,isPrimer=False,maxDistance=4):
         BaseCodec.__init__(self,CodecObj=CodecObj,Policy=Policy)
         self._seq = seq
         self.is_primer = isPrimer
+        self._matcher = ApproximateMatcher(seq,maxDistance)
 
     def _makeCutGuess(self,strand):
         diff = SequenceMatcher(lambda x: False, strand, self._seq)
@@ -185,17 +217,11 @@ class AppendSequence(BaseCodec):
             # with an exact match, so now we look for an inexact match
             if self._Policy.allow(er):
                 slen = len(self._seq)
-                res = []
-
-                for m in range(len(strand)-2*slen,len(strand)):
-                    sli = strand[m:m+slen]
-                    res.append( ed.eval(sli,self._seq) )
-                mn = min(res)
-                idx = res.index(mn)
-                # To do: make this distance configurable
-                if mn < 5:
+                begin = max(0,len(strand)-2*slen)
+                mn,start = self._matcher.find_start(strand[begin:])
+                if mn != None:
                     stats.inc("phys::AppendSequence::decode::foundNearby")
-                    return strand[:idx+len(strand)-2*slen]
+                    return strand[:begin+start]
                 else:
                     if self.is_primer:
                         stats.inc("phys::AppendSequence::decode::missingPrimer")
@@ -209,6 +235,9 @@ class AppendSequence(BaseCodec):
             else:
                 raise er
 
+    def _decode_batch(self,strands):
+        return _decode_batch_exact(self,strands,lambda s,i,n: s[:i],"AppendSequence")
+
 
 if __name__ == "__main__":
     import random
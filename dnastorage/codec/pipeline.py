@@ -0,0 +1,185 @@
+"""
+Compiled encoding of strands for LayeredEncoder.
+
+LayeredEncoder pushes every strand through its strand, codeword and phys
+codecs one at a time, and each codec builds a new list or string. For the
+codec stack that customize_RS_CFC8 builds,
+
+    ReedSolomonInnerCodec -> CommaFreeCodewords -> CombineCodewords ->
+    AppendSequence(PrependSequence([InsertMidSequence]))
+
+the layout of the final strand is fixed once the strand length is known:
+the primers and the cut site always land in the same columns. The compiled
+pipeline therefore encodes a whole block of strands at once: Reed-Solomon
+parity for all strands in one batch, bytes to comma-free codewords through
+one table lookup into a template of the final strands, and a single decode
+of the result that is sliced into strands.
+
+The output is identical to the codec chain. The checks the phys codecs make
+while encoding (a primer or cut site already present in the strand) are
+made on the assembled strands, and any strand that trips one is encoded
+again through the codec chain, so the Policy sees exactly the same errors.
+"""
+import numpy as np
+
+from dnastorage.codec.strand import ReedSolomonInnerCodec
+from dnastorage.codec.commafreecodec import CommaFreeCodewords, cfc
+from dnastorage.codec.phys import CombineCodewords, InsertMidSequence, PrependSequence, AppendSequence
+from dnastorage.codec.reedsolomon.rs import get_reed_solomon
+
+import logging
+logger = logging.getLogger('dna.storage.codec.pipeline')
+logger.addHandler(logging.NullHandler())
+
+# ASCII of the comma-free codeword for each byte
+_cfc_bytes = np.array([ [ ord(c) for c in cw ] for cw in cfc ],dtype=np.uint8)
+
+class CompiledEncodePipeline:
+    """
+    Encode strands through a fixed stack of strand, codeword and phys codecs.
+    Use compile_encode_pipeline to build one.
+
+    stages lists the sequences the phys codecs add around the payload,
+    innermost first, as ('prepend',seq) or ('append',seq). cut is the
+    sequence InsertMidSequence puts in the middle of the payload, or None.
+    """
+    def __init__(self,strandCodec,strandToCodewordCodec,codewordToPhysCodec,physCodec,\
+                 stages,cut=None):
+        self.strandCodec = strandCodec
+        self.strandToCodewordCodec = strandToCodewordCodec
+        self.codewordToPhysCodec = codewordToPhysCodec
+        self.physCodec = physCodec
+        self.rs = get_reed_solomon(c_exp=8,backend="numpy")
+        self.nsym = strandCodec._numberECCBytes
+        self.stages = stages
+        self.cut = cut
+        self.__layouts = {}
+
+    def _encode_strand(self,s):
+        """ Encode one strand through the codec chain. """
+        ecc_s = self.strandCodec.encode(s)
+        cw_s = self.strandToCodewordCodec.encode(ecc_s)
+        phys_s = self.codewordToPhysCodec.encode(cw_s)
+        return self.physCodec.encode(phys_s)
+
+    def _layout(self,length):
+        """ Return (template, columns, checks) for a payload of length
+            nucleotides. template holds the final strand with the added
+            sequences in place, columns are the (begin,end) columns of the
+            payload pieces, and checks are the (seq,begin,end) regions of
+            the final strand in which each phys codec looked for its seq. """
+        if length in self.__layouts:
+            return self.__layouts[length]
+        if self.cut is None:
+            parts = [ length ]
+        else:
+            middle = int(length/2)
+            parts = [ middle, self.cut, length-middle ]
+        for kind,seq in self.stages:
+            if kind == 'prepend':
+                parts.insert(0,seq)
+            else:
+                parts.append(seq)
+        total = sum([ p if isinstance(p,int) else len(p) for p in parts ])
+
+        template = np.zeros(total,dtype=np.uint8)
+        columns = []
+        pos = 0
+        for p in parts:
+            if isinstance(p,int):
+                columns.append( (pos,pos+p) )
+                pos += p
+            else:
+                template[pos:pos+len(p)] = np.frombuffer(p.encode('ascii'),dtype=np.uint8)
+                pos += len(p)
+
+        # each stage was given what the stages inside it built, which sits
+        # between the sequences added by it and by the stages outside it
+        checks = []
+        for i,(kind,seq) in enumerate(self.stages):
+            begin = sum([ len(s) for k,s in self.stages[i:] if k == 'prepend' ])
+            end = total - sum([ len(s) for k,s in self.stages[i:] if k == 'append' ])
+            checks.append( (seq,begin,end) )
+
+        layout = (template,columns,checks)
+        self.__layouts[length] = layout
+        return layout
+
+    def encode(self,strands):
+        """ Encode a list of strands, each a list of bytes, and return the
+            list of final strands. """
+        if len(strands) == 0:
+            return []
+        try:
+            msgs = np.array(strands,dtype=np.intp)
+        except ValueError:
+            msgs = None
+        if msgs is None or msgs.ndim != 2 or msgs.shape[1] + self.nsym > self.rs.field_charac \
+           or msgs.min() < 0 or msgs.max() > 255:
+            # strands of different lengths or values the codecs would reject
+            return [ self._encode_strand(s) for s in strands ]
+
+        codes = self.rs.rs_encode_msg_batch(msgs,self.nsym)
+        payload = _cfc_bytes[codes].reshape(len(strands),-1)
+        length = payload.shape[1]
+        template,columns,checks = self._layout(length)
+        total = template.shape[0]
+
+        phys = np.empty((len(strands),total),dtype=np.uint8)
+        phys[:] = template
+        pos = 0
+        for begin,end in columns:
+            phys[:,begin:end] = payload[:,pos:pos+end-begin]
+            pos += end-begin
+
+        text = phys.tobytes().decode('ascii')
+        final = [ text[i:i+total] for i in range(0,len(text),total) ]
+
+        # redo strands that hold a sequence their codecs would complain about
+        if self.cut is not None:
+            cut = self.cut.encode('ascii')
+            data = payload.tobytes()
+            for i in range(len(strands)):
+                if data.find(cut,i*length,(i+1)*length) != -1:
+                    final[i] = None
+        for i,f in enumerate(final):
+            if f is None:
+                continue
+            for seq,begin,end in checks:
+                if f.find(seq,begin,end) != -1:
+                    final[i] = None
+                    break
+        for i,f in enumerate(final):
+            if f is None:
+                final[i] = self._encode_strand(strands[i])
+        return final
+
+def _plain(codec,cls):
+    return type(codec) is cls and codec._Obj is None
+
+def compile_encode_pipeline(strandCodec,strandToCodewordCodec,codewordToPhysCodec,physCodec):
+    """ Return a CompiledEncodePipeline for this stack of codecs, or None if
+        it is not one the pipeline knows how to fuse. """
+    if not (_plain(strandCodec,ReedSolomonInnerCodec) and strandCodec.rs.field_charac == 255):
+        return None
+    if not _plain(strandToCodewordCodec,CommaFreeCodewords):
+        return None
+    if not _plain(codewordToPhysCodec,CombineCodewords):
+        return None
+
+    # unwind the phys codecs, outermost first
+    stages = []
+    cut = None
+    c = physCodec
+    while c is not None:
+        if type(c) is PrependSequence:
+            stages.insert(0,('prepend',c._seq))
+        elif type(c) is AppendSequence:
+            stages.insert(0,('append',c._seq))
+        elif type(c) is InsertMidSequence and c._Obj is None:
+            cut = c._seq
+        else:
+            return None
+        c = c._Obj
+    return CompiledEncodePipeline(strandCodec,strandToCodewordCodec,codewordToPhysCodec,\
+                                  physCodec,stages,cut)
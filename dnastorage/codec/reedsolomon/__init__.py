@@ -1 +1 @@
-__all__ = [ 'rs' ]
+__all__ = [ 'rs', 'rs_numpy' ]
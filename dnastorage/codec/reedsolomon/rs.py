@@ -12,6 +12,13 @@
 
 ################### INIT and stuff ###################
 
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from operator import xor
+
 try: # compatibility with Python 3+
     xrange
 except NameError:
@@ -20,6 +27,42 @@ except NameError:
 class ReedSolomonError(Exception):
     pass
 
+class BoundedCache(object):
+    '''Small thread-safe LRU cache used to keep values that depend only on
+    the code parameters (generator polynomials, encoding matrices, ...).
+    At most maxsize entries are kept; the least recently used entry is
+    dropped first. The contents are not pickled.
+    '''
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._lock = threading.RLock()
+        self._data = OrderedDict()
+
+    def get(self, key, factory):
+        '''Return the value cached for key, calling factory() to build it on a miss.'''
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                value = factory()
+                if len(self._data) >= self.maxsize:
+                    self._data.popitem(last=False)
+            self._data[key] = value
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getstate__(self):
+        return { 'maxsize' : self.maxsize }
+
+    def __setstate__(self, state):
+        self.__init__(state['maxsize'])
+
 ################### GALOIS FIELD ELEMENTS MATHS ###################
 
 def rwh_primes1(n):
@@ -32,7 +75,11 @@ def rwh_primes1(n):
     return [2] + [2*i+1 for i in xrange(1,n/2) if sieve[i]]
 
 class ReedSolomon:
-    def __init__(self, generator=2, c_exp=8, prim=0x11d, errs=10 ):
+    def __init__(self, generator=2, c_exp=8, prim=0x11d, errs=10, cache_size=128, table_file=None ):
+        # generator polynomials (and their logs) keyed by (nsym, fcr, generator)
+        self._gen_cache = BoundedCache(cache_size)
+        # logs of the points visited by the Chien search, keyed by (nmess, errs, generator)
+        self._chien_logs_cache = BoundedCache(cache_size)
         # For efficiency, gf_exp[] has size 2*GF_SIZE, so that a
         # simple multiplication of two numbers can be resolved without
         # calling % 255. For more infos on how to generate this
@@ -45,7 +92,7 @@ class ReedSolomon:
                                          fast_primes=True, single=True)
             print ("prim=0x{:x}".format(prim))
             
-        self.init_tables(prim=prim,generator=generator,c_exp=c_exp)
+        self.init_tables(prim=prim,generator=generator,c_exp=c_exp,table_file=table_file)
         #self.gen = self.rs_generator_poly(errs, 0, generator)
         
     def find_prime_polys(self, generator=2, c_exp=8, fast_primes=False, single=False):
@@ -168,7 +215,7 @@ class ReedSolomon:
         # polynomial: print [hex(i) for i in correct_primes]
         return correct_primes 
 
-    def init_tables(self, prim=0x11d, generator=2, c_exp=8):
+    def init_tables(self, prim=0x11d, generator=2, c_exp=8, table_file=None):
         '''Precompute the logarithm and anti-log tables for faster computation
         later, using the provided primitive polynomial.  These tables are
         used for multiplication/division since addition/substraction are
@@ -182,6 +229,9 @@ class ReedSolomon:
         resulting computations are the same given any such tables.  For
         more infos, see
         https://en.wikipedia.org/wiki/Finite_field_arithmetic#Implementation_tricks
+
+        If table_file is given, the tables are read from that file
+        (see write_tables) instead of being computed.
         '''
         # generator is the generator number (the "increment" that will be
         # used to walk through the field by multiplication, this must be a
@@ -213,6 +263,8 @@ class ReedSolomon:
         # c_exp is the exponent for the field's characteristic GF(2^c_exp)
 
         #Members of ReedSolomon class: gf_exp, gf_log, field_charac
+        self._gen_cache.clear() # cached polynomials depend on the tables
+        self._chien_logs_cache.clear()
         self.field_charac = int(2**c_exp - 1)
         self.gf_exp = [0] * (self.field_charac * 2) # anti-log (exponential) table. The first two elements will always be [GF256int(1), generator]
         self.gf_log = [0] * (self.field_charac+1) # log table, log[0] is impossible and thus unused
@@ -224,6 +276,10 @@ class ReedSolomon:
         # list starting with the element 0 followed by the (p-1)
         # successive powers of the generator a : 1, a, a^1, a^2, ...,
         # a^(p-1).
+        if table_file is not None:
+            self.load_tables(table_file)
+            return [self.gf_log, self.gf_exp]
+
         x = 1
 
         for i in xrange(self.field_charac): # we could skip index 255 which is equal to index 0 because of modulo: g^255==g^0 but either way, this does not change the later outputs (ie, the ecc symbols will be the same either way)
@@ -254,6 +310,41 @@ class ReedSolomon:
 
         return [self.gf_log, self.gf_exp]
 
+    def _table_typecode(self):
+        # 16-bit entries are enough for fields up to GF(2^16)
+        return 'H' if self.field_charac <= 0xffff else 'I'
+
+    def write_tables(self, table_file):
+        '''Save the anti-log and log tables as little-endian integers so
+        that init_tables can load them instead of recomputing them. Only
+        the first field_charac entries of gf_exp are stored, the second
+        half is a copy.'''
+        tables = array(self._table_typecode(), self.gf_exp[:self.field_charac] + self.gf_log)
+        if sys.byteorder != 'little':
+            tables.byteswap()
+        with open(table_file, 'wb') as fd:
+            tables.tofile(fd)
+
+    def load_tables(self, table_file):
+        '''Fill gf_exp and gf_log from a file written by write_tables.'''
+        tables = array(self._table_typecode())
+        with open(table_file, 'rb') as fd:
+            tables.frombytes(fd.read())
+        if sys.byteorder != 'little':
+            tables.byteswap()
+        if len(tables) != 2*self.field_charac+1:
+            raise ValueError("{} holds {} entries, expected {}".format(table_file, len(tables), 2*self.field_charac+1))
+        self.gf_exp = tables[:self.field_charac].tolist() * 2
+        self.gf_log = tables[self.field_charac:].tolist()
+
+    def __reduce_ex__(self, protocol):
+        # shared field objects unpickle to the shared object of the
+        # receiving process rather than to a copy of the tables
+        key = getattr(self, '_field_key', None)
+        if key is not None:
+            return (_shared_reed_solomon, key)
+        return object.__reduce_ex__(self, protocol)
+
     def gf_add(self, x, y):
         return x ^ y
 
@@ -413,6 +504,21 @@ class ReedSolomon:
             g = self.gf_poly_mul(g, [1, self.gf_pow(generator, i+fcr)])
         return g
 
+    def rs_generator_poly_cached(self, nsym, fcr=0, generator=2):
+        '''Same as rs_generator_poly, but the polynomial is built only once
+        per (nsym, fcr, generator) and then served from a bounded cache.'''
+        return self._rs_generator_entry(nsym, fcr, generator)[0]
+
+    def _rs_generator_entry(self, nsym, fcr=0, generator=2):
+        '''Return (gen, gen_log) from the cache. gen_log holds the logarithm
+        of every generator coefficient, so encoding can add logs directly
+        instead of calling gf_mul. All coefficients of a generator
+        polynomial are non-zero, so their logs are always defined.'''
+        def build():
+            gen = self.rs_generator_poly(nsym, fcr, generator)
+            return gen, [ self.gf_log[c] for c in gen ]
+        return self._gen_cache.get((int(nsym), fcr, generator), build)
+
     def rs_generator_poly_all(self, max_nsym, fcr=0, generator=2):
         '''Generate all irreducible generator polynomials up to max_nsym (usually you can use n, the length of the message+ecc). Very useful to reduce processing time if you want to encode using variable schemes and nsym rates.'''
         g_all = {}
@@ -425,7 +531,7 @@ class ReedSolomon:
         '''Simple Reed-Solomon encoding (mainly an example for you to understand how it works, because it's slower than the inlined function below)'''
 
         if (len(msg_in) + nsym) > self.field_charac: raise ValueError("Message is too long (%i when max is %i)" % (len(msg_in)+nsym, self.field_charac))
-        if gen is None: gen = self.rs_generator_poly(nsym, fcr, generator)
+        if gen is None: gen = self.rs_generator_poly_cached(nsym, fcr, generator)
 
         # Pad the message, then divide it by the irreducible generator polynomial
         _, remainder = self.gf_poly_div(msg_in + [0] * (len(gen)-1), gen)
@@ -442,7 +548,12 @@ class ReedSolomon:
         '''
 
         if (len(msg_in) + nsym) > self.field_charac: raise ValueError("Message is too long (%i when max is %i)" % (len(msg_in)+nsym, self.field_charac))
-        if gen is None: gen = self.rs_generator_poly(nsym, fcr, generator)
+        if gen is None:
+            gen, gen_log = self._rs_generator_entry(nsym, fcr, generator)
+        elif 0 in gen[1:]:
+            gen_log = None
+        else:
+            gen_log = [ self.gf_log[c] for c in gen ]
         #gen = self.gen
         #print "gen={}".format(gen)
         # Init msg_out with the values inside msg_in and pad with
@@ -462,7 +573,14 @@ class ReedSolomon:
             coef = msg_out[i]
 
             # log(0) is undefined, so we need to manually check for this case.
-            if coef != 0:
+            if coef != 0 and gen_log is not None:
+                # same as below, but in the log domain: gf_exp has
+                # 2*field_charac entries, so the sum of two logs never
+                # needs to be reduced
+                lcoef = self.gf_log[coef]
+                for j in xrange(1, len(gen)):
+                    msg_out[i+j] ^= self.gf_exp[lcoef + gen_log[j]]
+            elif coef != 0:
                 # in synthetic division, we always skip the first
                 # coefficient of the divisior, because it's only used to
                 # normalize the dividend coefficient (which is here
@@ -487,6 +605,15 @@ class ReedSolomon:
         return msg_out
 
 
+    def rs_encode_msg_batch(self, msgs, nsym, fcr=0, generator=2, gen=None):
+        '''Encode several messages of the same length with the same code.
+        msgs is a sequence of messages (e.g. the rows of a 2-D array) and
+        the result holds one codeword per message, in the same order.
+        '''
+        if gen is None: gen = self.rs_generator_poly_cached(nsym, fcr, generator)
+        return [ self.rs_encode_msg(list(m), nsym, fcr, generator, gen) for m in msgs ]
+
+
     ################### REED-SOLOMON DECODING ###################
 
     def rs_calc_syndromes(self, msg, nsym, fcr=0, generator=2):
@@ -507,6 +634,12 @@ class ReedSolomon:
             synd[i] = self.gf_poly_eval(msg, self.gf_pow(generator, i+fcr))
         return [0] + synd # pad with one 0 for mathematical precision (else we can end up with weird calculations sometimes)
 
+    def rs_calc_syndromes_batch(self, msgs, nsym, fcr=0, generator=2):
+        '''Syndromes of several codewords, one rs_calc_syndromes result per
+        codeword. Erasures (-1) count as 0, as in rs_correct_msg.
+        '''
+        return [ self.rs_calc_syndromes([ max(x,0) for x in m ], nsym, fcr, generator) for m in msgs ]
+
     def rs_correct_errata(self, msg_in, synd, err_pos, fcr=0, generator=2): # err_pos is a list of the positions of the errors/erasures/errata
         '''Forney algorithm, computes the values (error magnitude) to correct the input message.'''
 
@@ -525,44 +658,45 @@ class ReedSolomon:
 
         # Second part of Chien search to get the error location polynomial
         # X from the error positions in err_pos (the roots of the error
-        # locator polynomial, ie, where it evaluates to 0)
-        X = [] # will store the position of the errors
-        for i in xrange(len(coef_pos)):
-            l = self.field_charac - coef_pos[i]
-            X.append( self.gf_pow(generator, -l) )
+        # locator polynomial, ie, where it evaluates to 0). X is kept as
+        # logs, so that the Forney algorithm below is only additions of
+        # logs and table lookups.
+        fc = self.field_charac
+        gf_exp = self.gf_exp
+        gf_log = self.gf_log
+        g_log = gf_log[generator]
+        X_log = [ (g_log * c) % fc for c in coef_pos ]
+        Xinv_log = [ (fc - x) % fc for x in X_log ] # log of gf_inverse(Xi)
+        # the errata evaluator as (log of coefficient, degree), zero coefficients dropped
+        eval_terms = [ (gf_log[c], d) for d, c in enumerate(err_eval) if c != 0 ]
 
         # Forney algorithm: compute the magnitudes
-        E = [0] * (len(msg_in)) # will store the values that need to be corrected (substracted) to the message containing errors. This is sometimes called the error magnitude polynomial.
-        Xlength = len(X)
-        for i, Xi in enumerate(X):
-
-            Xi_inv = self.gf_inverse(Xi)
-
-            # Compute the formal derivative of the error locator polynomial (see Blahut, Algebraic codes for data transmission, pp 196-197).
-            # the formal derivative of the errata locator is used as the denominator of the Forney Algorithm, which simply says that the ith error value is given by error_evaluator(gf_inverse(Xi)) / error_locator_derivative(gf_inverse(Xi)). See Blahut, Algebraic codes for data transmission, pp 196-197.
-            err_loc_prime_tmp = []
-            for j in xrange(Xlength):
+        msg_in = list(msg_in)
+        for i in xrange(len(X_log)):
+            # The denominator is the formal derivative of the errata
+            # locator evaluated at Xi_inv (see Blahut, Algebraic codes for
+            # data transmission, pp 196-197), i.e. the product over j != i
+            # of (1 - Xi_inv * Xj), summed here in the log domain.
+            err_loc_prime_log = 0
+            for j in xrange(len(X_log)):
                 if j != i:
-                    err_loc_prime_tmp.append( self.gf_sub(1, self.gf_mul(Xi_inv, X[j])) )
-            # compute the product, which is the denominator of the Forney algorithm (errata locator derivative)
-            err_loc_prime = 1
-            for coef in err_loc_prime_tmp:
-                err_loc_prime = self.gf_mul(err_loc_prime, coef)
-            # equivalent to: err_loc_prime = functools.reduce(gf_mul, err_loc_prime_tmp, 1)
-
-            # Compute y (evaluation of the errata evaluator polynomial)
-            # This is a more faithful translation of the theoretical equation contrary to the old forney method. Here it is an exact reproduction:
-            # Yl = omega(Xl.inverse()) / prod(1 - Xj*Xl.inverse()) for j in len(X)
-            y = self.gf_poly_eval(err_eval[::-1], Xi_inv) # numerator of the Forney algorithm (errata evaluator evaluated)
-            y = self.gf_mul(self.gf_pow(Xi, 1-fcr), y) # adjust to fcr parameter
-
-            # Compute the magnitude
-            magnitude = self.gf_div(y, err_loc_prime) # magnitude value of the error, calculated by the Forney algorithm (an equation in fact): dividing the errata evaluator with the errata locator derivative gives us the errata magnitude (ie, value to repair) the ith symbol
-            E[err_pos[i]] = magnitude # store the magnitude for this error into the magnitude polynomial
+                    term = 1 ^ gf_exp[Xinv_log[i] + X_log[j]]
+                    if term == 0:
+                        raise ZeroDivisionError()
+                    err_loc_prime_log += gf_log[term]
 
-        # Apply the correction of values to get our message corrected! (note that the ecc bytes also gets corrected!)
-        # (this isn't the Forney algorithm, we just apply the result of decoding here)
-        msg_in = self.gf_poly_add(msg_in, E) # equivalent to Ci = Ri - Ei where Ci is the correct message, Ri the received (senseword) message, and Ei the errata magnitudes (minus is replaced by XOR since it's equivalent in GF(2^p)). So in fact here we substract from the received message the errors magnitude, which logically corrects the value to what it should be.
+            # The numerator is the errata evaluator evaluated at Xi_inv:
+            # Yl = omega(Xl.inverse()) / prod(1 - Xj*Xl.inverse()) for j in len(X)
+            y = 0
+            for c_log, d in eval_terms:
+                y ^= gf_exp[(c_log + d * Xinv_log[i]) % fc]
+            if y == 0:
+                continue # magnitude is 0, nothing to correct
+
+            # adjust to fcr parameter and divide to get the magnitude, then
+            # apply it: Ci = Ri - Ei, and minus is XOR in GF(2^p)
+            magnitude = gf_exp[(gf_log[y] + X_log[i] * (1 - fcr) - err_loc_prime_log) % fc]
+            msg_in[err_pos[i]] ^= magnitude
         return msg_in
 
     def rs_find_error_locator(self, synd, nsym, erase_loc=None, erase_count=0):
@@ -716,15 +850,35 @@ class ReedSolomon:
 
         return remainder
 
+    def _chien_logs(self, nmess, errs, generator=2):
+        '''L[d][i] = log((generator**i)**d) for d <= errs and i < nmess,
+        the logs of the powers of every point the Chien search visits.
+        '''
+        def build():
+            fc = self.field_charac
+            g_log = self.gf_log[generator]
+            return [ [ (g_log * i * d) % fc for i in xrange(nmess) ] for d in xrange(errs+1) ]
+        return self._chien_logs_cache.get((nmess, errs, generator), build)
+
     def rs_find_errors(self, err_loc, nmess, generator=2): # nmess is len(msg_in)
-        '''Find the roots (ie, where evaluation = zero) of error polynomial by brute-force trial, this is a sort of Chien's search
-        (but less efficient, Chien's search is a way to evaluate the polynomial such that each evaluation only takes constant time).'''
+        '''Chien search: find the roots (ie, where evaluation = zero) of the
+        error polynomial among generator**i for i < nmess. Each term of the
+        polynomial is evaluated at all points at once from a cached table of
+        logs, and the terms are summed point by point, instead of running
+        Horner's scheme once per point.'''
         errs = len(err_loc) - 1
-        err_pos = []
-        for i in xrange(nmess): # normally we should try all 2^8 possible values, but here we optimize to just check the interesting symbols
-            if self.gf_poly_eval(err_loc, self.gf_pow(generator, i)) == 0: # It's a 0? Bingo, it's a root of the error locator polynomial,
-                                                            # in other terms this is the location of an error
-                err_pos.append(nmess - 1 - i)
+        logs = self._chien_logs(nmess, errs, generator)
+        gf_exp = self.gf_exp
+        # err_loc[0] is the coefficient of the highest degree, err_loc[errs] the constant
+        evals = [0] * nmess
+        for d in xrange(1, errs+1):
+            c = err_loc[errs-d]
+            if c != 0:
+                c_log = self.gf_log[c]
+                evals = list(map(xor, evals, [ gf_exp[c_log + l] for l in logs[d] ]))
+        # a root is where the other terms cancel the constant term
+        constant = err_loc[errs]
+        err_pos = [ nmess - 1 - i for i, y in enumerate(evals) if y == constant ]
         # Sanity check: the number of errors/errata positions found should be exactly the same as the length of the errata locator polynomial
         if len(err_pos) != errs:
             # couldn't find error locations
@@ -751,8 +905,10 @@ class ReedSolomon:
 
         return fsynd
 
-    def rs_correct_msg(self, msg_in, nsym, fcr=0, generator=2, erase_pos=None, only_erasures=False):
-        '''Reed-Solomon main decoding function'''
+    def rs_correct_msg(self, msg_in, nsym, fcr=0, generator=2, erase_pos=None, only_erasures=False, synd=None):
+        '''Reed-Solomon main decoding function. synd may hold the syndromes
+        of msg_in with its erasures set to 0, as returned by
+        rs_calc_syndromes, if the caller already computed them.'''
         if len(msg_in) > self.field_charac:
             # Note that it is in fact possible to encode/decode messages that are longer than field_charac, but because this will be above the field, this will generate more error positions during Chien Search than it should, because this will generate duplicate values, which should normally be prevented thank's to the prime polynomial reduction (eg, because it can't discriminate between error at position 1 or 256, both being exactly equal under galois field 2^8). So it's really not advised to do it, but it's possible (but then you're not guaranted to be able to correct any error/erasure on symbols with a position above the length of field_charac -- if you really need a bigger message without chunking, then you should better enlarge c_exp so that you get a bigger field).
             raise ValueError("Message is too long (%i when max is %i)" % (len(msg_in), field_charac))
@@ -768,7 +924,8 @@ class ReedSolomon:
         if len(erase_pos) > nsym: raise ReedSolomonError("Too many erasures to correct")
         # prepare the syndrome polynomial using only errors (ie: errors = characters that were either replaced by null byte
         # or changed to another character, but we don't know their positions)
-        synd = self.rs_calc_syndromes(msg_out, nsym, fcr, generator)
+        if synd is None:
+            synd = self.rs_calc_syndromes(msg_out, nsym, fcr, generator)
         # check if there's any error/erasure in the input codeword. If not (all syndromes coefficients are 0), then just return the message as-is.
         if max(synd) == 0:
             return msg_out[:-nsym], msg_out[-nsym:]  # no errors
@@ -798,6 +955,79 @@ class ReedSolomon:
         # return the successfully decoded message
         return msg_out[:-nsym], msg_out[-nsym:] # also return the corrected ecc block so that the user can check()
 
+    def rs_correct_msg_batch(self, msgs, nsym, fcr=0, generator=2, only_erasures=False, synds=None):
+        '''Decode several codewords of the same code. Erasures are denoted
+        with -1 inside each codeword. Codewords whose syndromes are all zero
+        are returned as-is without going through Berlekamp-Massey/Forney.
+        synds may hold the syndromes of the codewords, as returned by
+        rs_calc_syndromes_batch, e.g. from the numpy backend; otherwise
+        they are computed here. Either way, each codeword's syndromes are
+        computed once.
+
+        Returns (codewords, errors, clean): the corrected codewords
+        (message+ecc) in input order, a dict mapping the index of every
+        codeword that could not be corrected to the exception raised for
+        it (those codewords are returned unchanged), and the number of
+        codewords that took the clean fast path.
+        '''
+        out = []
+        errors = {}
+        clean = 0
+        if hasattr(synds, 'tolist'):
+            synds = synds.tolist()
+        for row, msg_in in enumerate(msgs):
+            msg = list(msg_in)
+            erased = -1 in msg
+            msg_out = [ max(x,0) for x in msg ] if erased else msg
+            if synds is None:
+                synd = self.rs_calc_syndromes(msg_out, nsym, fcr, generator)
+            else:
+                synd = synds[row]
+            if max(synd) == 0 and (not erased or msg.count(-1) <= nsym):
+                clean += 1
+                out.append(msg_out)
+                continue
+            erase_pos = [ i for i in xrange(len(msg)) if msg[i] == -1 ]
+            try:
+                corrected_message, corrected_ecc = self.rs_correct_msg(msg, nsym, fcr, generator, erase_pos=erase_pos, only_erasures=only_erasures, synd=synd)
+                out.append(corrected_message + corrected_ecc)
+            except Exception as e:
+                errors[row] = e
+                out.append(msg)
+        return out, errors, clean
+
+    def rs_correct_erasures_batch(self, msgs, nsym, erase_pos, fcr=0, generator=2):
+        '''Decode codewords that were all erased (-1) at the same positions
+        erase_pos, e.g. the columns of a block that lost whole strands.
+        Each codeword is first solved for its erasures only, skipping
+        Berlekamp-Massey; codewords that this does not repair (they also
+        hold errors) go through rs_correct_msg. Returns the same
+        (codewords, errors, clean) triple as rs_correct_msg_batch, where
+        clean counts the codewords repaired by the erasure-only solve.
+        '''
+        erase_pos = list(erase_pos)
+        out = []
+        errors = {}
+        clean = 0
+        for row, msg_in in enumerate(msgs):
+            msg = list(msg_in)
+            row_erase_pos = [ i for i in xrange(len(msg)) if msg[i] == -1 ]
+            try:
+                if row_erase_pos == erase_pos:
+                    try:
+                        corrected_message, corrected_ecc = self.rs_correct_msg(msg, nsym, fcr, generator, erase_pos=erase_pos, only_erasures=True)
+                        clean += 1
+                        out.append(corrected_message + corrected_ecc)
+                        continue
+                    except ReedSolomonError:
+                        pass
+                corrected_message, corrected_ecc = self.rs_correct_msg(msg, nsym, fcr, generator, erase_pos=row_erase_pos)
+                out.append(corrected_message + corrected_ecc)
+            except Exception as e:
+                errors[row] = e
+                out.append(msg)
+        return out, errors, clean
+
     def rs_correct_msg_nofsynd(self, msg_in, nsym, fcr=0, generator=2, erase_pos=None, only_erasures=False):
         '''Reed-Solomon main decoding function, without using the modified
         Forney syndromes This demonstrates how the decoding process is
@@ -869,14 +1099,68 @@ class ReedSolomon:
         return ( max(self.rs_calc_syndromes(msg, nsym, fcr, generator)) == 0 )
 
     
-def get_reed_solomon(c_exp=8):
-    if c_exp==8:
-        return ReedSolomon(generator=2, c_exp=8, prim=0x18d )
-    elif c_exp==16:
-        return ReedSolomon(generator=2, c_exp=16, prim=0x1002d )
+# default primitive polynomial for each supported field width
+_default_prims = { 8 : 0x18d, 16 : 0x1002d }
+
+# precomputed log/anti-log tables shipped with the package, see packaged_table_file
+_table_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables")
+
+# process-wide field objects, keyed by (c_exp, prim, generator, backend, use_tables)
+_fields = {}
+_fields_lock = threading.Lock()
+
+def packaged_table_file(c_exp, prim, generator=2):
+    """Return the path of the packaged log/anti-log tables for this field, or
+    None when the package does not ship one. Tables are generated with
+    ReedSolomon.write_tables and named gf<c_exp>_<prim>_<generator>.bin.
+    """
+    path = os.path.join(_table_dir, "gf{}_{:x}_{}.bin".format(c_exp, prim, generator))
+    if os.path.exists(path):
+        return path
+    return None
+
+def _reed_solomon_class(backend):
+    if backend == "python":
+        return ReedSolomon
+    elif backend == "numpy":
+        from dnastorage.codec.reedsolomon.rs_numpy import NumpyReedSolomon
+        return NumpyReedSolomon
     else:
-        assert False and "ReedSolomon codec doesn't support field of width {} yet. Use c_exp=8 or c_exp=16".format(2**c_exp)
-        
+        raise ValueError("Unknown ReedSolomon backend {}. Use python or numpy.".format(backend))
+
+def get_reed_solomon(c_exp=8, backend="python", prim=None, generator=2, use_tables=True):
+    """Return the ReedSolomon object for GF(2^c_exp).
+
+    backend selects the implementation: "python" is the list-based
+    ReedSolomon class above, "numpy" is the array-backed NumpyReedSolomon
+    in rs_numpy.py. Both produce identical codewords.
+
+    Field objects only hold tables and caches, so one object is built per
+    (c_exp, prim, generator, backend, use_tables) on first use and shared
+    by every caller in the process. When use_tables is set and the package
+    ships a precomputed table for the field, it is loaded instead of
+    computed; otherwise the tables are always computed.
+    """
+    if prim is None:
+        if not c_exp in _default_prims:
+            assert False and "ReedSolomon codec doesn't support field of width {} yet. Use c_exp=8 or c_exp=16".format(2**c_exp)
+        prim = _default_prims[c_exp]
+    key = (c_exp, prim, generator, backend, bool(use_tables))
+    rs = _fields.get(key)
+    if rs is not None:
+        return rs
+    with _fields_lock:
+        rs = _fields.get(key)
+        if rs is None:
+            cls = _reed_solomon_class(backend)
+            table_file = packaged_table_file(c_exp, prim, generator) if use_tables else None
+            rs = cls(generator=generator, c_exp=c_exp, prim=prim, table_file=table_file)
+            rs._field_key = key
+            _fields[key] = rs
+    return rs
+
+def _shared_reed_solomon(c_exp, prim, generator, backend, use_tables=True):
+    return get_reed_solomon(c_exp=c_exp, backend=backend, prim=prim, generator=generator, use_tables=use_tables)
 
 if __name__ == "__main__":
     from random import randint
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###################################################
+### Array-backed Reed-Solomon Codec
+###
+### NumpyReedSolomon keeps the same interface as ReedSolomon but stores
+### the log/anti-log tables (and, for GF(2^8), a full multiplication
+### table) as numpy arrays. The hot loops -- syndrome computation,
+### generator polynomial division, the Chien search and the Forney
+### magnitudes -- are expressed as array operations over those tables.
+### Berlekamp-Massey is inherited unchanged, so codewords are bit-identical
+### to ReedSolomon.
+###
+###################################################
+
+import numpy as np
+
+from dnastorage.codec.reedsolomon.rs import ReedSolomon, ReedSolomonError, BoundedCache
+
+class NumpyReedSolomon(ReedSolomon):
+    def __init__(self, generator=2, c_exp=8, prim=0x11d, errs=10, cache_size=128, table_file=None):
+        # matrices that only depend on the code shape are cached here
+        self._parity_cache = BoundedCache(cache_size)
+        self._syndrome_cache = BoundedCache(cache_size)
+        self._chien_cache = BoundedCache(cache_size)
+        self._erasure_cache = BoundedCache(cache_size)
+        ReedSolomon.__init__(self, generator=generator, c_exp=c_exp, prim=prim, errs=errs, cache_size=cache_size, table_file=table_file)
+
+    def init_tables(self, prim=0x11d, generator=2, c_exp=8, table_file=None):
+        '''Build the python tables with ReedSolomon.init_tables, then mirror
+        them as numpy arrays. For fields up to GF(2^8) we also build the
+        full multiplication table, so that multiplying two arrays is a
+        single fancy-indexing operation.
+        '''
+        tables = ReedSolomon.init_tables(self, prim=prim, generator=generator, c_exp=c_exp, table_file=table_file)
+        self.c_exp = c_exp
+        if c_exp <= 8:
+            self.sym_dtype = np.uint8
+        else:
+            self.sym_dtype = np.uint16
+        self.gf_exp_np = np.array(self.gf_exp, dtype=np.intp)
+        self.gf_log_np = np.array(self.gf_log, dtype=np.intp)
+        if c_exp <= 8:
+            logs = self.gf_log_np
+            mul = self.gf_exp_np[logs[:, None] + logs[None, :]].astype(self.sym_dtype)
+            mul[0, :] = 0
+            mul[:, 0] = 0
+            self.gf_mul_table = mul
+        else:
+            # a 2^16 x 2^16 table is far too large, fall back on log/anti-log
+            self.gf_mul_table = None
+        # log/anti-log tables where log(0) is a sentinel that lands in a run
+        # of zeros of the anti-log table, so that exp[log[x]+log[y]] is x*y
+        # even when x or y is 0 and no masking is needed
+        zero_log = 2 * self.field_charac
+        self.gf_log_z = self.gf_log_np.copy()
+        self.gf_log_z[0] = zero_log
+        self.gf_exp_z = np.zeros(2 * zero_log + 1, dtype=self.sym_dtype)
+        self.gf_exp_z[:len(self.gf_exp)] = self.gf_exp_np
+        self._parity_cache.clear()
+        self._syndrome_cache.clear()
+        self._chien_cache.clear()
+        self._erasure_cache.clear()
+        return tables
+
+    def gf_mul_array(self, x, y):
+        '''Element-wise GF multiplication of two (broadcastable) integer arrays.'''
+        if self.gf_mul_table is not None:
+            return self.gf_mul_table[x, y]
+        return self.gf_exp_z[self.gf_log_z[x] + self.gf_log_z[y]]
+
+    def _pow_log(self, x, power):
+        '''log(x**power) for an array of powers, reduced modulo field_charac.'''
+        return (self.gf_log[x] * np.asarray(power, dtype=np.intp)) % self.field_charac
+
+    def gf_matmul(self, A, M, max_elements=1<<22):
+        '''Matrix product A.M over the field: out[r,j] is the XOR over i of
+        A[r,i]*M[i,j]. Rows of A are processed in chunks so that the
+        temporary product never holds more than about max_elements entries,
+        which matters for GF(2^16) codes with thousands of symbols.
+        '''
+        A = np.asarray(A, dtype=np.intp)
+        out = np.zeros((A.shape[0], M.shape[1]), dtype=self.sym_dtype)
+        step = max(1, max_elements // max(1, M.size))
+        if self.gf_mul_table is not None:
+            for r in range(0, A.shape[0], step):
+                out[r:r+step] = np.bitwise_xor.reduce(self.gf_mul_table[A[r:r+step, :, None], M[None, :, :]], axis=1)
+        else:
+            # take the logs once, each chunk is then one add and one lookup
+            log_A = self.gf_log_z[A]
+            log_M = self.gf_log_z[M]
+            for r in range(0, A.shape[0], step):
+                out[r:r+step] = np.bitwise_xor.reduce(self.gf_exp_z[log_A[r:r+step, :, None] + log_M[None, :, :]], axis=1)
+        return out
+
+################### REED-SOLOMON ENCODING ###################
+
+    def _parity_matrix(self, k, nsym, fcr=0, generator=2, gen=None):
+        '''RS encoding is linear over the field: the ecc symbols of a message
+        are the XOR of the ecc symbols of each message symbol times the
+        corresponding unit vector. Row i of the parity matrix holds the ecc
+        symbols of the unit message e_i, i.e. x**(nsym+k-1-i) mod gen, so
+        encoding becomes one matrix product over the field.
+
+        The rows are built from the bottom up, multiplying the remainder
+        by x and reducing it by gen at each step, which costs O(k*nsym)
+        instead of one polynomial division per row.
+        '''
+        if gen is None:
+            key = (k, int(nsym), fcr, generator)
+            gen = self.rs_generator_poly_cached(nsym, fcr, generator)
+        else:
+            key = (k, tuple(gen))
+        def build():
+            g = np.asarray(gen[1:], dtype=np.intp)
+            P = np.zeros((k, len(g)), dtype=self.sym_dtype)
+            if len(g) == 0:
+                return P
+            # x**nsym mod gen, gen is monic
+            rem = g.copy()
+            for i in range(k-1, -1, -1):
+                P[i] = rem
+                lead = rem[0]
+                rem = np.roll(rem, -1)
+                rem[-1] = 0
+                if lead != 0:
+                    rem ^= self.gf_mul_array(lead, g)
+            return P
+        return self._parity_cache.get(key, build)
+
+    def rs_encode_msg(self, msg_in, nsym, fcr=0, generator=2, gen=None):
+        '''Reed-Solomon encoding as a vectorized generator polynomial division.'''
+        if (len(msg_in) + nsym) > self.field_charac: raise ValueError("Message is too long (%i when max is %i)" % (len(msg_in)+nsym, self.field_charac))
+        P = self._parity_matrix(len(msg_in), nsym, fcr, generator, gen)
+        ecc = self.gf_matmul(np.asarray(msg_in, dtype=np.intp)[None, :], P)[0]
+        return list(msg_in) + ecc.tolist()
+
+    def rs_encode_msg_batch(self, msgs, nsym, fcr=0, generator=2, gen=None):
+        '''Encode a 2-D array of messages (one message per row) in one call.
+        Returns a 2-D array with one codeword per row.
+        '''
+        msgs = np.asarray(msgs, dtype=np.intp)
+        if msgs.ndim != 2:
+            raise ValueError("Expected a 2-D array of messages, got {} dimensions".format(msgs.ndim))
+        k = msgs.shape[1]
+        if (k + nsym) > self.field_charac: raise ValueError("Message is too long (%i when max is %i)" % (k+nsym, self.field_charac))
+        P = self._parity_matrix(k, nsym, fcr, generator, gen)
+        ecc = self.gf_matmul(msgs, P)
+        return np.concatenate((msgs.astype(self.sym_dtype), ecc), axis=1)
+
+################### REED-SOLOMON DECODING ###################
+
+    def _syndrome_matrix(self, n, nsym, fcr=0, generator=2):
+        '''S[i,j] = (generator**(j+fcr))**(n-1-i), so that the j-th syndrome
+        of a length n codeword c is the XOR over i of c[i]*S[i,j].
+        '''
+        def build():
+            degree = np.arange(n-1, -1, -1, dtype=np.intp)[:, None]
+            power = np.arange(fcr, fcr+nsym, dtype=np.intp)[None, :]
+            return self.gf_exp_np[self._pow_log(generator, degree * power)].astype(self.sym_dtype)
+        return self._syndrome_cache.get((n, int(nsym), fcr, generator), build)
+
+    def rs_calc_syndromes(self, msg, nsym, fcr=0, generator=2):
+        '''Same as ReedSolomon.rs_calc_syndromes, evaluated for all syndromes at once.'''
+        S = self._syndrome_matrix(len(msg), nsym, fcr, generator)
+        synd = self.gf_matmul(np.asarray(msg, dtype=np.intp)[None, :], S)[0]
+        return [0] + synd.tolist()
+
+    def rs_calc_syndromes_batch(self, msgs, nsym, fcr=0, generator=2):
+        '''Syndromes of all codewords as one matrix product, a 2-D array
+        with one rs_calc_syndromes result per row.
+        '''
+        msgs = np.asarray(msgs, dtype=np.intp)
+        if msgs.ndim != 2:
+            raise ValueError("Expected a 2-D array of codewords, got {} dimensions".format(msgs.ndim))
+        S = self._syndrome_matrix(msgs.shape[1], nsym, fcr, generator)
+        synd = self.gf_matmul(np.where(msgs < 0, 0, msgs), S)
+        return np.concatenate((np.zeros((len(msgs), 1), dtype=synd.dtype), synd), axis=1)
+
+    def _chien_table(self, nmess, errs, generator=2):
+        '''T[i,d] = log((generator**i)**(errs-d)), the log of every power of
+        every point the Chien search visits, for a locator of degree errs.
+        '''
+        def build():
+            i = np.arange(nmess, dtype=np.intp)[:, None]
+            degree = np.arange(errs, -1, -1, dtype=np.intp)[None, :]
+            return self._pow_log(generator, i * degree)
+        return self._chien_cache.get((nmess, errs, generator), build)
+
+    def rs_find_errors(self, err_loc, nmess, generator=2):
+        '''Chien search: evaluate the errata locator at generator**i for all
+        i < nmess in one sweep over a cached power table and keep the roots.
+        '''
+        errs = len(err_loc) - 1
+        T = self._chien_table(nmess, errs, generator)
+        # log(coef[d] * x**degree[d]) with x = generator**i; a zero
+        # coefficient has a sentinel log and contributes 0
+        coef_log = self.gf_log_z[np.asarray(err_loc, dtype=np.intp)]
+        evals = np.bitwise_xor.reduce(self.gf_exp_z[T + coef_log[None, :]], axis=1)
+        roots = np.flatnonzero(evals == 0)
+        err_pos = (nmess - 1 - roots).tolist()
+        if len(err_pos) != errs:
+            # couldn't find error locations
+            raise ReedSolomonError("Too many (or few) errors found by Chien Search for the errata locator polynomial!")
+        return err_pos
+
+    def rs_correct_errata(self, msg_in, synd, err_pos, fcr=0, generator=2):
+        '''Forney algorithm, same as ReedSolomon.rs_correct_errata but the
+        magnitudes of all errata are computed at once in the log domain.
+        '''
+        fc = self.field_charac
+        coef_pos = [len(msg_in) - 1 - p for p in err_pos]
+        err_loc = self.rs_find_errata_locator(coef_pos, generator)
+        err_eval = self.rs_find_error_evaluator(synd[::-1], err_loc, len(err_loc)-1)[::-1]
+
+        # X[i] = generator**coef_pos[i], kept as logs
+        X_log = self._pow_log(generator, np.asarray(coef_pos, dtype=np.intp))
+        Xinv_log = (-X_log) % fc
+
+        # denominator: prod over j != i of (1 - Xi_inv * Xj)
+        terms = 1 ^ self.gf_exp_np[(Xinv_log[:, None] + X_log[None, :]) % fc]
+        np.fill_diagonal(terms, 1)
+        if not terms.all():
+            raise ZeroDivisionError()
+        err_loc_prime_log = self.gf_log_np[terms].sum(axis=1) % fc
+
+        # numerator: err_eval evaluated at Xi_inv, adjusted to fcr
+        poly = np.asarray(err_eval[::-1], dtype=np.intp)
+        degree = np.arange(len(poly)-1, -1, -1, dtype=np.intp)
+        y = np.bitwise_xor.reduce(self.gf_exp_z[self.gf_log_z[poly][None, :] + (Xinv_log[:, None] * degree[None, :]) % fc], axis=1)
+        y_log = (self.gf_log_np[y] + X_log * (1 - fcr)) % fc
+
+        magnitude = np.where(y == 0, 0, self.gf_exp_np[(y_log - err_loc_prime_log) % fc])
+        E = np.zeros(len(msg_in), dtype=np.intp)
+        E[np.asarray(err_pos, dtype=np.intp)] = magnitude
+        return (np.asarray(msg_in, dtype=np.intp) ^ E).tolist()
+
+    def rs_correct_msg_batch(self, msgs, nsym, fcr=0, generator=2, only_erasures=False, synds=None):
+        '''Batched decoder, see ReedSolomon.rs_correct_msg_batch. The
+        syndromes of all codewords are computed at once as a matrix product
+        over the field, unless synds holds them already; only codewords
+        with a non-zero syndrome are handed to rs_correct_msg. Returns the
+        codewords as a 2-D array.
+        '''
+        msgs = np.asarray(msgs, dtype=np.intp)
+        if msgs.ndim != 2:
+            raise ValueError("Expected a 2-D array of codewords, got {} dimensions".format(msgs.ndim))
+        erased = msgs < 0
+        out = np.where(erased, 0, msgs)
+        if synds is None:
+            S = self._syndrome_matrix(msgs.shape[1], nsym, fcr, generator)
+            synd = self.gf_matmul(out, S)
+        else:
+            synd = np.asarray(synds)[:, 1:]
+        dirty = synd.any(axis=1) | (erased.sum(axis=1) > nsym)
+        errors = {}
+        for row in np.flatnonzero(dirty).tolist():
+            erase_pos = np.flatnonzero(erased[row]).tolist()
+            try:
+                corrected_message, corrected_ecc = self.rs_correct_msg(msgs[row].tolist(), nsym, fcr, generator, erase_pos=erase_pos, only_erasures=only_erasures, synd=[0] + synd[row].tolist())
+                out[row] = corrected_message + corrected_ecc
+            except Exception as e:
+                errors[row] = e
+                out[row] = msgs[row]
+        return out, errors, len(msgs) - int(dirty.sum())
+
+    def _erasure_matrix(self, n, nsym, erase_pos, fcr=0, generator=2):
+        '''Forney's formula for erasures only, as a linear map of the
+        syndromes: the magnitudes of a length n codeword erased at
+        erase_pos are S[:v].W, where S are its syndromes and v the number
+        of erasures. The errata locator and the denominators only depend
+        on erase_pos, so W is computed once for all codewords erased at
+        the same positions.
+        '''
+        def build():
+            fc = self.field_charac
+            v = len(erase_pos)
+            coef_pos = [n - 1 - p for p in erase_pos]
+            # errata locator, lowest degree first
+            err_loc = self.rs_find_errata_locator(coef_pos, generator)[::-1]
+            L_log = self.gf_log_z[np.asarray(err_loc, dtype=np.intp)]
+
+            X_log = self._pow_log(generator, np.asarray(coef_pos, dtype=np.intp))
+            Xinv_log = (-X_log) % fc
+            terms = 1 ^ self.gf_exp_np[(Xinv_log[:, None] + X_log[None, :]) % fc]
+            np.fill_diagonal(terms, 1)
+            if not terms.all():
+                raise ZeroDivisionError()
+            err_loc_prime_log = self.gf_log_np[terms].sum(axis=1) % fc
+
+            # The evaluator is Omega_k = sum_t L_t S_(k-t-1), so Omega(Xi_inv)
+            # is sum_j S_j A[j,i] with A[j,i] = sum_t L_t Xi_inv**(t+j+1)
+            A = np.zeros((v, v), dtype=self.sym_dtype)
+            for j in range(v):
+                t = np.arange(v - j, dtype=np.intp)
+                powers = (Xinv_log[None, :] * (t + j + 1)[:, None]) % fc
+                A[j] = np.bitwise_xor.reduce(self.gf_exp_z[L_log[t][:, None] + powers], axis=0)
+            scale_log = (X_log * (1 - fcr) - err_loc_prime_log) % fc
+            return self.gf_exp_z[self.gf_log_z[A] + scale_log[None, :]]
+        return self._erasure_cache.get((n, int(nsym), tuple(erase_pos), fcr, generator), build)
+
+    def rs_correct_erasures_batch(self, msgs, nsym, erase_pos, fcr=0, generator=2):
+        '''Vectorized ReedSolomon.rs_correct_erasures_batch: the erasures of
+        all codewords are solved at once against one shared locator (see
+        _erasure_matrix), then the syndromes are checked again and only
+        the codewords that still fail go through rs_correct_msg. Returns
+        the codewords as a 2-D array.
+        '''
+        msgs = np.asarray(msgs, dtype=np.intp)
+        if msgs.ndim != 2:
+            raise ValueError("Expected a 2-D array of codewords, got {} dimensions".format(msgs.ndim))
+        erase_pos = list(erase_pos)
+        if len(erase_pos) == 0 or len(erase_pos) > nsym:
+            return self.rs_correct_msg_batch(msgs, nsym, fcr, generator)
+        erased = msgs < 0
+        shared = np.zeros(msgs.shape[1], dtype=bool)
+        shared[erase_pos] = True
+        # codewords erased anywhere else can't use the shared solve
+        dirty = (erased != shared[None, :]).any(axis=1)
+        out = np.where(erased, 0, msgs)
+        S = self._syndrome_matrix(msgs.shape[1], nsym, fcr, generator)
+        synd = self.gf_matmul(out, S)
+        W = self._erasure_matrix(msgs.shape[1], nsym, erase_pos, fcr, generator)
+        out[:, erase_pos] = self.gf_matmul(synd[:, :len(erase_pos)], W)
+        dirty |= self.gf_matmul(out, S).any(axis=1)
+        errors = {}
+        for row in np.flatnonzero(dirty).tolist():
+            row_erase_pos = np.flatnonzero(erased[row]).tolist()
+            try:
+                corrected_message, corrected_ecc = self.rs_correct_msg(msgs[row].tolist(), nsym, fcr, generator, erase_pos=row_erase_pos)
+                out[row] = corrected_message + corrected_ecc
+            except Exception as e:
+                errors[row] = e
+                out[row] = msgs[row]
+        return out, errors, len(msgs) - int(dirty.sum())
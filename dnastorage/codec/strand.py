@@ -24,25 +24,37 @@ class RandomizeCodec(BaseCodec):
     def _decode(self, array):
         return array[:self._numRandBytes]
 
+# batches with at least this many strands get their syndromes from one
+# matrix product of the numpy backend
+batch_syndrome_threshold = 4
+
 class ReedSolomonInnerCodec(BaseCodec):
     """
     ReedSolomonInnerCodec takes a sequence of bytes as input to the _encode function and
     produces a Reed-Solomon encoded message as a byte array. 
 
     This is an 'Inner' Codec because it only can correct errors within a strand.
+
+    Single strands are decoded with the python backend, which is the fastest for one
+    short codeword. _decode_batch computes the syndromes of a batch of strands with the
+    numpy backend and only corrects the strands with errors one by one.
     """
-    def __init__(self,numberECCBytes,c_exp=8,CodecObj=None,Policy=None):
+    def __init__(self,numberECCBytes,c_exp=8,CodecObj=None,Policy=None,backend="python"):
         """
         numberECCBytes is the amount of error correction symbols to add. 
         c_exp is the characteristic.
         CodecObj is a nested codec, called after encoding or before decoding. See BaseCodec 
         for more info.
         Policy defines the fault handling support. By default, errors trigger an exception.        
+        backend selects the ReedSolomon implementation, see get_reed_solomon.
         """
         super(ReedSolomonInnerCodec,self).__init__(CodecObj=CodecObj,Policy=Policy)
 
-        self.rs = get_reed_solomon(c_exp=c_exp)
+        self.rs = get_reed_solomon(c_exp=c_exp,backend=backend)
+        self.rs_batch = get_reed_solomon(c_exp=c_exp,backend="numpy")
         self._numberECCBytes = numberECCBytes
+        # build the generator polynomial once, encoding then uses the cached copy
+        self.rs.rs_generator_poly_cached(self._numberECCBytes)
 
     def _encode(self,array):
         """ Accepts list/array of bytes. Return the Reed-Solomon encoded byte array.
@@ -70,40 +82,76 @@ class ReedSolomonInnerCodec(BaseCodec):
     def _decode(self,array):
         """
         This function expects a list of unsigned integers in the GF. For now, erasures are
-        denoted with -1.
+        denoted with -1. Strands without errors take the syndrome-only fast path of
+        rs_correct_msg_batch.
         """
         message = [x for x in array] 
-        # find the -1s in the list
-        erasures = [ i for i in range(len(message)) if message[i]==-1 ]
-        # correct the message
-        try:
-            corrected_message, corrected_ecc = self.rs.rs_correct_msg(message,self._numberECCBytes, erase_pos=erasures)
-            value = corrected_message
+        codewords, errors, clean = self.rs.rs_correct_msg_batch([message],self._numberECCBytes)
+        stats.inc("RSInnerCodec::decode::fast_path",clean)
+        if not 0 in errors:
+            value = [ int(x) for x in codewords[0][:-self._numberECCBytes] ]
             #print "corrected message"
             stats.inc("RSInnerCodec::decode::succeeded")
-        except ReedSolomonError as e:
+            return value
+        return self._uncorrectable(errors[0],len(array))
+
+    def _uncorrectable(self,e,length):
+        """ Handle the error raised for a message that could not be corrected. """
+        if isinstance(e,ReedSolomonError):
             stats.inc("RSInnerCodec::decode::failed")
             #print "Inner: Couldn't correct message: {}".format(message)
             stats.inc("RSInnerCodec.ReedSolomonError")
-            if self._Policy.allow(e):
-                # leave erasures, may be helpful for outer decoder
-                #value = message[0:(self._numberECCBytes)]
-                value = [-1 for _ in range(len(array))]
-                pass # nothing to do
-            else:
-                print (str(e))
-                raise err.DNACodingError("RSInnerCodec failed to correct message.")
-            # just proceed without further error correction
-            pass
-        except ZeroDivisionError as e:
+        elif isinstance(e,ZeroDivisionError):
             stats.inc("RSInnerCodec.ZeroDivision")
-            if self._Policy.allow(e):
-                # leave erasures, may be helpful for outer decoder
-                #value = message[0:(self._numberECCBytes)]
-                value = [-1 for _ in range(len(array))]                
-                pass # nothing to do
-            else:
-                print (str(e))
-                raise err.DNACodingError("RSInnerCodec failed to correct message.")
+        else:
+            raise e
+
+        if self._Policy.allow(e):
+            # leave erasures, may be helpful for outer decoder
+            #value = message[0:(self._numberECCBytes)]
+            value = [-1 for _ in range(length)]
+        else:
+            print (str(e))
+            raise err.DNACodingError("RSInnerCodec failed to correct message.")
 
         return value
+
+    def _encode_batch(self,arrays):
+        """ Encode messages of the same length with one rs_encode_msg_batch call. """
+        lengths = set([ len(a) for a in arrays ])
+        if len(lengths) != 1 or lengths.pop() > self.rs.field_charac:
+            return BaseCodec._encode_batch(self,arrays)
+        try:
+            mesecc = self.rs.rs_encode_msg_batch([ [x for x in a] for a in arrays ],self._numberECCBytes)
+        except ReedSolomonError as e:
+            raise err.DNACodingError("Error while encoding Reed-Solomon Inner Codec.")
+        if hasattr(mesecc,'tolist'):
+            mesecc = mesecc.tolist()
+        return mesecc
+
+    def _decode_batch(self,arrays):
+        """ Correct messages of the same length with one rs_correct_msg_batch call. """
+        rows = [ i for i,a in enumerate(arrays) if not isinstance(a,err.DNAStorageError) ]
+        if len(set([ len(arrays[i]) for i in rows ])) != 1:
+            return BaseCodec._decode_batch(self,arrays)
+        msgs = [ [x for x in arrays[i]] for i in rows ]
+        synds = None
+        if len(msgs) >= batch_syndrome_threshold:
+            synds = self.rs_batch.rs_calc_syndromes_batch(msgs,self._numberECCBytes)
+        codewords, errors, clean = self.rs.rs_correct_msg_batch(msgs,self._numberECCBytes,synds=synds)
+        stats.inc("RSInnerCodec::decode::fast_path",clean)
+        if hasattr(codewords,'tolist'):
+            codewords = codewords.tolist()
+        out = list(arrays)
+        for r,i in enumerate(rows):
+            if not r in errors:
+                out[i] = [ int(x) for x in codewords[r][:-self._numberECCBytes] ]
+                continue
+            try:
+                out[i] = self._uncorrectable(errors[r],len(arrays[i]))
+            except err.DNAStorageError as e:
+                out[i] = e
+        succeeded = len(rows) - len(errors)
+        if succeeded > 0:
+            stats.inc("RSInnerCodec::decode::succeeded",succeeded)
+        return out
@@ -30,6 +30,11 @@ class NoTolerance(FaultTolerancePolicy):
         return False
         
 
+def _rebuild_error(cls, args):
+    e = cls.__new__(cls)
+    e.args = args
+    return e
+
 # All exceptions in dnastorage should inherit from this class
 class DNAStorageError(Exception):
     """ Exception base class for error handling in this module. All """
@@ -40,6 +45,11 @@ class DNAStorageError(Exception):
         super(DNAStorageError,self).__init__(msg)
         stats.inc("Error")
 
+    def __reduce__(self):
+        # errors raised in worker processes were already counted there,
+        # so unpickling must not run __init__ and count them again
+        return (_rebuild_error, (type(self), self.args))
+
 class DNACodingError(DNAStorageError):
     """ An error occured while encoding or decoding a file """
     def __init__(self,msg=None):
@@ -0,0 +1,217 @@
+"""
+Binary strand container (.dnab), an alternative to the text strand format.
+
+Layout (all integers little-endian):
+
+  magic     b'DNAB', version (1 byte), 3 reserved bytes
+  records   one per strand: a uint32 whose top bit is set when the strand
+            is stored as ASCII (it contains something other than A, C, G, T)
+            and whose other bits hold the length in nucleotides, followed by
+            the nucleotides packed 4 per byte (first one in the high bits) or
+            by the ASCII characters
+  footer    uint32 number of records
+            uint32 number of header strands, then a uint64 offset for each
+            uint32 number of segments, then uint32 first and end record of each
+            uint32 length of the comments, then the comment lines
+  trailer   uint64 offset of the footer, b'DNAB'
+
+The footer lets a reader find the header strands without classifying every
+strand. The file is read through mmap, so strands are decoded on demand.
+"""
+import mmap
+import struct
+import sys
+
+import dnastorage.system.header as header
+
+import logging
+logger = logging.getLogger("dna.storage.system.binaryfile")
+logger.addHandler(logging.NullHandler())
+
+binary_magic = b'DNAB'
+binary_version = 1
+binary_extension = '.dnab'
+
+_ascii_flag = 1 << 31
+_nuc_to_digit = str.maketrans('ACGT','0123')
+_nucleotides = frozenset('ACGT')
+# the four nucleotides packed into each byte value
+_byte_to_nucs = [ "".join('ACGT'[(b >> s) & 3] for s in (6,4,2,0)) for b in range(256) ]
+
+def pack_strand(s):
+    """ Return the record for strand s. """
+    n = len(s)
+    if not (frozenset(s) <= _nucleotides):
+        data = s.encode('ascii')
+        return struct.pack('<I',n | _ascii_flag) + data
+    if n == 0:
+        return struct.pack('<I',0)
+    nbytes = (n+3)//4
+    padded = s + 'A'*(nbytes*4-n)
+    return struct.pack('<I',n) + int(padded.translate(_nuc_to_digit),4).to_bytes(nbytes,'big')
+
+def unpack_strand(buf,offset):
+    """ Return (strand, offset of the next record) for the record at offset. """
+    word, = struct.unpack_from('<I',buf,offset)
+    offset += 4
+    n = word & ~_ascii_flag
+    if word & _ascii_flag:
+        return bytes(buf[offset:offset+n]).decode('ascii'),offset+n
+    nbytes = (n+3)//4
+    s = "".join([ _byte_to_nucs[b] for b in buf[offset:offset+nbytes] ])
+    return s[:n],offset+nbytes
+
+def is_binary_strand_file(filename):
+    try:
+        with open(filename,"rb") as fd:
+            return fd.read(len(binary_magic)) == binary_magic
+    except OSError:
+        return False
+
+class BinaryStrandWriter:
+    """
+    Write a .dnab file. write() accepts the same text a strand file would
+    contain, so it can stand in for the output file of WriteDNAFile: lines
+    starting with % are kept as comments and other lines become strands.
+    write_strand() marks header strands so that they are recorded in the
+    footer, and add_segment() records the range of records of a segment.
+    """
+    def __init__(self,output):
+        if isinstance(output,str):
+            self.fd = open(output,"wb")
+            self.need_to_close = True
+        else:
+            self.fd = output
+            self.need_to_close = False
+        self.fd.write(binary_magic + bytes([binary_version,0,0,0]))
+        self.offset = len(binary_magic)+4
+        self.numRecords = 0
+        self.header_offsets = []
+        self.segments = []
+        self.comments = []
+        self.__partial = ""
+
+    def write_strand(self,s,is_header=False):
+        if is_header:
+            self.header_offsets.append(self.offset)
+        record = pack_strand(s)
+        self.fd.write(record)
+        self.offset += len(record)
+        self.numRecords += 1
+
+    def add_segment(self,begin,end):
+        self.segments.append( (begin,end) )
+
+    def write(self,text):
+        lines = (self.__partial+text).split("\n")
+        self.__partial = lines.pop()
+        for line in lines:
+            s = line.strip()
+            if s.startswith('%'):
+                self.comments.append(line)
+            elif len(s) > 0:
+                self.write_strand(s)
+
+    def seekable(self):
+        # comments go in the footer, there is nothing to patch in place
+        return False
+
+    def flush(self):
+        self.fd.flush()
+
+    def close(self):
+        if len(self.__partial) > 0:
+            self.write("\n")
+        footer = struct.pack('<II',self.numRecords,len(self.header_offsets))
+        footer += b''.join([ struct.pack('<Q',o) for o in self.header_offsets ])
+        footer += struct.pack('<I',len(self.segments))
+        footer += b''.join([ struct.pack('<II',b,e) for b,e in self.segments ])
+        comments = "".join([ c+"\n" for c in self.comments ]).encode('utf-8')
+        footer += struct.pack('<I',len(comments)) + comments
+        self.fd.write(footer)
+        self.fd.write(struct.pack('<Q',self.offset) + binary_magic)
+        if self.need_to_close:
+            self.fd.close()
+
+class BinaryStrandFile:
+    """
+    Read a .dnab file through mmap. Strands are decoded only when they are
+    iterated or requested by record offset.
+    """
+    def __init__(self,filename):
+        self.filename = filename
+        self.fd = open(filename,"rb")
+        self.buf = mmap.mmap(self.fd.fileno(),0,access=mmap.ACCESS_READ)
+        assert self.buf[0:len(binary_magic)] == binary_magic, "{} is not a binary strand file".format(filename)
+        assert self.buf[len(binary_magic)] <= binary_version
+        assert self.buf[-len(binary_magic):] == binary_magic, "{} is truncated".format(filename)
+
+        self.footer_offset, = struct.unpack_from('<Q',self.buf,len(self.buf)-len(binary_magic)-8)
+        pos = self.footer_offset
+        self.numRecords,numHeader = struct.unpack_from('<II',self.buf,pos)
+        pos += 8
+        self.header_offsets = list(struct.unpack_from('<{}Q'.format(numHeader),self.buf,pos))
+        pos += 8*numHeader
+        numSegments, = struct.unpack_from('<I',self.buf,pos)
+        pos += 4
+        seg = struct.unpack_from('<{}I'.format(2*numSegments),self.buf,pos)
+        self.segments = list(zip(seg[0::2],seg[1::2]))
+        pos += 8*numSegments
+        length, = struct.unpack_from('<I',self.buf,pos)
+        pos += 4
+        self.comments = bytes(self.buf[pos:pos+length]).decode('utf-8')
+
+    def __len__(self):
+        return self.numRecords
+
+    def records(self):
+        """ Generate (offset,strand) for every record in file order. """
+        offset = len(binary_magic)+4
+        while offset < self.footer_offset:
+            s,next_offset = unpack_strand(self.buf,offset)
+            yield offset,s
+            offset = next_offset
+
+    def __iter__(self):
+        for _,s in self.records():
+            yield s
+
+    def strand_at(self,offset):
+        return unpack_strand(self.buf,offset)[0]
+
+    def header_strands(self):
+        return [ self.strand_at(o) for o in self.header_offsets ]
+
+    def close(self):
+        self.buf.close()
+        self.fd.close()
+
+def convert_text_to_binary(text_filename,binary_filename,primer5=None):
+    """ Convert a text strand file. If primer5 is given, strands that look like
+        header strands for it are recorded as header strands. """
+    out = BinaryStrandWriter(binary_filename)
+    with open(text_filename,"r") as fd:
+        for line in fd:
+            s = line.strip()
+            if s.startswith('%'):
+                out.comments.append(line.rstrip("\n"))
+            elif len(s) > 0:
+                out.write_strand(s,primer5 != None and header.is_header_strand(s,primer5))
+    out.close()
+
+def convert_binary_to_text(binary_filename,text_filename):
+    """ Convert a binary strand file, comments first. """
+    f = BinaryStrandFile(binary_filename)
+    with open(text_filename,"w") as fd:
+        fd.write(f.comments)
+        for s in f:
+            fd.write("{}\n".format(s))
+    f.close()
+
+if __name__ == "__main__":
+    # convert between formats: python -m dnastorage.system.binaryfile <in> <out> [primer5]
+    if is_binary_strand_file(sys.argv[1]):
+        convert_binary_to_text(sys.argv[1],sys.argv[2])
+    else:
+        primer5 = sys.argv[3] if len(sys.argv) > 3 else None
+        convert_text_to_binary(sys.argv[1],sys.argv[2],primer5)
@@ -0,0 +1,166 @@
+import tempfile
+
+from dnastorage.util.stats import stats
+from dnastorage.util.approxmatch import ApproximateMatcher, primer_window, primer_max_distance
+from dnastorage.system.binaryfile import BinaryStrandFile, is_binary_strand_file
+
+import logging
+logger = logging.getLogger("dna.storage.system.demux")
+logger.addHandler(logging.NullHandler())
+
+class Demultiplexer:
+    """
+    Split the reads of a pooled sequencing run between the files in it, each
+    registered with the primer pair it was written with. Every read is
+    assigned in one pass, at a cost that does not grow with the number of
+    files:
+
+      1. a read that starts with a registered 5' primer belongs to it,
+      2. else the k-mers in the first window+len(primer) bases are looked up
+         in an index of the k-mers of all 5' primers, and only the primers
+         they hit are verified with an approximate match,
+      3. if no primer shares a k-mer with the read, e.g. because every seed
+         has an error in it, and exhaustive is set, all primers are verified.
+
+    A primer verifies if it has an approximate match with at most maxDistance
+    edits. The closest one wins; files that tie on the 5' primer are told
+    apart by their 3' primer. Reads that match no file, or more than one
+    equally well, are dropped and counted. match5() exposes the 5' half of
+    this on its own.
+
+    split() writes the reads of each file to its own stream, which can be
+    read back with ReadDNAFile(in_fd=stream, primer5=..., primer3=...).
+    """
+    def __init__(self,k=8,maxDistance=primer_max_distance,window=primer_window,exhaustive=True):
+        self.k = k
+        self.maxDistance = maxDistance
+        self.window = window
+        self.exhaustive = exhaustive
+        self.names = []
+        self.primers = {}    # name -> (primer5,primer3)
+        self.prefixes = {}   # primer5 -> [ names ]
+        self.seeds = {}      # k-mer -> [ names ]
+        self.matchers5 = {}
+        self.matchers3 = {}
+        self.lengths = []    # lengths of the 5' primers, longest first
+
+    def add(self,name,primer5,primer3=""):
+        assert name not in self.primers, "{} is already registered".format(name)
+        assert len(primer5) >= self.k, "primer {} is shorter than k={}".format(primer5,self.k)
+        self.names.append(name)
+        self.primers[name] = (primer5,primer3)
+        self.prefixes.setdefault(primer5,[]).append(name)
+        self.lengths = sorted(set(self.lengths+[len(primer5)]),reverse=True)
+        for i in range(len(primer5)-self.k+1):
+            names = self.seeds.setdefault(primer5[i:i+self.k],[])
+            if name not in names:
+                names.append(name)
+        self.matchers5[name] = ApproximateMatcher(primer5,self.maxDistance)
+        if len(primer3) > 0:
+            self.matchers3[name] = ApproximateMatcher(primer3,self.maxDistance)
+
+    def __candidates(self,read):
+        for l in self.lengths:
+            names = self.prefixes.get(read[:l])
+            if names is not None:
+                return names,True
+        hits = {}
+        end = min(len(read),self.window+self.lengths[0]-1)
+        for i in range(end-self.k+1):
+            for name in self.seeds.get(read[i:i+self.k],()):
+                hits[name] = hits.get(name,0) + 1
+        if len(hits) == 0 and self.exhaustive:
+            return self.names,False
+        return list(hits.keys()),False
+
+    def __distance3(self,name,read):
+        if name not in self.matchers3:
+            return 0
+        primer3 = self.primers[name][1]
+        if read.endswith(primer3):
+            return 0
+        d,_ = self.matchers3[name].find_start(read[-2*len(primer3):])
+        return d
+
+    def match5(self,read):
+        """ Return (distance,names), the names of the files whose 5' primer
+            matches read with the fewest edits and that number of edits, or
+            (None,[]) if none matches. The 3' primers are not looked at. """
+        names,exact = self.__candidates(read)
+        if exact:
+            return 0,names
+        best = (None,[])
+        for name in names:
+            primer5 = self.primers[name][0]
+            d,_ = self.matchers5[name].find_end(read[:self.window+len(primer5)-1])
+            if d is None:
+                continue
+            if best[0] is None or d < best[0]:
+                best = (d,[name])
+            elif d == best[0]:
+                best[1].append(name)
+        return best
+
+    def __assign(self,read):
+        # the names of the files that match read best
+        _,best = self.match5(read)
+        if len(best) > 1:
+            # same 5' distance, so let the 3' primer decide
+            scored = [ (self.__distance3(name,read),name) for name in best ]
+            scored = [ (d,name) for d,name in scored if d is not None ]
+            if len(scored) > 0:
+                d = min([ d for d,_ in scored ])
+                best = [ name for e,name in scored if e == d ]
+            else:
+                best = []
+        return best
+
+    def assign(self,read):
+        """ Return the name of the file that read belongs to, or None. """
+        names = self.__assign(read)
+        if len(names) == 1:
+            return names[0]
+        return None
+
+    def __reads(self,source):
+        if isinstance(source,str):
+            if is_binary_strand_file(source):
+                f = BinaryStrandFile(source)
+                for s in f:
+                    yield s
+                f.close()
+            else:
+                with open(source,"r") as fd:
+                    for s in self.__reads(fd):
+                        yield s
+            return
+        for line in source:
+            s = line.strip()
+            if len(s) > 0 and not s.startswith('%'):
+                yield s
+
+    def split(self,source,max_size=1<<24,dir=None):
+        """ Assign every read of source, a strand filename, file object or
+            iterable of strands, and return a dictionary from each registered
+            name to a text stream of its reads in their original order,
+            positioned at its start. A stream stays in memory until it holds
+            more than max_size bytes and then spills to a temporary file. """
+        streams = { name : tempfile.SpooledTemporaryFile(max_size=max_size,mode="w+",dir=dir) \
+                    for name in self.names }
+        counts = { 'assigned' : 0, 'unassigned' : 0, 'ambiguous' : 0 }
+        for s in self.__reads(source):
+            names = self.__assign(s)
+            if len(names) == 1:
+                counts['assigned'] += 1
+                streams[names[0]].write(s+"\n")
+            elif len(names) == 0:
+                counts['unassigned'] += 1
+            else:
+                counts['ambiguous'] += 1
+        for c,n in counts.items():
+            if n > 0:
+                stats.inc("Demultiplexer::"+c,n)
+        logger.debug("demultiplexed reads: {}".format(counts))
+        for f in streams.values():
+            f.seek(0,0)
+        return streams
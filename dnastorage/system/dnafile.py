@@ -1,8 +1,17 @@
 from io import BytesIO
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import logging
 
-from dnastorage.util.packetizedfile import ReadPacketizedFilestream, WritePacketizedFilestream
+from dnastorage.util.packetizedfile import ReadPacketizedFilestream, WritePacketizedFilestream, \
+    SparseWritePacketizedFilestream, MappedReadPacketizedFile
+from dnastorage.util.bucketfile import BucketFile
+from dnastorage.system.strandindex import StrandIndex
+from dnastorage.system.segmentrouter import SegmentRouter
+from dnastorage.system.binaryfile import BinaryStrandWriter, binary_extension
+from dnastorage.util.stats import stats
+from dnastorage.codec.block import reportBlockStatus
 import dnastorage.system.formats as formats
 import dnastorage.system.header as header
 from dnastorage.codec.base_conversion import convertIntToBytes, convertBytesToInt
@@ -21,66 +30,106 @@ class DNAFile:
         return
 
     @classmethod
-    def open(self, filename, op, primer5, primer3, format_name="", write_incomplete_file=False, fsmd_abbrev='FSMD',flanking_primer5="",flanking_primer3="",use_flanking_primer_for_decoding=False,use_single_primer=False,preview_mode=False,reverse_primer3_from_seq=False):
+    def open(self, filename, op, primer5, primer3, format_name="", write_incomplete_file=False, fsmd_abbrev='FSMD',flanking_primer5="",flanking_primer3="",use_flanking_primer_for_decoding=False,use_single_primer=False,preview_mode=False,reverse_primer3_from_seq=False,workers=None,streaming=False,max_inflight_blocks=4,binary=None,segment_workers=None,sparse=False,input_file=None):
         '''        
         1. filename is the input file of strands
         2. op is the file operation: 'r' or 'w'
         3. format_name is optional for reading and required for writing. 
         4. primer5 is the coding primer, and primer3 is the non-coding primer.
+        5. workers is the number of processes used to decode when reading.
+        6. streaming reads the file in one pass and decodes blocks as they are
+           read, keeping at most max_inflight_blocks decoded blocks in memory.
+           When writing, streaming encodes each block as soon as it is full.
+        7. binary writes the binary strand container (see binaryfile.py); by
+           default it is used for filenames ending in .dnab. Reading detects
+           binary files on its own.
+        8. segment_workers is the number of processes used to decode the
+           segments of a segmented file in parallel.
+        9. sparse decodes into a temporary file instead of memory, writing
+           each block to its place as soon as it is decoded (see
+           SparseWritePacketizedFilestream).
+        10. input_file names a file to encode when writing. It is mapped and
+           encoded in place (see MappedReadPacketizedFile) instead of being
+           passed through write().
         '''     
         # check if we are reading or writing
         if op=="r":
-            
-            with open(filename,"r") as fd:
+            if streaming:
+                f = StreamingReadDNAFile(input=filename, primer5=primer5, primer3=primer3,\
+                                         fsmd_abbrev=fsmd_abbrev,\
+                                         flanking_primer5=flanking_primer5,\
+                                         flanking_primer3=flanking_primer3,\
+                                         use_flanking_primer_for_decoding=use_flanking_primer_for_decoding,\
+                                         write_incomplete_file=write_incomplete_file,\
+                                         workers=workers,max_inflight_blocks=max_inflight_blocks)
+                if f.formatid != formats.file_system_formatid_by_abbrev("Segmented"):
+                    return f
+                # segmented files are not streamed, but the header is already known
+                h = f.header
+                index = f.index
+                f.close()
+            else:
                 logger.debug("open {} for reading.".format(filename))
-                strands = get_strands(fd)
-
                 if use_flanking_primer_for_decoding==True:
-                    h = header.decode_file_header(strands,flanking_primer5+primer5,\
-                                       flanking_primer3+primer3,fsmd_abbrev=fsmd_abbrev)
+                    hdr_primer5 = flanking_primer5+primer5
+                    hdr_primer3 = flanking_primer3+primer3
                 else:
-                    h = header.decode_file_header(strands,primer5,primer3,fsmd_abbrev=fsmd_abbrev)
+                    hdr_primer5 = primer5
+                    hdr_primer3 = primer3
+                index = StrandIndex(filename,primer5,hdr_primer5)
+                h = header.decode_file_header(list(index.strands('header')),hdr_primer5,\
+                                              hdr_primer3,fsmd_abbrev=fsmd_abbrev)
             
-                logger.debug("decoded header: {}".format(h)) 
-                assert h['version'][0] <= header.system_version['major']
-                assert h['version'][1] <= header.system_version['minor']
-
-                if h['formatid'] == formats.file_system_formatid_by_abbrev("Segmented"):
-                    logger.debug("SegmentedReadDNAFile({},{},{})".format(filename,primer5,primer3))
-                    return SegmentedReadDNAFile(input=filename,\
-                                                primer5=primer5,primer3=primer3,\
-                                                write_incomplete_file=write_incomplete_file,\
-                                                fsmd_abbrev=fsmd_abbrev,\
-                                                flanking_primer5=flanking_primer5,\
-                                                flanking_primer3=flanking_primer3,\
-                                                use_flanking_primer_for_decoding=use_flanking_primer_for_decoding,\
-                                                use_single_primer=use_single_primer,\
-                                                header=h,\
-                                                preview_mode=preview_mode,\
-                                                reverse_primer3_from_seq=reverse_primer3_from_seq)
-                else:
-                    return ReadDNAFile(input=filename, primer5=primer5, primer3=primer3,\
-                                       fsmd_abbrev=fsmd_abbrev,\
-                                       flanking_primer5=flanking_primer5,\
-                                       flanking_primer3=flanking_primer3,\
-                                       use_flanking_primer_for_decoding=use_flanking_primer_for_decoding,\
-                                       header=h,preview_mode=preview_mode)
+            logger.debug("decoded header: {}".format(h)) 
+            assert h['version'][0] <= header.system_version['major']
+            assert h['version'][1] <= header.system_version['minor']
+
+            if h['formatid'] == formats.file_system_formatid_by_abbrev("Segmented"):
+                logger.debug("SegmentedReadDNAFile({},{},{})".format(filename,primer5,primer3))
+                return SegmentedReadDNAFile(input=filename,\
+                                            primer5=primer5,primer3=primer3,\
+                                            write_incomplete_file=write_incomplete_file,\
+                                            fsmd_abbrev=fsmd_abbrev,\
+                                            flanking_primer5=flanking_primer5,\
+                                            flanking_primer3=flanking_primer3,\
+                                            use_flanking_primer_for_decoding=use_flanking_primer_for_decoding,\
+                                            use_single_primer=use_single_primer,\
+                                            header=h,index=index,\
+                                            preview_mode=preview_mode,\
+                                            reverse_primer3_from_seq=reverse_primer3_from_seq,\
+                                            workers=workers,segment_workers=segment_workers,\
+                                            sparse=sparse)
+            else:
+                return ReadDNAFile(input=filename, primer5=primer5, primer3=primer3,\
+                                   fsmd_abbrev=fsmd_abbrev,\
+                                   flanking_primer5=flanking_primer5,\
+                                   flanking_primer3=flanking_primer3,\
+                                   use_flanking_primer_for_decoding=use_flanking_primer_for_decoding,\
+                                   header=h,index=index,preview_mode=preview_mode,\
+                                   workers=workers,sparse=sparse)
                 
-                # return ReadDNAFile(input=filename, primer5=primer5, primer3=primer3,\
-                #                    fsmd_abbrev=fsmd_abbrev,\
-                #                    flanking_primer5=flanking_primer5,\
-                #                    flanking_primer3=flanking_primer3,\
-                #                    use_flanking_primer_for_decoding=use_flanking_primer_for_decoding)
+            # return ReadDNAFile(input=filename, primer5=primer5, primer3=primer3,\
+            #                    fsmd_abbrev=fsmd_abbrev,\
+            #                    flanking_primer5=flanking_primer5,\
+            #                    flanking_primer3=flanking_primer3,\
+            #                    use_flanking_primer_for_decoding=use_flanking_primer_for_decoding)
         elif "w" in op and "s" in op:
             return SegmentedWriteDNAFile(output=filename,primer5=primer5,primer3=primer3, \
                                          format_name=format_name,fsmd_abbrev=fsmd_abbrev,\
                                          flanking_primer5=flanking_primer5,\
-                                         flanking_primer3=flanking_primer3)       
+                                         flanking_primer3=flanking_primer3,binary=binary)       
+        elif op=="w" and streaming:
+            return StreamingWriteDNAFile(output=filename,primer5=primer5,primer3=primer3, \
+                                         format_name=format_name,fsmd_abbrev=fsmd_abbrev,\
+                                         flanking_primer5=flanking_primer5,\
+                                         flanking_primer3=flanking_primer3,binary=binary,\
+                                         input=input_file)
         elif op=="w":
             return WriteDNAFile(output=filename,primer5=primer5,primer3=primer3, \
                                 format_name=format_name,fsmd_abbrev=fsmd_abbrev,\
                                 flanking_primer5=flanking_primer5,\
-                                flanking_primer3=flanking_primer3)
+                                flanking_primer3=flanking_primer3,binary=binary,\
+                                input=input_file)
                 
         # elif op=="w":
         #     return WriteDNAFile(output=filename,primer5=primer5,primer3=primer3, \
@@ -113,6 +162,18 @@ def get_strands(in_fd):
         strands.append(s)
     return strands
 
+def seekable_input(in_fd,dir=None):
+    """ Return in_fd if it can seek, else a temporary file in dir holding the
+        rest of in_fd, positioned at its start. StrandIndex reads strands back
+        by offset, so pipes and stdin are copied before they are indexed. """
+    if in_fd.seekable():
+        return in_fd
+    spill = tempfile.TemporaryFile(mode="w+",dir=dir)
+    for line in in_fd:
+        spill.write(line)
+    spill.seek(0,0)
+    return spill
+
 class ReadDNAFile(DNAFile):
     # ReadDNAFile reads a set of strands from a file.  It finds the header,
     # determines compatibility and encoding type, and then decodes the file.
@@ -120,10 +181,13 @@ class ReadDNAFile(DNAFile):
     def __init__(self,**kwargs):     
         DNAFile.__init__(self)
 
+        # a copy of a non-seekable in_fd, closed once its strands are read
+        self.spill = None
         if 'input' in kwargs:
+            # read through the StrandIndex, which also handles binary files
             self.input_filename = kwargs['input']
-            self.in_fd = open(self.input_filename,"r")
-            self.need_to_close = True
+            self.in_fd = None
+            self.need_to_close = False
         elif 'in_fd' in kwargs:
             self.in_fd = kwargs['in_fd']
             self.input_filename = ""
@@ -152,15 +216,27 @@ class ReadDNAFile(DNAFile):
             self.use_flanking_primers = kwargs['use_flanking_primer_for_decoding']
         else:
             self.use_flanking_primers = False
+
+        # decode strands and blocks in this many processes
+        if 'workers' in kwargs:
+            self.workers = kwargs['workers']
+        else:
+            self.workers = None
             
-        # get all the strands ( this will be bad for large files )
-        strands = get_strands(self.in_fd)
+        # classify the strands once, then read back only what is needed
+        if 'index' in kwargs and kwargs['index'] != None:
+            self.index = kwargs['index']
+        elif self.input_filename != "":
+            self.index = StrandIndex(self.input_filename,self.primer5)
+        else:
+            in_fd = seekable_input(self.in_fd,kwargs.get('spill_dir',None))
+            if in_fd is not self.in_fd:
+                self.spill = in_fd
+            self.index = StrandIndex(in_fd,self.primer5)
         if 'header' in kwargs and kwargs['header'] != None:
             h = kwargs['header']
         else:
-            h = header.decode_file_header(strands,self.primer5,self.primer3,fsmd_abbrev=self.fsmd_abbrev)    
-
-        self.strands = header.pick_nonheader_strands(strands,self.primer5)
+            h = header.decode_file_header(list(self.index.strands('header')),self.primer5,self.primer3,fsmd_abbrev=self.fsmd_abbrev)    
         
         assert h['version'][0] <= header.system_version['major']
         assert h['version'][1] <= header.system_version['minor']
@@ -169,8 +245,12 @@ class ReadDNAFile(DNAFile):
         self.formatid = h['formatid']
         self.size = h['size']
 
-        # set up mem_buffer 
-        self.mem_buffer = BytesIO()
+        # set up mem_buffer; a sparse reader decodes into a temporary file
+        self.sparse = kwargs.get('sparse',False)
+        if self.sparse:
+            self.mem_buffer = tempfile.TemporaryFile(dir=kwargs.get('spill_dir',None))
+        else:
+            self.mem_buffer = BytesIO()
         
         if self.formatid == 0x1000:
             # let sub-classes handle initialization
@@ -178,9 +258,11 @@ class ReadDNAFile(DNAFile):
 
         dec_func = formats.file_system_decoder(self.formatid)
             
-            
-        self.mem_buffer = BytesIO()
-        self.pf = WritePacketizedFilestream(self.mem_buffer,self.size,formats.file_system_format_packetsize(self.formatid))
+
+        if self.sparse:
+            self.pf = SparseWritePacketizedFilestream(self.mem_buffer,self.size,formats.file_system_format_packetsize(self.formatid))
+        else:
+            self.pf = WritePacketizedFilestream(self.mem_buffer,self.size,formats.file_system_format_packetsize(self.formatid))
 
         if self.use_flanking_primers:
             self.dec = dec_func(self.pf,self.flanking_primer5+self.primer5,\
@@ -188,9 +270,8 @@ class ReadDNAFile(DNAFile):
         else:
             self.dec = dec_func(self.pf,kwargs['primer5'],kwargs['primer3'])
 
-        for s in self.strands:
-            if s.startswith(self.primer5):
-                self.dec.decode(s)
+        self.dec.workers = self.workers
+        self.dec.decode_many(self.index.strands('payload'),workers=self.workers)
 
         self.dec.write()
         assert self.dec.complete
@@ -199,18 +280,193 @@ class ReadDNAFile(DNAFile):
         
         if self.need_to_close:
             self.in_fd.close()
+        self._close_spill()
         return
 
+    def _close_spill(self):
+        if self.spill != None:
+            self.spill.close()
+            self.spill = None
+
     def read(self, n=1):        
         return self.mem_buffer.read(n)
     def readline(self, n=-1):
         return self.mem_buffer.readline(n)
 
+    def close(self):
+        self.index.close()
+        self._close_spill()
+        if self.sparse:
+            self.mem_buffer.close()
+
     def readable(self):
         return True
     def writable(self):
         return False
         
+class StreamingReadDNAFile(DNAFile):
+    # StreamingReadDNAFile reads the strand file in a single pass that builds
+    # a StrandIndex. Once the header is known, the payload strands are read
+    # back from the index in chunks and decoded into logical strands that
+    # are routed to per-block buckets on disk (see BucketFile). Blocks are
+    # decoded in order as read() needs them, max_inflight_blocks at a time,
+    # so memory use does not grow with the size of the archive.
+    #
+    def __init__(self,**kwargs):
+        DNAFile.__init__(self)
+
+        if not ('fsmd_abbrev' in kwargs):
+            self.fsmd_abbrev = 'FSMD'
+        else:
+            self.fsmd_abbrev = kwargs['fsmd_abbrev']
+
+        assert 'primer5' in kwargs and 'primer3' in kwargs
+        self.primer5 = kwargs['primer5']
+        self.primer3 = kwargs['primer3']
+
+        self.flanking_primer5 = kwargs.get('flanking_primer5','')
+        self.flanking_primer3 = kwargs.get('flanking_primer3','')
+        self.use_flanking_primers = kwargs.get('use_flanking_primer_for_decoding',False)
+        self.write_incomplete_file = kwargs.get('write_incomplete_file',False)
+        self.workers = kwargs.get('workers',None)
+        self.max_inflight_blocks = kwargs.get('max_inflight_blocks',4)
+        # reads decoded per call to decode_many
+        self.chunksize = kwargs.get('chunksize',10000)
+        spill_dir = kwargs.get('spill_dir',None)
+
+        if self.use_flanking_primers:
+            primer5 = self.flanking_primer5+self.primer5
+            primer3 = self.flanking_primer3+self.primer3
+        else:
+            primer5 = self.primer5
+            primer3 = self.primer3
+
+        # the only pass over the input
+        spill = None
+        if 'index' in kwargs and kwargs['index'] != None:
+            self.index = kwargs['index']
+        elif 'input' in kwargs:
+            self.input_filename = kwargs['input']
+            self.index = StrandIndex(self.input_filename,self.primer5,primer5)
+        else:
+            in_fd = seekable_input(kwargs['in_fd'],spill_dir)
+            if in_fd is not kwargs['in_fd']:
+                spill = in_fd
+            self.index = StrandIndex(in_fd,self.primer5,primer5)
+
+        if 'header' in kwargs and kwargs['header'] != None:
+            h = kwargs['header']
+        else:
+            h = header.decode_file_header(list(self.index.strands('header')),primer5,primer3,fsmd_abbrev=self.fsmd_abbrev)
+        assert h['version'][0] <= header.system_version['major']
+        assert h['version'][1] <= header.system_version['minor']
+
+        self.header = h
+        self.formatid = h['formatid']
+        self.size = h['size']
+        self.buckets = None
+
+        if self.formatid == formats.file_system_formatid_by_abbrev("Segmented"):
+            # segments need their own decoders, see DNAFile.open
+            return
+
+        dec_func = formats.file_system_decoder(self.formatid)
+        # only describes the layout of the file, decoded blocks never go here
+        self.pf = WritePacketizedFilestream(BytesIO(),self.size,formats.file_system_format_packetsize(self.formatid))
+        self.dec = dec_func(self.pf,primer5,primer3)
+        self.dec.workers = self.workers
+
+        self.buckets = BucketFile(dir=spill_dir)
+        self.out_of_range = set()
+        reads = []
+        for s in self.index.strands('payload'):
+            reads.append(s)
+            if len(reads) >= self.chunksize:
+                self._bucket_strands(reads)
+                reads = []
+        self._bucket_strands(reads)
+        if spill != None:
+            spill.close()
+        for idx in self.out_of_range:
+            stats.inc("LayeredCodec::_attempt_final_decoding::indexOutOfRange")
+
+        self.next_block = self.pf.minKey
+        self.buffer = bytearray()
+        self.pos = 0
+        return
+
+    def _bucket_strands(self, reads):
+        # the decoder only holds this chunk, so its indices line up with strands
+        strands = self.dec.decode_many(reads,workers=self.workers)
+        indices = self.dec.block_indices()
+        self.dec.clear_strands()
+        for idx,s in zip(indices,strands):
+            if idx < self.pf.minKey or idx >= self.pf.maxKey:
+                self.out_of_range.add(idx)
+                continue
+            self.buckets.append(idx,s)
+
+    def _decode_next_blocks(self):
+        last = self.pf.maxKey
+        indices = range(self.next_block,min(self.next_block+self.max_inflight_blocks,last))
+        self.next_block = indices.stop
+        blocks = [ (idx,self.buckets.get(idx)) for idx in indices if idx in self.buckets ]
+        reportBlockStatus(blocks,self.dec.minIndex,self.dec.blockIndexSize,self.dec.intraBlockIndexSize)
+        stats.inc("LayeredCodec::_attempt_final_decoding::numberOfBlocks",len(blocks))
+
+        decoded = {}
+        def sink(key,value):
+            decoded[key] = bytearray(value)
+        self.dec.decode_blocks(blocks,sink)
+
+        for idx in indices:
+            if idx in decoded:
+                data = decoded[idx]
+                if idx == last-1:
+                    data = data[0:self.pf.lastPacketSize]
+                self.buffer += data
+            else:
+                assert self.write_incomplete_file, "block {} could not be decoded".format(idx)
+
+    def _fill(self, n):
+        # decode blocks until n bytes are buffered or the file is exhausted
+        while (n < 0 or len(self.buffer)-self.pos < n) and self.next_block < self.pf.maxKey:
+            if self.pos > 0:
+                del self.buffer[:self.pos]
+                self.pos = 0
+            self._decode_next_blocks()
+
+    def read(self, n=1):
+        if n is None:
+            n = -1
+        self._fill(n)
+        end = len(self.buffer) if n < 0 else self.pos+n
+        data = bytes(self.buffer[self.pos:end])
+        self.pos += len(data)
+        return data
+
+    def readline(self, n=-1):
+        line = bytearray()
+        while n < 0 or len(line) < n:
+            b = self.read(1)
+            if len(b) == 0:
+                break
+            line += b
+            if b == b'\n':
+                break
+        return bytes(line)
+
+    def close(self):
+        self.index.close()
+        if self.buckets is not None:
+            self.buckets.close()
+            self.buckets = None
+
+    def readable(self):
+        return True
+    def writable(self):
+        return False
+
 class WriteDNAFile(DNAFile):
     # WriteDNAFile writes a set of strands.
     def __init__(self,**kwargs):     
@@ -227,8 +483,14 @@ class WriteDNAFile(DNAFile):
         else:
             self.fsmd_abbrev = kwargs['fsmd_abbrev']
 
-        self.mem_buffer = BytesIO()
-        self.pf = ReadPacketizedFilestream(self.mem_buffer)
+        # a named input file is mapped and read in place; otherwise the data
+        # arrives through write()
+        if kwargs.get('input',None) != None:
+            self.mem_buffer = None
+            self.pf = MappedReadPacketizedFile(kwargs['input'])
+        else:
+            self.mem_buffer = BytesIO()
+            self.pf = ReadPacketizedFilestream(self.mem_buffer)
 
         assert 'primer5' in kwargs and 'primer3' in kwargs
         self.primer5 = kwargs['primer5']
@@ -250,12 +512,25 @@ class WriteDNAFile(DNAFile):
             
         if 'output' in kwargs:
             self.output_filename = kwargs['output']
-            self.out_fd = open(self.output_filename,"wt")
         elif 'out_fd' in kwargs:
             self.out_fd = kwargs['out_fd']
             self.output_filename = ""
+
+        # binary strand container, see binaryfile.py
+        if 'binary' in kwargs and kwargs['binary'] != None:
+            self.binary = kwargs['binary']
+        else:
+            self.binary = self.output_filename.endswith(binary_extension)
+
+        if 'output' in kwargs:
+            if self.binary:
+                self.out_fd = BinaryStrandWriter(self.output_filename)
+            else:
+                self.out_fd = open(self.output_filename,"wt")
+        elif self.binary and not isinstance(self.out_fd,BinaryStrandWriter):
+            self.out_fd = BinaryStrandWriter(self.out_fd)
             
-        self.size = 0
+        self.size = 0 if self.mem_buffer != None else self.pf.size
         self.strands = []
         return
 
@@ -268,6 +543,14 @@ class WriteDNAFile(DNAFile):
                 self.strands.append(block)
         #print "_encode_buffer: index={}".format(self.enc.index)
 
+    def _write_header_strands(self, hdr):
+        if self.binary:
+            for s in hdr:
+                self.out_fd.write_strand(s,is_header=True)
+        else:
+            for s in hdr:
+                self.out_fd.write("{}\n".format(s))
+
     def read(self, size):
         assert False and "Do not read at the same time as writing"
         
@@ -277,6 +560,7 @@ class WriteDNAFile(DNAFile):
         return False
     
     def write(self, buff):
+        assert self.mem_buffer != None, "the input file was given to open(), don't write to it"
         self.size += len(buff)
         tell = self.mem_buffer.tell()
         self.mem_buffer.seek(0,2)
@@ -302,17 +586,110 @@ class WriteDNAFile(DNAFile):
                                  self.flanking_primer3+self.primer3,\
                                  fsmd_abbrev=self.fsmd_abbrev)
 
-        for i,h in enumerate(hdr):
-            self.strands.insert(i,h)
-
         comment = header.encode_file_header_comments(self.output_filename,self.formatid,self.size,"",\
                                               self.primer5,self.primer3)
         self.out_fd.write(comment)
+        self._write_header_strands(hdr)
         for s in self.strands:
             self.out_fd.write("{}\n".format(s))
 
         if self.out_fd != sys.stdout and self.out_fd != sys.stderr:
             self.out_fd.close()
+        if self.mem_buffer == None:
+            self.pf.close()
+        return
+
+
+class StreamingWriteDNAFile(WriteDNAFile):
+    # StreamingWriteDNAFile encodes a block as soon as a full block of input
+    # has been written and sends its strands straight to the output, so only
+    # a partial block is ever held in memory. The header can only be encoded
+    # once the size is known, so its strands are written last. If the output
+    # is seekable, space for the header comments is reserved at the top of
+    # the file and filled in by close(); otherwise the comments follow the
+    # header strands.
+    #
+    # Space reserved for the size to grow beyond the placeholder comment.
+    comment_slack = 40
+
+    def __init__(self,**kwargs):
+        WriteDNAFile.__init__(self,**kwargs)
+        self.strands = None
+        try:
+            self.comment_offset = self.out_fd.tell()
+        except (AttributeError,OSError):
+            self.comment_offset = None
+        if self.comment_offset != None and self.out_fd.seekable():
+            comment = self._comment(0)
+            self.comment_length = len(comment)+self.comment_slack
+            self.out_fd.write(self._pad_comment(comment))
+        else:
+            self.comment_offset = None
+        return
+
+    def _comment(self,size):
+        return header.encode_file_header_comments(self.output_filename,self.formatid,size,"",\
+                                                  self.primer5,self.primer3)
+
+    def _pad_comment(self,comment):
+        pad = self.comment_length - len(comment)
+        assert pad >= 2
+        return comment + "%" + " "*(pad-2) + "\n"
+
+    def _encode_block(self):
+        block = next(self.enc)
+        if type(block) != list:
+            block = [block]
+        for s in block:
+            self.out_fd.write("{}\n".format(s))
+
+    def _buffered(self):
+        if self.mem_buffer == None:
+            return self.pf.size - self.pf.bytes_read
+        return len(self.mem_buffer.getbuffer()) - self.mem_buffer.tell()
+
+    def _compact(self):
+        rest = self.mem_buffer.read()
+        self.mem_buffer.seek(0,0)
+        self.mem_buffer.truncate()
+        self.mem_buffer.write(rest)
+        self.mem_buffer.seek(0,0)
+
+    def write(self, buff):
+        WriteDNAFile.write(self,buff)
+        if self._buffered() >= self.pf.packetSize:
+            while self._buffered() >= self.pf.packetSize:
+                self._encode_block()
+            self._compact()
+        return
+
+    def flush(self):
+        # a partial block would be padded, so it waits for close()
+        self.out_fd.flush()
+        return
+
+    def close(self):
+        # only a partial block is left unless the input file was given to open()
+        while self._buffered() > 0:
+            self._encode_block()
+        hdr = header.encode_file_header(self.output_filename,self.formatid,self.size,\
+                                 "",self.flanking_primer5+self.primer5,\
+                                 self.flanking_primer3+self.primer3,\
+                                 fsmd_abbrev=self.fsmd_abbrev)
+        self._write_header_strands(hdr)
+
+        comment = self._comment(self.size)
+        if self.comment_offset != None:
+            self.out_fd.seek(self.comment_offset,0)
+            self.out_fd.write(self._pad_comment(comment))
+            self.out_fd.seek(0,2)
+        else:
+            self.out_fd.write(comment)
+
+        if self.out_fd != sys.stdout and self.out_fd != sys.stderr:
+            self.out_fd.close()
+        if self.mem_buffer == None:
+            self.pf.close()
         return
 
 
@@ -321,11 +698,13 @@ class SegmentedWriteDNAFile(WriteDNAFile):
     def __init__(self,**kwargs):     
         WriteDNAFile.__init__(self,**kwargs)
         self.segments = []
+        self.segment_ends = []
         self.beginIndex = 0
         return
 
     def _record_segment(self):
         self.segments += [[ self.formatid, self.size, self.primer5, self.primer3, self.beginIndex, self.flanking_primer5, self.flanking_primer3 ]]
+        self.segment_ends.append(len(self.strands))
 
     def new_segment(self, format_name, primer5, primer3, flanking_primer5="", flanking_primer3=""):
         self._encode_buffer()  # write everything in the buffer to the file
@@ -397,14 +776,17 @@ class SegmentedWriteDNAFile(WriteDNAFile):
 
         #print "Number of strands in header: ", len(hdr)
 
-        for i,h in enumerate(hdr):
-            self.strands.insert(i,h)
-
         comment = header.encode_file_header_comments(self.output_filename,formatid,\
                                               size,hdr_other,primer5,primer3)
         self.out_fd.write(comment)
         comment = self.encode_segments_header_comments(self.segments)
         self.out_fd.write(comment)
+        self._write_header_strands(hdr)
+        if self.binary:
+            begin = len(hdr)
+            for end in self.segment_ends:
+                self.out_fd.add_segment(begin,len(hdr)+end)
+                begin = len(hdr)+end
         for ss in self.strands:
             if type(ss) is list:
                 for s in ss:
@@ -417,6 +799,50 @@ class SegmentedWriteDNAFile(WriteDNAFile):
         return
 
 
+def _decode_segment(seg,strands,mem_buffer,workers=None,sparse=False):
+    """ Decode the strands of one segment into mem_buffer and return its decoder.
+        The decoded data is not written until only_write() is called on it,
+        unless sparse is set, in which case blocks go to mem_buffer as they
+        are decoded. """
+    formatid,size,bindex,primer5,primer3 = seg
+    dec_func = formats.file_system_decoder(formatid)
+    if sparse:
+        pf = SparseWritePacketizedFilestream(mem_buffer,size,\
+                                             formats.file_system_format_packetsize(formatid),\
+                                             minKey=bindex)
+    else:
+        pf = WritePacketizedFilestream(mem_buffer,size,\
+                                       formats.file_system_format_packetsize(formatid),\
+                                       minKey=bindex)
+    #print primer5, primer3, bindex
+    dec = dec_func(pf,primer5,primer3,bindex)
+    dec.workers = workers
+    dec.decode_many(strands,workers=workers)
+    dec._attempt_final_decoding()
+    #print(dec.strand_errors,dec.block_errors," missing=",dec._packetizedFile.hasMissingKeys())
+    return dec
+
+def _decode_segment_in_worker(args):
+    """ Decode one segment in a worker process. Returns (data, block errors,
+        complete, missing keys, error, stats), where stats only holds what
+        decoding this segment added, so that the parent can merge it.
+    """
+    seg,strands = args
+    saved = stats.all_stats
+    stats.all_stats = {}
+    try:
+        mem_buffer = BytesIO()
+        dec = _decode_segment(seg,strands,mem_buffer)
+        dec.only_write()
+        result = (mem_buffer.getvalue(),dec.block_errors,dec.complete,\
+                  dec._packetizedFile.hasMissingKeys(),None)
+    except Exception as e:
+        result = (b'',0,False,True,e)
+    finally:
+        delta = stats.all_stats
+        stats.all_stats = saved
+    return result + (delta,)
+
 class SegmentedReadDNAFile(ReadDNAFile):
 
     def decode_segments_header(self,other_data):
@@ -484,53 +910,59 @@ class SegmentedReadDNAFile(ReadDNAFile):
             self.preview_mode = kwargs['preview_mode']
         else:
             self.preview_mode = False
-            
+
+        if 'use_single_primer' in kwargs and kwargs['use_single_primer']==True:
+            # strands from sequencing should all have the same primer
+            segs = [ s[0:3] + [self.primer5,self.primer3] for s in segs ]
+
+        # match each non-header strand to its segment once
+        router = SegmentRouter([s[3] for s in segs])
+        routed = router.partition(self.index.strands('nonheader'))
+        self._close_spill()
+
         #print "segments=",segs
 
-        for s in segs:
-            logger.debug("formatid={} size={} bindex={} primer5={} primer3={}".format(s[0],s[1],s[2],s[3],s[4]))                                             
-            formatid = s[0]
-            size = s[1]
-            bindex = s[2]
-            primer5 = s[3]
-            primer3 = s[4]
+        # segments are independent, so they may be decoded in parallel; the
+        # results are still written and checked in segment order
+        segment_workers = kwargs.get('segment_workers',None)
+        if segment_workers != None and segment_workers > 1 and len(segs) > 1:
+            with ProcessPoolExecutor(max_workers=segment_workers) as executor:
+                results = list(executor.map(_decode_segment_in_worker,\
+                                            [ (s,r) for s,r in zip(segs,routed) ]))
+        else:
+            results = None
 
+        for i,s in enumerate(segs):
+            logger.debug("formatid={} size={} bindex={} primer5={} primer3={} strands={}".format(s[0],s[1],s[2],s[3],s[4],len(routed[i])))
             logger.info("{}".format(s))
-            
-            if 'use_single_primer' in kwargs and kwargs['use_single_primer']==True:
-                # strands from sequencing should all have the same primer
-                primer5 = self.primer5
-                primer3 = self.primer3
-
-            dec_func = formats.file_system_decoder(formatid)
-            #self.mem_buffer = BytesIO()
-            self.pf = WritePacketizedFilestream(self.mem_buffer,size,\
-                                                formats.file_system_format_packetsize(formatid),\
-                                                minKey=bindex)
-
-            #print primer5, primer3, bindex
-            self.dec = dec_func(self.pf,primer5,primer3,bindex)
-
-            for s in self.strands:
-                #if s.find(primer5)!=-1:
-                #print "dnafile.py",self.dec.decode_from_phys_to_strand(s)
-                self.dec.decode(s)
-
-            self.dec._attempt_final_decoding()
-            #print(self.dec.strand_errors,self.dec.block_errors," missing=",self.dec._packetizedFile.hasMissingKeys())
-                            
-            if self.preview_mode and (self.dec.block_errors > 0 or not self.dec.complete):
-                print("found errors!",self.dec.block_errors)
-                print("mising=",self.dec._packetizedFile.hasMissingKeys())
+
+            if results is None:
+                self.dec = _decode_segment(s,routed[i],self.mem_buffer,self.workers,self.sparse)
+                self.pf = self.dec._packetizedFile
+                block_errors = self.dec.block_errors
+                complete = self.dec.complete
+                missing = self.dec._packetizedFile.hasMissingKeys()
+            else:
+                data,block_errors,complete,missing,error,delta = results[i]
+                stats.merge(delta)
+                if error is not None:
+                    raise error
+
+            if self.preview_mode and (block_errors > 0 or not complete):
+                print("found errors!",block_errors)
+                print("mising=",missing)
                 break
             else:
-                self.dec.only_write()
+                if results is None:
+                    self.dec.only_write()
+                else:
+                    self.mem_buffer.write(data)
                 write_anyway = 'write_incomplete_file' in kwargs and \
                     kwargs['write_incomplete_file']==True
                 #if self.dec.complete or write_anyway:
                 #    self.dec.write()
                 if not write_anyway:
-                    assert self.dec.complete
+                    assert complete
 
         #print [x for x in self.mem_buffer.getvalue()]
         self.mem_buffer.seek(0,0) # set read point at beginning of buffer
@@ -18,6 +18,18 @@ def DEC_RS_CFC8_200(pf, primer5, primer3, bIndex=0, policy=AllowAll()):
     dec = customize_RS_CFC8(False,pf,primer5,primer3,1,2,2,15,185*15,policy,minIndex=bIndex)
     return dec    
 
+# Large blocks: the outer code works over GF(2^16) on 2-byte symbols, so a
+# block holds 1850 data strands and 700 ecc strands (2 byte intra-block index)
+def ENC_RS16_CFC8_200(pf, primer5, primer3, bIndex=0, policy=NoTolerance()):
+    enc = customize_RS_CFC8(True,pf,primer5,primer3,2,2,2,14,1850*14,policy,minIndex=bIndex,\
+                            outerECCStrands=700,outerCExp=16)
+    return enc
+
+def DEC_RS16_CFC8_200(pf, primer5, primer3, bIndex=0, policy=AllowAll()):
+    dec = customize_RS_CFC8(False,pf,primer5,primer3,2,2,2,14,1850*14,policy,minIndex=bIndex,\
+                            outerECCStrands=700,outerCExp=16)
+    return dec
+
 ### Support for preview - FIXME - move to dnapreview - create registry
 
 def ENC_FSMD_WCUT_160(pf, primer5, primer3, bIndex=0, policy=NoTolerance(),withCut=None):
@@ -80,11 +92,19 @@ def DEC_RS_CFC8_RE4_160(pf, primer5, primer3, bIndex=0, policy=AllowAll()):
 
 ### End support for preview - FIXME - move to dnapreview - create registry
 
+# PacketSize is the packet size a file's packetized stream starts with. The
+# layered encoders and decoders replace it with their block size, so for
+# data formats it is only a nominal, small per-packet size, about the bytes
+# of data in one strand.
+# FSMD formats are the exception: the header is decoded with packets of
+# exactly this size, so it is the header's block size.
 FileSystemFormats = {
     # KEY      KEY    LEN  PacketSize, Abbrev.   Description                   ENCODER       DECODER
     0x0010 : [0x0010, 200, 90, "FSMD", "File system meta-data format", ENC_FSMD_200, DEC_FSMD_200 ],
     0x0020 : [0x0020, 200, 16, "RS+CFC8", "Reed-Solomon coded with ad hoc Comma-free codewords",
               ENC_RS_CFC8_200, DEC_RS_CFC8_200 ],
+    0x0030 : [0x0030, 200, 14, "RS16+CFC8", "GF(2^16) Reed-Solomon outer code for large blocks with ad hoc Comma-free codewords",
+              ENC_RS16_CFC8_200, DEC_RS16_CFC8_200 ],
 
     # Support preview -- support through registry
     0x0011 : [0x0011, 160, 120, "FSMD-1", "File system meta-data format with cut", ENC_FSMD_WCUT_160, DEC_FSMD_WCUT_160 ],
@@ -115,34 +115,30 @@ def encode_file_header(filename,format_id,size,other_data,primer5,primer3,fsmd_a
             
     return strands
 
+def is_nonheader_strand(s,primer5):
+    return not s.startswith(primer5+magic_header)
+
 def pick_nonheader_strands(strands,primer5):
-    others = []
-    picks = []
-    for s in strands:
-        if s.startswith(primer5):            
-            if s.startswith(primer5+magic_header):
-                pass
-            else:
-                others.append(s)
-        else:
-            others.append(s)
-    return others
+    return [ s for s in strands if is_nonheader_strand(s,primer5) ]
+
+def is_header_strand(s,primer5):
+    if s.find(primer5+magic_header)!=-1:
+        return True
+    elif s.find(primer5)!=-1:
+        plen= s.find(primer5)+len(primer5)
+        possible_hdr = s[plen:plen+len(magic_header)]
+        if ed.eval(possible_hdr,magic_header) < 2:
+            #ss = s[:]
+            #ss[plen:plen+len(magic_header)] = magic_header
+            return True
+    return False
 
 def pick_header_strands(strands,primer5):
     picks = []
     others = []
     for s in strands:
-        if s.find(primer5+magic_header)!=-1:
+        if is_header_strand(s,primer5):
             picks.append(s)
-        elif s.find(primer5)!=-1:
-            plen= s.find(primer5)+len(primer5)
-            possible_hdr = s[plen:plen+len(magic_header)]
-            if ed.eval(possible_hdr,magic_header) < 2:
-                #ss = s[:]
-                #ss[plen:plen+len(magic_header)] = magic_header
-                picks.append(s)
-            else:
-                others.append(s)
         else:
             others.append(s)
 
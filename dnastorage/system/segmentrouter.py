@@ -0,0 +1,57 @@
+from dnastorage.util.stats import stats
+from dnastorage.util.approxmatch import primer_window, primer_max_distance
+from dnastorage.system.demux import Demultiplexer
+
+import logging
+logger = logging.getLogger("dna.storage.system.segmentrouter")
+logger.addHandler(logging.NullHandler())
+
+class SegmentRouter:
+    """
+    Send each read to the segments whose 5' primer it carries, so that a
+    segment's decoder only sees its own reads. Each distinct primer is
+    registered with a Demultiplexer, and a read is matched once by its
+    5'-only assignment (Demultiplexer.match5): by prefix, else by the
+    closest approximate match in the first window bases with at most
+    maxDistance edits, the same search PrependSequence makes when decoding.
+
+    Segments that share a primer all receive the reads carrying it. If two
+    primers match equally well, the first one found wins. Reads that match
+    no primer are dropped and counted.
+    """
+    def __init__(self,primers,maxDistance=primer_max_distance,window=primer_window):
+        self.numSegments = len(primers)
+        self.owners = {}   # primer -> [ segment numbers ]
+        for i,p in enumerate(primers):
+            self.owners.setdefault(p,[]).append(i)
+        # primers are their own names
+        self.demux = Demultiplexer(maxDistance=maxDistance,window=window)
+        for p in self.owners:
+            self.demux.add(p,p)
+
+    def route(self,read):
+        """ Return the list of segments that read belongs to. """
+        d,primers = self.demux.match5(read)
+        if len(primers) == 0:
+            return []
+        p = primers[0]
+        if d > 0:
+            stats.inc("SegmentRouter::foundNearby")
+        elif not read.startswith(p):
+            stats.inc("SegmentRouter::found")
+        return self.owners[p]
+
+    def partition(self,reads):
+        """ Return a list with the reads of each segment, in read order. """
+        routed = [ [] for _ in range(self.numSegments) ]
+        unrouted = 0
+        for r in reads:
+            owners = self.route(r)
+            if len(owners) == 0:
+                unrouted += 1
+            for i in owners:
+                routed[i].append(r)
+        if unrouted > 0:
+            stats.inc("SegmentRouter::unrouted",unrouted)
+            logger.debug("{} reads match no segment primer".format(unrouted))
+        return routed
@@ -0,0 +1,115 @@
+from array import array
+
+import dnastorage.system.header as header
+from dnastorage.system.binaryfile import BinaryStrandFile, is_binary_strand_file
+
+import logging
+logger = logging.getLogger("dna.storage.system.strandindex")
+logger.addHandler(logging.NullHandler())
+
+class StrandIndex:
+    """
+    Classify every strand of a strand file in one pass and remember where each
+    class of strands starts in the file. Header decoding, segment decoding and
+    payload decoding then read back only the strands they need from the index
+    instead of rescanning and reclassifying the whole file.
+
+    Classes:
+      'header'    strands that look like header strands for header_primer5
+      'nonheader' strands that do not start with primer5 and the magic header
+      'payload'   nonheader strands that start with primer5
+
+    Comment lines (starting with %) are skipped, as in get_strands. The index
+    accepts a filename, a seekable file object or a BinaryStrandFile; a file
+    object must stay open while strands are read from the index. Offsets into
+    a binary file are record offsets, and if its footer lists the header
+    strands, those are used instead of looking for them. close() releases a
+    binary file that the index opened from a filename.
+    """
+    classes = [ 'header', 'nonheader', 'payload' ]
+
+    def __init__(self,source,primer5,header_primer5=None):
+        self.primer5 = primer5
+        if header_primer5 == None:
+            self.header_primer5 = primer5
+        else:
+            self.header_primer5 = header_primer5
+        self.__offsets = { c : array('q') for c in self.classes }
+        self.binary = None
+        # a binary file opened here is closed by close()
+        self.__opened = False
+        if isinstance(source,str) and is_binary_strand_file(source):
+            source = BinaryStrandFile(source)
+            self.__opened = True
+        if isinstance(source,BinaryStrandFile):
+            self.filename = source.filename
+            self.fd = None
+            self.binary = source
+            self.__scan_records(source)
+        elif isinstance(source,str):
+            self.filename = source
+            self.fd = None
+            with open(source,"rb") as fd:
+                self.__scan_lines(fd)
+        else:
+            self.filename = None
+            self.fd = source
+            self.__scan_text(source)
+        logger.debug("indexed {} header and {} payload strands".format(len(self.__offsets['header']),\
+                                                                      len(self.__offsets['payload'])))
+
+    def __classify(self,s,offset,find_header=True):
+        if find_header and header.is_header_strand(s,self.header_primer5):
+            self.__offsets['header'].append(offset)
+        if header.is_nonheader_strand(s,self.primer5):
+            self.__offsets['nonheader'].append(offset)
+            if s.startswith(self.primer5):
+                self.__offsets['payload'].append(offset)
+
+    def __scan_records(self,f):
+        find_header = len(f.header_offsets) == 0
+        if not find_header:
+            self.__offsets['header'].extend(f.header_offsets)
+        for offset,s in f.records():
+            self.__classify(s,offset,find_header)
+
+    def __scan_lines(self,fd):
+        offset = 0
+        for line in fd:
+            s = line.decode('ascii').strip()
+            if not s.startswith('%'):
+                self.__classify(s,offset)
+            offset += len(line)
+
+    def __scan_text(self,fd):
+        while True:
+            offset = fd.tell()
+            line = fd.readline()
+            if len(line) == 0:
+                break
+            s = line.strip()
+            if not s.startswith('%'):
+                self.__classify(s,offset)
+
+    def count(self,cls):
+        return len(self.__offsets[cls])
+
+    def strands(self,cls):
+        """ Generate the strands of a class in file order. """
+        if self.binary != None:
+            for offset in self.__offsets[cls]:
+                yield self.binary.strand_at(offset)
+        elif self.fd == None:
+            with open(self.filename,"rb") as fd:
+                for offset in self.__offsets[cls]:
+                    fd.seek(offset,0)
+                    yield fd.readline().decode('ascii').strip()
+        else:
+            for offset in self.__offsets[cls]:
+                self.fd.seek(offset,0)
+                yield self.fd.readline().strip()
+
+    def close(self):
+        if self.__opened:
+            self.binary.close()
+            self.__opened = False
@@ -0,0 +1,123 @@
+"""
+Approximate substring matching with Myers' bit-vector algorithm
+(G. Myers, "A fast bit-vector algorithm for approximate string matching
+based on dynamic programming", J. ACM 46(3), 1999).
+
+One sweep over the text gives, for every position, the smallest edit
+distance between the pattern and any substring of the text ending there.
+Each column of the dynamic programming table is kept as two bit-vectors,
+so a sweep costs a handful of integer operations per character of text.
+Python integers have no fixed width, so patterns of any length work.
+"""
+
+import logging
+logger = logging.getLogger("dna.storage.util.approxmatch")
+logger.addHandler(logging.NullHandler())
+
+# primers are looked for near the start of a read: a match must end within
+# the first primer_window+len(primer)-1 bases and have at most
+# primer_max_distance edits
+primer_window = 50
+primer_max_distance = 4
+
+class ApproximateMatcher:
+    """
+    Find where a pattern, e.g. a primer, occurs in a text with at most
+    maxDistance substitutions, insertions and deletions.
+    """
+    def __init__(self,pattern,maxDistance=4):
+        self.pattern = pattern
+        self.maxDistance = maxDistance
+        self.__full = (1 << len(pattern)) - 1
+        self.__high = 1 << (len(pattern)-1) if len(pattern) > 0 else 0
+        # bit i of __peq[c] is set when pattern[i] == c
+        self.__peq = {}
+        for i,c in enumerate(pattern):
+            self.__peq[c] = self.__peq.get(c,0) | (1 << i)
+        self.__reversed = None
+
+    def distances(self,text,anchored=False):
+        """ Return, for each position j of text, the edit distance between the
+            pattern and the best matching substring of text ending at j. If
+            anchored, the substring must start at the beginning of text. """
+        full = self.__full
+        high = self.__high
+        peq = self.__peq
+        pv = full
+        mv = 0
+        score = len(self.pattern)
+        res = []
+        append = res.append
+        for c in text:
+            eq = peq.get(c,0)
+            xv = eq | mv
+            xh = ((((eq & pv) + pv) & full) ^ pv) | eq
+            ph = mv | (~(xh | pv) & full)
+            mh = pv & xh
+            if ph & high:
+                score += 1
+            elif mh & high:
+                score -= 1
+            # unless anchored, a match may start anywhere in the text, so the
+            # top row stays at distance 0 and nothing is shifted in
+            ph = ((ph << 1) | anchored) & full
+            mh = (mh << 1) & full
+            pv = mh | (~(xv | ph) & full)
+            mv = ph & xv
+            append(score)
+        return res
+
+    def find_end(self,text,maxDistance=None):
+        """ Return (distance, end) for the best match in text, where end is
+            one past its last character, or (None, None) if no match is within
+            maxDistance. Of equally good matches, the first one wins; if it
+            ends at several consecutive positions, the last of them does, so
+            that a substitution at the end of the pattern is not mistaken for
+            a deletion. """
+        if maxDistance == None:
+            maxDistance = self.maxDistance
+        res = self.distances(text)
+        if len(res) == 0:
+            return None,None
+        best = min(res)
+        # the end of the first run of positions with the smallest distance
+        end = res.index(best)
+        while end+1 < len(res) and res[end+1] == best:
+            end += 1
+        end += 1
+        if best > maxDistance:
+            return None,None
+        return best,end
+
+    def find_start(self,text,maxDistance=None):
+        """ Return (distance, start) for the best match in text, where start is
+            its first character, or (None, None) if no match is within
+            maxDistance. Of equally good matches, the one nearest the end of
+            text wins. """
+        if self.__reversed == None:
+            self.__reversed = ApproximateMatcher(self.pattern[::-1],self.maxDistance)
+        d,end = self.__reversed.find_end(text[::-1],maxDistance)
+        if d == None:
+            return None,None
+        return d,len(text)-end
+
+    def find(self,text,maxDistance=None):
+        """ Return (distance, start, end) for the best match in text, or
+            (None, None, None) if no match is within maxDistance. """
+        d,end = self.find_end(text,maxDistance)
+        if d == None:
+            return None,None,None
+        # the match ends at end, so it starts within len(pattern)+d before it;
+        # of the starts that give distance d, keep the one whose match is
+        # closest in length to the pattern
+        if self.__reversed == None:
+            self.__reversed = ApproximateMatcher(self.pattern[::-1],self.maxDistance)
+        window = text[max(0,end-len(self.pattern)-d):end][::-1]
+        length = None
+        for j,dj in enumerate(self.__reversed.distances(window,anchored=True)):
+            if dj == d and (length == None or abs(j+1-len(self.pattern)) < abs(length-len(self.pattern))):
+                length = j+1
+        if length == None:
+            # only an empty match is that far from the pattern
+            length = 0
+        return d,end-length,end
@@ -0,0 +1,57 @@
+import pickle
+import tempfile
+
+import logging
+logger = logging.getLogger("dna.storage.util.bucketfile")
+logger.addHandler(logging.NullHandler())
+
+class BucketFile:
+    """
+    Collect items into buckets by key without keeping them all in memory. Items are
+    buffered and, once more than maxBuffered items are pending, every pending bucket is
+    appended as one chunk to a single temporary file. The offsets of each bucket's
+    chunks are kept in memory, so get(key) only reads the chunks of that bucket.
+    Items within a bucket are returned in the order they were added.
+    """
+    def __init__(self,maxBuffered=10000,dir=None):
+        self.__fd = tempfile.TemporaryFile(dir=dir)
+        self.__chunks = {}     # key -> [ (offset,length) ]
+        self.__pending = {}    # key -> [ items ]
+        self.__numPending = 0
+        self.maxBuffered = maxBuffered
+
+    def append(self,key,item):
+        self.__pending.setdefault(key,[]).append(item)
+        self.__numPending += 1
+        if self.__numPending >= self.maxBuffered:
+            self.flush()
+
+    def flush(self):
+        self.__fd.seek(0,2)
+        for key,items in self.__pending.items():
+            data = pickle.dumps(items,protocol=pickle.HIGHEST_PROTOCOL)
+            self.__chunks.setdefault(key,[]).append( (self.__fd.tell(),len(data)) )
+            self.__fd.write(data)
+        logger.debug("flushed {} items in {} buckets".format(self.__numPending,len(self.__pending)))
+        self.__pending = {}
+        self.__numPending = 0
+
+    def get(self,key):
+        items = []
+        for offset,length in self.__chunks.get(key,[]):
+            self.__fd.seek(offset,0)
+            items += pickle.loads(self.__fd.read(length))
+        items += self.__pending.get(key,[])
+        return items
+
+    def keys(self):
+        return sorted(set(self.__chunks.keys()) | set(self.__pending.keys()))
+
+    def __contains__(self,key):
+        return key in self.__chunks or key in self.__pending
+
+    def __len__(self):
+        return len(self.keys())
+
+    def close(self):
+        self.__fd.close()
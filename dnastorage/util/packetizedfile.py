@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import os
 import sys
+import mmap
 
 import logging
 logger = logging.getLogger("dna.storage.util.packetizedfile")
@@ -60,14 +61,8 @@ received in any order. But, the file cannot be written until the file is complet
 
     @property
     def complete(self):
-        if len(self.__data.keys()) < self.numberOfPackets:
-            #print "too few keys {}".format(self.numberOfPackets)
-            return False
-        for i in range(self.minKey,self.maxKey):
-            if not (i in self.__data.keys()):
-                #print "missing key {}".format(i)
-                return False
-        return True
+        # __setitem__ only keeps keys in range(minKey,maxKey)
+        return len(self.__data) >= self.numberOfPackets
 
     def getMissingKeys(self):
         keys = self.__data.keys()
@@ -152,6 +147,97 @@ class WritePacketizedFile(WritePacketizedFilestream):
         WritePacketizedFilestream.__init__(self,open(filename,"wb"),size,packetSize)
         self.__filename = filename
 
+class SparseWritePacketizedFilestream(WritePacketizedFilestream):
+    """
+    Write each packet straight to its place in the file, (key-minKey)*packetSize bytes
+    past the position of fd when the stream is created, instead of buffering packets
+    until write(). The file is extended to its full size up front, which is a sparse
+    file on most file systems, so missing packets read back as zeros. Presence is kept
+    in a bytearray with one byte per packet, so complete is O(1) and getMissingKeys
+    only loops over the missing packets. fd must be seekable and opened for writing
+    and, to read packets back, for reading.
+
+    Decoders set packetSize to their block size, so the bitmap and the file are
+    sized again whenever packetSize is set, which must happen before the first
+    packet is written.
+    """
+    def __init__(self,fd,size,packetSize,minKey=0):
+        WritePacketizedFilestream.__init__(self,fd,size,packetSize,minKey=minKey,zeroFillMissing=True)
+        self.__fd = fd
+        self.__base = fd.tell()
+        self.__allocate()
+
+    def __allocate(self):
+        self.__present = bytearray(self.numberOfPackets)
+        self.__count = 0
+        self.__fd.truncate(self.__base)
+        if self.size > 0:
+            # extend the file, which leaves a hole on most file systems
+            self.__fd.seek(self.__base+self.size-1,0)
+            self.__fd.write(bytes(1))
+
+    # packet property
+    def __set_packetSize(self,val):
+        assert self.__count == 0, "packetSize can't change once packets are written"
+        WritePacketizedFilestream.packetSize.fset(self,val)
+        self.__allocate()
+    def __get_packetSize(self):
+        return WritePacketizedFilestream.packetSize.fget(self)
+    packetSize = property(__get_packetSize,__set_packetSize)
+
+    def __offset(self,key):
+        return self.__base + (key-self.minKey)*self.packetSize
+
+    def has_key(self,key):
+        return key >= self.minKey and key < self.maxKey and self.__present[key-self.minKey] == 1
+
+    def __setitem__(self,key,value):
+        if (key >= self.minKey) and (key < self.maxKey):
+            if key == self.maxKey-1:
+                value = value[0:self.lastPacketSize]
+            self.__fd.seek(self.__offset(key),0)
+            self.__fd.write(value)
+            if self.__present[key-self.minKey] == 0:
+                self.__present[key-self.minKey] = 1
+                self.__count += 1
+        else:
+            logger.warning("packet {} is not in range [{},{})".format(key,self.minKey,self.maxKey))
+
+    def __getitem__(self,key):
+        assert self.has_key(key)
+        self.__fd.seek(self.__offset(key),0)
+        if key == self.maxKey-1:
+            return self.__fd.read(self.lastPacketSize)
+        return self.__fd.read(self.packetSize)
+
+    @property
+    def complete(self):
+        return self.__count == self.numberOfPackets
+
+    def getMissingKeys(self):
+        missing = []
+        i = self.__present.find(0)
+        while i != -1:
+            missing.append(self.minKey+i)
+            i = self.__present.find(0,i+1)
+        return missing
+
+    def hasMissingKeys(self):
+        return not self.complete
+
+    def write(self):
+        # packets are already in place, leave the cursor at the end of the data
+        self.__fd.seek(self.__base+self.size,0)
+        self.__fd.flush()
+
+class SparseWritePacketizedFile(SparseWritePacketizedFilestream):
+    def __init__(self,filename,size,packetSize,minKey=0):
+        SparseWritePacketizedFilestream.__init__(self,open(filename,"w+b"),size,packetSize,minKey)
+        self.__filename = filename
+    @property
+    def filename(self):
+        return self.__filename
+
 
 
 class ReadPacketizedFilestream:
@@ -229,6 +315,61 @@ class ReadPacketizedFile(ReadPacketizedFilestream):
     def filename(self):
         return self.__filename
 
+class MappedReadPacketizedFile(ReadPacketizedFilestream):
+    """
+    Read a file through mmap. Packets are memoryview slices of the mapping rather
+    than copies; only a padded last packet is copied. Packets refer to the mapping,
+    so the mapping stays alive until they are released even after close().
+    """
+    def __init__(self,filename):
+        self.__fd = open(filename,"rb")
+        ReadPacketizedFilestream.__init__(self,self.__fd)
+        self.__filename = filename
+        if os.fstat(self.__fd.fileno()).st_size > 0:
+            self.__map = mmap.mmap(self.__fd.fileno(),0,access=mmap.ACCESS_READ)
+            self.__view = memoryview(self.__map)
+        else:
+            # mmap can't map an empty file
+            self.__map = None
+            self.__view = memoryview(b'')
+        self.__pos = 0
+        self.__read_size = 0
+
+    def read(self):
+        b = self.__view[self.__pos:self.__pos+self.packetSize]
+        self.__pos += len(b)
+        self.__read_size += len(b)
+        if len(b) > 0 and len(b) != self.packetSize and not self._RS:
+            b = bytes(b).ljust(self.packetSize,bytes(1))
+        return b
+
+    def __iter__(self):
+        self.__pos = 0
+        return self
+
+    def __getitem__(self,key):
+        self.__pos = key*self.packetSize
+        return self.read()
+
+    @property
+    def size(self):
+        return len(self.__view)
+    @property
+    def bytes_read(self):
+        return self.__read_size
+    @property
+    def filename(self):
+        return self.__filename
+
+    def close(self):
+        self.__view = memoryview(b'')
+        if self.__map != None:
+            try:
+                self.__map.close()
+            except BufferError:
+                pass # packets still in use, the mapping goes away with them
+        self.__fd.close()
+
 
 if __name__ == "__main__":
     import os
@@ -36,6 +36,20 @@ class dnastats:
             name += "::"+random_string(5)
         self.all_stats[name] = val            
         
+    # Use merge to fold in stats collected elsewhere, e.g. in a worker
+    # process: counters are added, lists are concatenated and any other
+    # value is kept under a unique name if the name is already taken.
+    def merge(self, all_stats):
+        for name,val in all_stats.items():
+            if not name in self.all_stats:
+                self.all_stats[name] = val
+            elif isinstance(val,list):
+                self.all_stats[name] = self.all_stats[name] + val
+            elif isinstance(val,(int,float)) and isinstance(self.all_stats[name],(int,float)):
+                self.all_stats[name] = self.all_stats[name] + val
+            else:
+                self.unique(name,val)
+
     def __getitem__(self, name):
         return self.all_stats[name]
 
@@ -132,6 +132,22 @@ class phys_py_tests(unittest.TestCase):
         assert match / 10000 * 100 > 90.0
         #print (match / 10000.0 * 100)
 
+    def test_prepend_append_with_indels(self):
+        pre = PrependSequence('CAGGTACGCAGTTAGCACTC',isPrimer=True,Policy=AllowAll())
+        app = AppendSequence('CGTGGCAATATGACTACGGA',CodecObj=pre,isPrimer=True,Policy=AllowAll())
+        strand = 'GATTACA'*10
+        phys = app.encode(strand)
+        # a deletion in the 5' primer and an insertion in the 3' primer
+        assert app.decode(phys[:5]+phys[6:]) == strand
+        assert app.decode(phys[:-5]+'T'+phys[-5:]) == strand
+        assert app.decode('TTT'+phys[:2]+'C'+phys[3:]) == strand
+        tight = PrependSequence('CAGGTACGCAGTTAGCACTC',isPrimer=True,Policy=AllowAll(),maxDistance=1)
+        try:
+            tight.decode('CAGTTACGCTGTTAGCACTC'+strand)
+            assert False
+        except DNAMissingPrimer:
+            pass
+
 
 from dnastorage.codec.commafreecodec import *
 class commafreecodec_py_tests(unittest.TestCase):
@@ -144,6 +160,32 @@ class commafreecodec_py_tests(unittest.TestCase):
         for x,x2 in zip(x,x_out):
             assert x==x2
 
+    def test_commafreecodec_exact_vote(self):
+        cfc = CommaFreeCodewords(20)
+        x_enc = cfc.encode([ randint(0,255) for x in range(20) ])
+        x_enc.insert(3, "N")
+        x_enc.insert(9, "GA")
+        for strand in [ "".join(x_enc), "ACG", "", "CGTGAGCA" ]:
+            expected = [ cfc_inv.get(strand[i:i+8]) for i in range(len(strand)) ]
+            assert cfc.exact_vote(strand) == expected
+        assert kmer_value('CGTGAGCA') == int('12320210',4)
+        assert cfc_table[kmer_value('CGTGAGCA')] == 0
+
+    def test_commafreecodec_inexact_vote(self):
+        for w in [ 'CGTGAGCA', 'CGTGAGC', 'CGTGNGCA', 'CGTAGCAT', 'AAAAAAAA', 'CGTAGAG', '' ]:
+            close = sorted([ (ed.eval(w,c),i) for i,c in enumerate(cfc) ])
+            d,picks = nearest_codewords(w)
+            if close[0][0] > 2:
+                assert d == None and picks == ()
+            else:
+                assert d == close[0][0]
+                assert picks == tuple([ cfc[i] for x,i in close if x == d ])
+        votes = []
+        for _ in range(2):
+            cfc8 = CommaFreeCodewords(20,seed=7)
+            votes.append([ cfc8.inexact_vote('CGTAGAG') for _ in range(10) ])
+        assert votes[0] == votes[1]
+
     def test_commafreecodec_with_faults(self):
         cfc = CommaFreeCodewords(1000)
         x = [ x%256 for x in range(1000) ]
@@ -160,9 +202,122 @@ class commafreecodec_py_tests(unittest.TestCase):
         for x,x2 in zip(x,x_out):
             assert x==x2
 
+from dnastorage.codec.reedsolomon.rs import ReedSolomon,get_reed_solomon,packaged_table_file
+class reedsolomon_py_tests(unittest.TestCase):
+    ''' Check that the numpy backend matches the python Reed-Solomon implementation '''
+    def test_numpy_backend_matches(self):
+        rs = get_reed_solomon(c_exp=8)
+        rs_np = get_reed_solomon(c_exp=8,backend="numpy")
+        for _ in range(100):
+            message = [ randint(0,255) for _ in range(randint(1,40)) ]
+            nsym = randint(2,20)
+            codeword = rs.rs_encode_msg(message,nsym)
+            assert codeword == rs_np.rs_encode_msg(message,nsym)
+            for p in range(0,nsym//2):
+                codeword[p] ^= randint(1,255)
+            assert rs.rs_correct_msg(codeword,nsym) == rs_np.rs_correct_msg(codeword,nsym)
+            assert rs_np.rs_correct_msg(codeword,nsym)[0] == message
+
+    def test_chien_forney_matches(self):
+        import random
+        for c_exp in [8,16]:
+            rs = get_reed_solomon(c_exp=c_exp)
+            rs_np = get_reed_solomon(c_exp=c_exp,backend="numpy")
+            nsym = 16
+            for errors in range(1,nsym//2+1):
+                for fcr in [0,1]:
+                    message = [ randint(0,2**c_exp-1) for _ in range(60) ]
+                    codeword = rs.rs_encode_msg(message,nsym,fcr=fcr)
+                    erase_pos = random.sample(range(len(codeword)),nsym-2*errors)
+                    for p in random.sample(range(len(codeword)),errors):
+                        codeword[p] ^= randint(1,2**c_exp-1)
+                    synd = rs.rs_calc_syndromes(codeword,nsym,fcr)
+                    assert synd == rs_np.rs_calc_syndromes(codeword,nsym,fcr)
+                    fsynd = rs.rs_forney_syndromes(synd,erase_pos,len(codeword))
+                    err_loc = rs.rs_find_error_locator(fsynd,nsym,erase_count=len(erase_pos))
+                    err_pos = rs.rs_find_errors(err_loc[::-1],len(codeword))
+                    assert sorted(err_pos) == sorted(rs_np.rs_find_errors(err_loc[::-1],len(codeword)))
+                    # both are table driven, so check against evaluating at every point
+                    roots = [ len(codeword)-1-i for i in range(len(codeword)) \
+                              if rs.gf_poly_eval(err_loc[::-1],rs.gf_pow(2,i)) == 0 ]
+                    assert sorted(err_pos) == sorted(roots)
+                    corrected = rs.rs_correct_errata(codeword,synd,erase_pos+err_pos,fcr)
+                    assert corrected == rs_np.rs_correct_errata(codeword,synd,erase_pos+err_pos,fcr)
+                    assert corrected[:60] == message
+
+    def test_generator_poly_cache(self):
+        rs = ReedSolomon(generator=2,c_exp=8,prim=0x18d,cache_size=4)
+        g = rs.rs_generator_poly_cached(10)
+        assert g == rs.rs_generator_poly(10)
+        assert rs.rs_generator_poly_cached(10) is g
+        for nsym in range(1,10):
+            rs.rs_generator_poly_cached(nsym)
+        assert len(rs._gen_cache) == 4
+
+    def test_shared_fields(self):
+        import pickle
+        for c_exp,prim in [(8,0x18d),(16,0x1002d)]:
+            rs = get_reed_solomon(c_exp=c_exp,backend="numpy")
+            assert get_reed_solomon(c_exp=c_exp,backend="numpy") is rs
+            assert pickle.loads(pickle.dumps(rs)) is rs
+            assert packaged_table_file(c_exp,prim) is not None
+            computed = ReedSolomon(generator=2,c_exp=c_exp,prim=prim)
+            assert rs.gf_exp == computed.gf_exp
+            assert rs.gf_log == computed.gf_log
+            # a field whose tables were computed is a different object
+            rs_computed = get_reed_solomon(c_exp=c_exp,backend="numpy",use_tables=False)
+            assert rs_computed is not rs
+            assert get_reed_solomon(c_exp=c_exp,backend="numpy",use_tables=False) is rs_computed
+            assert pickle.loads(pickle.dumps(rs_computed)) is rs_computed
+
+    def test_batch_decode(self):
+        for backend in ["python","numpy"]:
+            rs = get_reed_solomon(c_exp=8,backend=backend)
+            messages = [ [ randint(0,255) for _ in range(20) ] for _ in range(10) ]
+            codewords = [ rs.rs_encode_msg(m,6) for m in messages ]
+            received = [ list(c) for c in codewords ]
+            received[2][5] ^= 0x11
+            received[4][0:2] = [-1,-1]
+            received[7][0:7] = [-1]*7
+            out, errors, clean = rs.rs_correct_msg_batch(received,6)
+            assert clean == 7
+            assert list(errors.keys()) == [7]
+            # syndromes computed by either backend can be passed in
+            synds = get_reed_solomon(c_exp=8,backend="numpy").rs_calc_syndromes_batch(received,6)
+            assert [ list(s) for s in synds ] == get_reed_solomon(c_exp=8).rs_calc_syndromes_batch(received,6)
+            out2, errors2, clean2 = rs.rs_correct_msg_batch(received,6,synds=synds)
+            assert clean2 == 7 and list(errors2.keys()) == [7]
+            assert [ list(x) for x in out2 ] == [ list(x) for x in out ]
+            for i in range(10):
+                if i != 7:
+                    assert [ int(x) for x in out[i] ] == codewords[i]
+
+
 from dnastorage.codec.block import *
 class block_py_tests(unittest.TestCase):
     ''' Check the logic for breaking up blocks of the outer code into a strands for the inner code. '''
+    def test_partitionStrandsIntoBlocks(self):
+        strands = [ [2,0,1], [1,0,2], [2,0,3], [0,1,4], [1,0,5] ]
+        blocks = list(partitionStrandsIntoBlocks(strands,2))
+        assert blocks == [ (2,[[2,0,1],[2,0,3]]), (1,[[1,0,2],[1,0,5]]), (256,[[0,1,4]]) ]
+        blocks = partitionStrandsIntoBlocks(strands,2,sort=True)
+        assert next(blocks) == (1,[[1,0,2],[1,0,5]])
+        assert list(blocks) == [ (2,[[2,0,1],[2,0,3]]), (256,[[0,1,4]]) ]
+        assert list(partitionStrandsIntoBlocks(strands,2,indices=[0,0,1,1,0])) == \
+            [ (0,[[2,0,1],[1,0,2],[1,0,5]]), (1,[[2,0,3],[0,1,4]]) ]
+
+    def test_doMajorityVote(self):
+        single = [9,0,0,1,2]
+        strands = [ [1,0,0,5,6,7], [2,0,0,1], single, [1,0,0,5,8,7,3], [2,0,0,3],
+                    [1,0,0,4,8,9], [2,0,0,2,2] ]
+        voted = doMajorityVote(strands)
+        # keys in order of first appearance, ties go to the first value seen
+        assert voted == [ [1,0,0,5,8,7,3], [2,0,0,1,2], single ]
+        assert voted[2] is single
+        voted = doMajorityVote(strands,weights=[1,1,1,1,1,3,1])
+        assert voted[0] == [1,0,0,4,8,9,3]
+        assert doMajorityVote([ ['a','b'], ['a','c'], ['a','c'] ],indexBytes=0) == [ ['a','c'] ]
+
     def test_BlockToStrand(self):
         b2s = BlockToStrand(20,80,Policy=AllowAll())
         x = [ randint(0,255) for x in range(4*20) ]
@@ -173,7 +328,41 @@ class block_py_tests(unittest.TestCase):
         assert index == 2323
         assert x == y
         #print (index, y)
-        #print (sum([ (a-b)**2 for a,b in zip(x,y) ]))    
+        #print (sum([ (a-b)**2 for a,b in zip(x,y) ]))
+
+    def test_ReedSolomonOuterCodec_batch_encode(self):
+        ''' batched outer encoding must match the column-by-column python encoder '''
+        rs_py = ReedSolomonOuterCodec(15*185,70,15,backend="python")
+        rs_np = ReedSolomonOuterCodec(15*185,70,15)
+        for size in [15*185, 15*100+7]:
+            x = [ randint(0,255) for _ in range(size) ]
+            assert rs_py.encode( (1,x) ) == rs_np.encode( (1,x) )
+
+    def test_ReedSolomonOuterCodec_missing_strands(self):
+        ''' missing strands erase every column at the same positions '''
+        for backend in ["python","numpy"]:
+            rs = ReedSolomonOuterCodec(15*185,70,15,backend=backend,Policy=AllowAll())
+            x = [ randint(0,255) for _ in range(15*185) ]
+            index,y = rs.encode( (5,x) )
+            for strand in range(0,255,4):
+                y[strand*15:strand*15+15] = [-1]*15
+            y[2*15+3] ^= 0x21
+            index,z = rs.decode( (5,y) )
+            assert z == x
+
+    def test_ReedSolomonOuterCodec_gf16(self):
+        ''' 2-byte symbols let a block hold more than 255 strands '''
+        rs = ReedSolomonOuterCodec(14*600,100,14,c_exp=16,Policy=AllowAll())
+        x = [ randint(0,255) for _ in range(14*600) ]
+        index,y = rs.encode( (3,x) )
+        assert len(y) == 14*700
+        for strand in range(0,700,25):
+            # lose whole strands and a single byte of others
+            y[strand*14:strand*14+14] = [-1]*14
+            y[(strand+1)*14+5] ^= 0x5a
+        index,z = rs.decode( (3,y) )
+        assert index == 3
+        assert z == x
 
 
 
@@ -261,6 +450,115 @@ class LayeredCodec_py_tests(unittest.TestCase):
             val = convertBytesToInt(b)
             assert val == y
             y = y+1
-            
+
+    def test_layered_decoder_workers(self):
+        ''' decoding blocks in worker processes matches serial decoding '''
+        from dnastorage.codec.builder import customize_RS_CFC8
+        from dnastorage.util.stats import stats
+        data = bytearray([ randint(0,255) for _ in range(15*185*6+100) ])
+        enc = customize_RS_CFC8(True,ReadPacketizedFilestream(BytesIO(data)),'AAAG','TTTG',Policy=AllowAll())
+        strands = [ s for ss in enc for s in ss ]
+        strands = [ s for i,s in enumerate(strands) if i%7 != 3 ]
+
+        outputs = []
+        for workers in [None,2]:
+            wbuff = BytesIO()
+            wpf = WritePacketizedFilestream(wbuff,len(data),15*185)
+            dec = customize_RS_CFC8(False,wpf,'AAAG','TTTG',Policy=AllowAll())
+            dec.workers = workers
+            dec.chunksize = 2
+            for s in strands:
+                dec.decode(s)
+            before = stats.all_stats.get("RSOuterCodec::fully_correct",0)
+            dec.write()
+            assert stats["RSOuterCodec::fully_correct"] - before == 7
+            outputs.append(wbuff.getvalue())
+        assert outputs[0] == outputs[1] == bytes(data)
+
+    def test_layered_decode_many(self):
+        ''' decode_many in worker processes gives the same strands and counters as decode '''
+        from dnastorage.codec.builder import customize_RS_CFC8
+        data = bytearray([ randint(0,255) for _ in range(15*185*2) ])
+        enc = customize_RS_CFC8(True,ReadPacketizedFilestream(BytesIO(data)),'AAAG','TTTG',Policy=AllowAll())
+        reads = [ s for ss in enc for s in ss ]
+        reads[10] = reads[10][:40] + reads[10][60:]
+        reads[20] = 'ACGT'*20
+
+        results = []
+        for workers in [None,2]:
+            dec = customize_RS_CFC8(False,WritePacketizedFilestream(BytesIO(),len(data),15*185),'AAAG','TTTG',Policy=NoTolerance())
+            strands = dec.decode_many(reads,workers=workers,chunksize=100)
+            assert strands == dec.all_strands
+            results.append( (strands,dec.strand_errors) )
+        assert results[0] == results[1]
+        assert results[0][1] == 2
+
+from dnastorage.codec.pipeline import compile_encode_pipeline
+from dnastorage.codec.commafreecodec import cfc
+class pipeline_py_tests(unittest.TestCase):
+    ''' Check that the compiled encoding pipeline matches the codecs '''
+    def chain(self,pol,primer5):
+        strandCodec = ReedSolomonInnerCodec(2,Policy=pol)
+        codewords = CommaFreeCodewords(14,Policy=pol)
+        cut = InsertMidSequence('AGGTACCA',Policy=pol)
+        pre = PrependSequence(primer5,CodecObj=cut,isPrimer=True,Policy=pol)
+        app = AppendSequence('CGTGGCAATATGACTACGGA',CodecObj=pre,isPrimer=True,Policy=pol)
+        flank = AppendSequence('CCTCGGTTCTTCTTGACCAG',CodecObj=app,isPrimer=True,Policy=pol)
+        return strandCodec,codewords,CombineCodewords(),flank
+
+    def test_pipeline_matches_codecs(self):
+        for n in (9,12):
+            strands = [ [ randint(0,255) for _ in range(n) ] for _ in range(100) ]
+            # a 5' primer made of the codeword for byte 7 is already present
+            # in every strand holding a 7
+            for primer5 in ('CAGGTACGCAGTTAGCACTC',cfc[7]):
+                codecs = self.chain(AllowAll(),primer5)
+                pipeline = compile_encode_pipeline(*codecs)
+                assert pipeline != None
+                expected = [ codecs[3].encode(codecs[2].encode(codecs[1].encode(codecs[0].encode(s)))) \
+                             for s in strands ]
+                assert pipeline.encode(strands) == expected
+
+        pipeline = compile_encode_pipeline(*self.chain(NoTolerance(),cfc[7]))
+        try:
+            pipeline.encode([ [7]*9 ])
+            assert False
+        except DNAStrandPoorlyFormed:
+            pass
+        assert compile_encode_pipeline(ReedSolomonInnerCodec(2),DenseCodewords(14),\
+                                       CombineCodewords(),PrependSequence('ACGT')) == None
+
+class batch_py_tests(unittest.TestCase):
+    ''' Check that encode_batch and decode_batch match encode and decode '''
+    def test_batch_matches_single(self):
+        strandCodec = ReedSolomonInnerCodec(2)
+        codewords = CommaFreeCodewords(11,seed=1)
+        combine = CombineCodewords()
+        cut = InsertMidSequence('AGGTACCA')
+        pre = PrependSequence('CAGGTACGCAGTTAGCACTC',CodecObj=cut,isPrimer=True)
+        app = AppendSequence('CGTGGCAATATGACTACGGA',CodecObj=pre,isPrimer=True)
+        strands = [ [ randint(0,255) for _ in range(9) ] for _ in range(200) ]
+
+        phys = app.encode_batch(combine.encode_batch(codewords.encode_batch(strandCodec.encode_batch(strands))))
+        assert phys == [ app.encode(combine.encode(codewords.encode(strandCodec.encode(s)))) for s in strands ]
+
+        reads = []
+        for i,p in enumerate(phys):
+            r = list(p)
+            for _ in range(i%4):
+                r[randint(0,len(r)-1)] = 'T'
+            reads.append("".join(r))
+        reads += [ 'ACGT'*30, '' ]
+
+        def single(r):
+            try:
+                return strandCodec.decode(codewords.decode(app.decode(r)))
+            except DNAStorageError as e:
+                return type(e)
+        batch = strandCodec.decode_batch(codewords.decode_batch(app.decode_batch(reads)))
+        batch = [ type(b) if isinstance(b,DNAStorageError) else b for b in batch ]
+        assert batch == [ single(r) for r in reads ]
+        assert batch[0] == strands[0] and batch[-1] == DNAMissingPrimer
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,7 @@
 from io import BytesIO
 import os
 import sys
+import threading
 from random import randint
 import unittest
 
@@ -49,6 +50,159 @@ class dnafile_py_test(unittest.TestCase):
             i = i+1
         rf.close()
 
+    def test_dnafile_workers(self):
+        wf = DNAFile.open("out.dna","w",primer3='TTTG',primer5='AAAG',format_name='RS+CFC8')
+        for i in range(3000):
+            wf.write( bytearray(convertIntToBytes(i,4)) )
+        wf.close()
+        rf = DNAFile.open("out.dna","r",primer3='TTTG',primer5='AAAG',workers=2)
+        for i in range(3000):
+            assert convertBytesToInt(rf.read(4)) == i
+        assert len(rf.read(4)) == 0
+        rf.close()
+
+    def test_dnafile_streaming(self):
+        wf = DNAFile.open("out.dna","w",primer3='TTTG',primer5='AAAG',format_name='RS+CFC8')
+        for i in range(3000):
+            wf.write( bytearray(convertIntToBytes(i,4)) )
+        wf.close()
+        rf = DNAFile.open("out.dna","r",primer3='TTTG',primer5='AAAG',streaming=True,max_inflight_blocks=1)
+        assert isinstance(rf,StreamingReadDNAFile)
+        for i in range(3000):
+            assert convertBytesToInt(rf.read(4)) == i
+        assert len(rf.read(4)) == 0
+        rf.close()
+
+    def test_dnafile_streaming_write(self):
+        wf = DNAFile.open("out.dna","w",primer3='TTTG',primer5='AAAG',format_name='RS+CFC8',streaming=True)
+        assert isinstance(wf,StreamingWriteDNAFile)
+        for i in range(3001):
+            wf.write( bytearray(convertIntToBytes(i,4)) )
+        wf.close()
+        with open("out.dna") as fd:
+            assert fd.readline().startswith("% dnastorage version")
+            assert fd.readline() == "% {} \n".format(3001*4)
+        rf = DNAFile.open("out.dna","r",primer3='TTTG',primer5='AAAG')
+        for i in range(3001):
+            assert convertBytesToInt(rf.read(4)) == i
+        assert len(rf.read(4)) == 0
+        rf.close()
+
+    def test_dnafile_sparse(self):
+        wf = DNAFile.open("out.dna","w",primer3='TTTG',primer5='AAAG',format_name='RS+CFC8')
+        for i in range(2000):
+            wf.write( bytearray(convertIntToBytes(i,4)) )
+        wf.close()
+        rf = DNAFile.open("out.dna","r",primer3='TTTG',primer5='AAAG',sparse=True)
+        # the decoder sized the packets as blocks of 185*15 bytes
+        assert isinstance(rf.pf,SparseWritePacketizedFilestream)
+        assert rf.pf.packetSize == 185*15 and rf.pf.numberOfPackets == 3
+        assert rf.pf.complete and rf.pf.getMissingKeys() == []
+        for i in range(2000):
+            assert convertBytesToInt(rf.read(4)) == i
+        assert len(rf.read(4)) == 0
+        rf.close()
+
+    def test_dnafile_input_file(self):
+        # zero runs exercise the zero-strand filter on array blocks
+        data = bytes(1000) + bytes([ randint(0,255) for _ in range(4000) ]) + bytes(3000)
+        with open("out.bin","wb") as fd:
+            fd.write(data)
+        wf = DNAFile.open("out.dna","w",primer3='TTTG',primer5='AAAG',format_name='RS+CFC8')
+        wf.write(data)
+        wf.close()
+        with open("out.dna") as fd:
+            expected = fd.read()
+        for streaming in [ False, True ]:
+            wf = DNAFile.open("out.dna","w",primer3='TTTG',primer5='AAAG',format_name='RS+CFC8',\
+                              streaming=streaming,input_file="out.bin")
+            assert isinstance(wf.pf,MappedReadPacketizedFile)
+            wf.close()
+            rf = DNAFile.open("out.dna","r",primer3='TTTG',primer5='AAAG')
+            assert rf.read(len(data)+1) == data
+            rf.close()
+            if not streaming:
+                with open("out.dna") as fd:
+                    assert fd.read() == expected
+        os.remove("out.bin")
+
+    def test_dnafile_pipe(self):
+        wf = DNAFile.open("out.dna","w",primer3='TTTG',primer5='AAAG',format_name='RS+CFC8')
+        for i in range(1000):
+            wf.write( bytearray(convertIntToBytes(i,4)) )
+        wf.close()
+        with open("out.dna") as fd:
+            text = fd.read()
+        for cls in [ ReadDNAFile, StreamingReadDNAFile ]:
+            # a pipe cannot seek, like stdin
+            r,w = os.pipe()
+            def write_pipe(w=w):
+                with os.fdopen(w,"w") as out_fd:
+                    out_fd.write(text)
+            writer = threading.Thread(target=write_pipe)
+            writer.start()
+            with os.fdopen(r,"r") as in_fd:
+                assert not in_fd.seekable()
+                rf = cls(in_fd=in_fd,primer3='TTTG',primer5='AAAG')
+                for i in range(1000):
+                    assert convertBytesToInt(rf.read(4)) == i
+                assert len(rf.read(4)) == 0
+                rf.close()
+            writer.join()
+
+from dnastorage.system.strandindex import StrandIndex
+class strandindex_py_test(unittest.TestCase):
+    """ test strand index. """
+    def test_strandindex(self):
+        wf = DNAFile.open("out.dna","w",primer3='TTTG',primer5='AAAG',format_name='RS+CFC8')
+        for i in range(100):
+            wf.write( bytearray(convertIntToBytes(i,4)) )
+        wf.close()
+        with open("out.dna") as fd:
+            strands = get_strands(fd)
+        index = StrandIndex("out.dna",'AAAG')
+        hdr,others = pick_header_strands(strands,'AAAG')
+        assert list(index.strands('header')) == hdr
+        assert list(index.strands('nonheader')) == pick_nonheader_strands(strands,'AAAG')
+        assert index.count('payload') == len([ s for s in others if s.startswith('AAAG') ])
+        with open("out.dna") as fd:
+            assert list(StrandIndex(fd,'AAAG').strands('payload')) == list(index.strands('payload'))
+        h = decode_file_header(list(index.strands('header')),'AAAG','TTTG')
+        assert h['size'] == 400
+
+from dnastorage.system.binaryfile import *
+class binaryfile_py_test(unittest.TestCase):
+    """ test binary strand files. """
+    def test_pack_strand(self):
+        for s in [ '', 'A', 'ACGTT', 'TTTTGGGGCCCCAAAA', 'ACGTNACGT' ]:
+            assert unpack_strand(pack_strand(s)+b'x',0) == (s,len(pack_strand(s)))
+
+    def test_binaryfile(self):
+        wf = DNAFile.open("out.dnab","w",primer3='TTTG',primer5='AAAG',format_name='RS+CFC8')
+        for i in range(1000):
+            wf.write( bytearray(convertIntToBytes(i,4)) )
+        wf.close()
+        assert is_binary_strand_file("out.dnab")
+        rf = DNAFile.open("out.dnab","r",primer3='TTTG',primer5='AAAG')
+        for i in range(1000):
+            assert convertBytesToInt(rf.read(4)) == i
+        assert len(rf.read(4)) == 0
+        rf.close()
+        # the index opened the binary file, so closing the reader closes it
+        assert rf.index.binary.buf.closed and rf.index.binary.fd.closed
+
+        convert_binary_to_text("out.dnab","out.dna")
+        convert_text_to_binary("out.dna","out2.dnab",'AAAG')
+        b = BinaryStrandFile("out.dnab")
+        b2 = BinaryStrandFile("out2.dnab")
+        with open("out.dna") as fd:
+            assert get_strands(fd) == list(b) == list(b2)
+        assert b.header_offsets == b2.header_offsets and b.comments == b2.comments
+        b.close()
+        b2.close()
+        os.remove("out.dnab")
+        os.remove("out2.dnab")
+
 from dnastorage.codec.base_conversion import convertIntToBytes, convertBytesToInt      
 class segmentedfile_py_test(unittest.TestCase):
     """ test stats. """
@@ -74,5 +228,70 @@ class segmentedfile_py_test(unittest.TestCase):
         rf.close()
         assert out == [_ for _ in range(30)]
         
+from dnastorage.system.segmentrouter import SegmentRouter
+class segmentrouter_py_test(unittest.TestCase):
+    """ test routing reads to segments by primer. """
+    def test_route(self):
+        p1 = 'A'*19+'G'
+        p2 = 'AT'+'A'*17+'G'
+        p3 = 'C'*19+'G'
+        router = SegmentRouter([p1,p2,p3,p3])
+        body = 'GATTACA'*10
+        assert router.route(p1+body) == [0]
+        assert router.route(p2+body) == [1]
+        assert router.route(p3+body) == [2,3]
+        # behind a flanking primer, and with a damaged primer
+        assert router.route('TGCA'+p2+body) == [1]
+        assert router.route('C'*10+'T'+'C'*8+'G'+body) == [2,3]
+        assert router.route('GT'*40) == []
+        routed = router.partition([p2+body,p1+body,'GT'*40,p2+'CC'])
+        assert routed == [ [p1+body], [p2+body,p2+'CC'], [], [] ]
+
+    def test_segmented_workers(self):
+        wf = SegmentedWriteDNAFile(primer3='T'*19+'G',primer5='A'*19+'G',format_name='RS+CFC8+RE1',output="out.dna",fsmd_abbrev='FSMD-1')
+        for i in range(20):
+            wf.write( bytes([x for x in convertIntToBytes(i,4)]) )
+        wf.new_segment('RS+CFC8+RE2','AT'+'A'*17+'G','TA'+'T'*17+'G')
+        for i in range(20,50):
+            wf.write( bytes([x for x in convertIntToBytes(i,4)]) )
+        wf.close()
+        serial = SegmentedReadDNAFile(primer3='T'*19+'G',primer5='A'*19+'G',input="out.dna",fsmd_abbrev='FSMD-1')
+        parallel = SegmentedReadDNAFile(primer3='T'*19+'G',primer5='A'*19+'G',input="out.dna",fsmd_abbrev='FSMD-1',segment_workers=2)
+        data = serial.read(-1)
+        assert data == parallel.read(-1)
+        assert [ convertBytesToInt(data[i:i+4]) for i in range(0,len(data),4) ] == list(range(50))
+        serial.close()
+        parallel.close()
+
+from random import shuffle
+from dnastorage.system.demux import Demultiplexer
+class demux_py_test(unittest.TestCase):
+    """ test splitting a pooled run between files. """
+    def test_demux(self):
+        pairs = { 'a' : ('CAGGTACGCAGTTAGCACTC','CGTGGCAATATGACTACGGA'),
+                  'b' : ('AGTCTTGCAGGATCGAGCTA','TCGGATCCTAGACTGCAATC'),
+                  'c' : ('GTTCAGCATACGTCGATGAC','ACATCGTGACCTAGGCTAGT') }
+        data = { n : bytes([ randint(0,255) for _ in range(300) ]) for n in pairs }
+        pool = []
+        for n,(p5,p3) in pairs.items():
+            wf = WriteDNAFile(primer5=p5,primer3=p3,format_name='RS+CFC8+RE1',output="out.dna",fsmd_abbrev='FSMD')
+            wf.write(data[n])
+            wf.close()
+            with open("out.dna","r") as fd:
+                pool += [ s.strip() for s in fd if not s.startswith('%') ]
+        # a damaged 5' primer, a read from another run and a shuffled pool
+        pool[3] = pool[3][:4]+'T'+pool[3][6:]
+        pool.append('ACGT'*40)
+        shuffle(pool)
+
+        demux = Demultiplexer()
+        for n,(p5,p3) in pairs.items():
+            demux.add(n,p5,p3)
+        assert demux.assign('ACGT'*40) == None
+        streams = demux.split(pool)
+        for n,(p5,p3) in pairs.items():
+            rf = ReadDNAFile(in_fd=streams[n],primer5=p5,primer3=p3,fsmd_abbrev='FSMD')
+            assert rf.read(-1) == data[n]
+
 if __name__ == "__main__":
     unittest.main()
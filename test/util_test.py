@@ -41,6 +41,66 @@ class packetizedfile_py_test(unittest.TestCase):
             assert val == y
             y = y+1
 
+    def test_mapped_packetizedfile(self):
+        with open("out.bin","wb") as fd:
+            fd.write(bytes([ randint(0,255) for _ in range(1050) ]))
+        packetFile = ReadPacketizedFile("out.bin")
+        packetFile.packetSize = 100
+        mappedFile = MappedReadPacketizedFile("out.bin")
+        mappedFile.packetSize = 100
+        assert mappedFile.size == 1050
+        packets = [ p for p in packetFile ]
+        mapped = [ p for p in mappedFile ]
+        assert len(mapped) == 11 and isinstance(mapped[0],memoryview)
+        assert packets == [ bytes(p) for p in mapped ]
+        assert bytes(mappedFile[3]) == packetFile[3]
+        mapped = None
+        mappedFile.close()
+        os.remove("out.bin")
+
+
+    def test_sparse_packetizedfile(self):
+        out = SparseWritePacketizedFile("out.bin",1050,100,minKey=5)
+        keys = [ 15, 7, 5, 12, 9 ]
+        for k in keys:
+            out[k] = bytearray([k]*100)
+        assert not out.complete
+        assert out.getMissingKeys() == [6,8,10,11,13,14]
+        assert out.has_key(7) and not out.has_key(6)
+        assert out[15] == bytes([15]*50)
+        for k in out.getMissingKeys():
+            out[k] = bytearray([k]*100)
+        assert out.complete and not out.hasMissingKeys()
+        out.write()
+        out.close()
+        with open("out.bin","rb") as fd:
+            data = fd.read()
+        assert data == b''.join([ bytes([k]*100) for k in range(5,16) ])[0:1050]
+        os.remove("out.bin")
+
+        # decoders change packetSize after the stream is created
+        out = SparseWritePacketizedFile("out.bin",1050,10)
+        out.packetSize = 500
+        assert out.getMissingKeys() == [0,1,2]
+        for k in range(3):
+            out[k] = bytearray([k]*500)
+        assert out.complete and out[2] == bytes([2]*50)
+        out.close()
+        os.remove("out.bin")
+
+from dnastorage.util.bucketfile import BucketFile
+class bucketfile_py_test(unittest.TestCase):
+    """ test bucket file. """
+    def test_bucketfile(self):
+        bf = BucketFile(maxBuffered=7)
+        for i in range(100):
+            bf.append(i%5,i)
+        assert bf.keys() == [0,1,2,3,4]
+        assert 3 in bf and not (5 in bf)
+        for k in range(5):
+            assert bf.get(k) == list(range(k,100,5))
+        assert bf.get(5) == []
+        bf.close()
 
 from dnastorage.util.stats import stats
 class stats_py_test(unittest.TestCase):
@@ -58,6 +118,31 @@ class stats_py_test(unittest.TestCase):
         stats.unique("askdfjakjalk2",1)
         assert stats["askdfjakjalk2"]==1
 
-            
+import random
+import editdistance
+from dnastorage.util.approxmatch import ApproximateMatcher
+class approxmatch_py_test(unittest.TestCase):
+    """ test the bit-vector approximate matcher. """
+    def test_distances(self):
+        ''' compare against edit distances of every substring '''
+        for _ in range(100):
+            p = "".join([ random.choice('ACGT') for _ in range(random.randint(1,70)) ])
+            t = "".join([ random.choice('ACGT') for _ in range(random.randint(0,30)) ])
+            t = t + p[random.randint(0,5):] + t
+            m = ApproximateMatcher(p)
+            expected = [ min([ editdistance.eval(p,t[i:j+1]) for i in range(j+2) ]) for j in range(len(t)) ]
+            assert m.distances(t) == expected
+            anchored = [ editdistance.eval(p,t[:j+1]) for j in range(len(t)) ]
+            assert m.distances(t,anchored=True) == anchored
+
+    def test_find(self):
+        m = ApproximateMatcher('TAAAGGAAAAAG',maxDistance=2)
+        assert m.find('CCC'+'TAAAGGAAAAAG'+'CCC') == (0,3,15)
+        assert m.find_end('CCC'+'TAAACGAAAAAG'+'CCC') == (1,15)
+        assert m.find('CCC'+'TAAAGAAAAAG'+'CCC') == (1,3,14)
+        assert m.find_start('CCC'+'TAAAGGAAAATAAG'+'CCC') == (2,3)
+        assert m.find_end('CCC'+'TTTTGGAAAAAG'+'CCC') == (None,None)
+
+
 if __name__ == "__main__":
     unittest.main()